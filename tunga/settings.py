@@ -245,6 +245,10 @@ RQ_QUEUES = {
     'default': {
         'USE_REDIS_CACHE': 'default',
     },
+    # Slack deliveries wait for bursts and back off on rate limits, keep them off the default queue
+    'slack': {
+        'USE_REDIS_CACHE': 'default',
+    },
 }
 
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
@@ -423,6 +427,16 @@ SLACK_ATTACHMENT_COLOR_GREEN = '#4CAF50'
 SLACK_ATTACHMENT_COLOR_RED = '#FF0000'
 SLACK_ATTACHMENT_COLOR_BLUE = '#0078BD'
 
+SLACK_API_URL = 'https://slack.com/api/'
+SLACK_REQUEST_TIMEOUT = 10
+SLACK_DELIVERY_WINDOW = 3  # seconds, messages to the same channel within this window are merged
+SLACK_DELIVERY_MAX_ATTEMPTS = 5
+SLACK_DELIVERY_MAX_BACKOFF = 60  # seconds
+SLACK_DELIVERY_MAX_ATTACHMENTS = 20  # Slack truncates messages with more attachments
+SLACK_DIRECTORY_TIMEOUT = 24 * 60 * 60  # 1 day
+SLACK_DIRECTORY_REFRESH_INTERVAL = 60 * 60  # 1 hour, older directories are refreshed in the background
+SLACK_DIRECTORY_MISS_INTERVAL = 5 * 60  # 5 minutes, minimum time between refreshes triggered by unknown emails
+
 TUNGA_ICON_URL_150 = 'https://tunga.io/icons/Tunga_iconx150.png'
 TUNGA_ICON_SQUARE_URL_150 = 'https://tunga.io/icons/Tunga_squarex150.png'
 
@@ -445,6 +459,11 @@ PAYONEER_USERNAME = None
 PAYONEER_PASSWORD = None
 PAYONEER_PARTNER_ID = None
 PAYONEER_API_URL = None
+PAYONEER_MIN_PAYOUT = 20  # EUR
+PAYONEER_PAYOUT_ORDER = 'fifo'  # fifo or largest_first, order in which the balance is allocated to invoices
+PAYONEER_PAYOUT_MAX_WORKERS = 5
+PAYONEER_PAYOUT_LOCK_TIMEOUT = 30 * 60  # 30 minutes
+PAYONEER_REQUEST_TIMEOUT = 60  # seconds, must stay well below PAYONEER_PAYOUT_LOCK_TIMEOUT
 
 EXACT_DIVISION_CODE = None
 
@@ -466,6 +485,10 @@ EXACT_GL_ACCOUNT_CLIENT_FEE = None
 EXACT_GL_ACCOUNT_DEVELOPER_FEE = None
 EXACT_GL_ACCOUNT_TUNGA_FEE = None
 
+EXACT_RATE_LIMIT = 60  # API calls per minute, Exact's limit per company
+EXACT_SYNC_MAX_WORKERS = 4
+EXACT_ACCOUNT_CACHE_TIMEOUT = 24 * 60 * 60  # 1 day
+
 ALGOLIA_APP_ID = None
 ALGOLIA_SEARCH_KEY = None
 ALGOLIA_ADMIN_KEY = None
@@ -478,6 +501,18 @@ RAVEN_CONFIG = {
 
 UPLOAD_SIZE_LIMIT_MBS = 5 * 1024 * 1024  # 5 MB
 
+PDF_CACHE_ROOT = os.path.join(BASE_DIR, 'pdf_cache')
+PDF_CACHE_MAX_SIZE = 500 * 1024 * 1024  # 500 MB
+PDF_CACHE_EVICT_RATIO = 0.8  # Eviction frees space down to 80% of PDF_CACHE_MAX_SIZE
+PDF_CACHE_VERSION = 1  # Bump after changing pdf templates or styles to drop cached PDFs
+PDF_JOB_TIMEOUT = 60 * 60  # 1 hour, identical PDF requests within this window reuse the same job
+PDF_JOB_FILES_DIR = 'pdf_jobs'  # Job results directory in the default file storage, shared by all hosts
+
+NOTIFICATION_CACHE_TIMEOUT = 5 * 60  # 5 minutes, bounds staleness of the time based notification sections
+
+SCHEDULER_MAX_WORKERS = 5
+SCHEDULER_LOCK_TIMEOUT = 60 * 60  # 1 hour, a job's lock is released after this even if the host dies mid run
+
 try:
     from .env.local import *
 except ImportError:
@@ -43,7 +43,8 @@ from tunga_tasks.views import TimeEntryViewSet, \
     TaskPaymentViewSet, ParticipantPaymentViewSet, SkillsApprovalViewSet, SprintViewSet, TaskDocumentViewSet, TaskViewSet
 from tunga_uploads.views import UploadViewSet
 from tunga_utils.views import SkillViewSet, ContactRequestView, get_medium_posts, get_oembed_details, upload_file, \
-    find_by_legacy_id, InviteRequestView, weekly_report, hubspot_notification, calendly_notification, search_logger
+    find_by_legacy_id, InviteRequestView, weekly_report, hubspot_notification, calendly_notification, search_logger, \
+    pdf_job_status, pdf_job_download, scheduler_status
 
 api_schema_view = get_swagger_view(title='Tunga API')
 
@@ -156,6 +157,9 @@ urlpatterns = [
         password_reset_confirm, name='password_reset_confirm'),
     url(r'^api/migrate/(?P<model>\w+)/(?P<pk>\d+)/$', find_by_legacy_id, name="migrate"),
     url(r'^api/weekly-report/(?P<subject>\w+)/$', weekly_report, name="weekly-report"),
+    url(r'^api/pdf-jobs/(?P<job_id>\w+)/$', pdf_job_status, name="pdf-job-status"),
+    url(r'^api/pdf-jobs/(?P<job_id>\w+)/download/$', pdf_job_download, name="pdf-job-download"),
+    url(r'^api/scheduler/status/$', scheduler_status, name="scheduler-status"),
     url(r'^$', router.get_api_root_view(), name='backend-root'),
     url(r'^api/sitemap\.xml$', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
 ]
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from tunga_activity.models import ActivityReadLog, FieldChangeLog, NotificationReadLog
+from tunga_activity.models import ActivityReadLog, FieldChangeLog, NotificationReadLog, ActivitySearchIndex
 from tunga_utils.admin import ReadOnlyModelAdmin
 
 
@@ -18,3 +18,8 @@ class NotificationReadLogAdmin(ReadOnlyModelAdmin):
 @admin.register(FieldChangeLog)
 class FieldChangeLogAdmin(ReadOnlyModelAdmin):
     list_display = ('__str__', 'field', 'created_at')
+
+
+@admin.register(ActivitySearchIndex)
+class ActivitySearchIndexAdmin(ReadOnlyModelAdmin):
+    list_display = ('__str__', 'action', 'updated_at')
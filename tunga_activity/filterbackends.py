@@ -3,7 +3,9 @@ import datetime
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
+from rest_framework.filters import DjangoFilterBackend, SearchFilter
 
+from tunga_activity.utils import search_activity_index
 from tunga_payments.models import Invoice
 from tunga_utils.filterbackends import dont_filter_staff_or_superuser
 
@@ -22,3 +24,21 @@ class ActivityFilterBackend(DRYPermissionFiltersBase):
                 )
             )
         return queryset
+
+
+class ActivitySearchFilter(SearchFilter):
+    """
+    Searches message, comment and upload activity through the activity search index
+    instead of LIKE matches across the Action joins in search_fields.
+    The index holds the content of all the activity search_fields, so views only need to declare them.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = getattr(view, 'search_fields', None)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+        return queryset.filter(id__in=search_activity_index(search_terms).values('action_id'))
+
+
+ACTIVITY_FILTER_BACKENDS = (DjangoFilterBackend, ActivitySearchFilter)
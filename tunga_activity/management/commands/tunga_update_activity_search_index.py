@@ -0,0 +1,37 @@
+from actstream.models import Action
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+
+from tunga_activity.utils import index_activity
+from tunga_comments.models import Comment
+from tunga_messages.models import Message
+from tunga_utils.models import Upload
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', dest='full', default=False,
+            help='Reindex all message, comment and upload activity instead of only unindexed activity'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Build the activity search index for message, comment and upload activity
+        """
+        # command to run: python manage.py tunga_update_activity_search_index
+
+        actions = Action.objects.filter(
+            action_object_content_type__in=[
+                ContentType.objects.get_for_model(model) for model in [Message, Comment, Upload]
+            ]
+        ).order_by('id')
+        if not options['full']:
+            actions = actions.filter(search_index__isnull=True)
+
+        total = 0
+        for activity in actions.iterator():
+            index_activity(activity)
+            total += 1
+        print('Indexed {} activities'.format(total))
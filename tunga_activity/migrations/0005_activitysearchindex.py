@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2026-10-18 10:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX tunga_activity_search_content ON tunga_activity_activitysearchindex (content)'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX tunga_activity_search_content ON tunga_activity_activitysearchindex "
+            "USING GIN (to_tsvector('simple', content))"
+        )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute('DROP INDEX tunga_activity_search_content ON tunga_activity_activitysearchindex')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS tunga_activity_search_content')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('actstream', '0001_initial'),
+        ('tunga_activity', '0004_auto_20180912_0920'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivitySearchIndex',
+            fields=[
+                ('action', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='actstream.Action')),
+                ('object_id', models.PositiveIntegerField()),
+                ('content', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType', verbose_name='content type')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='activitysearchindex',
+            index_together=set([('content_type', 'object_id')]),
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+from actstream.models import Action
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
@@ -64,3 +65,19 @@ class FieldChangeLog(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+
+
+@python_2_unicode_compatible
+class ActivitySearchIndex(models.Model):
+    action = models.OneToOneField(Action, on_delete=models.CASCADE, primary_key=True, related_name='search_index')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, verbose_name=_('content type'))
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    content = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s #%s' % (self.content_type, self.object_id)
+
+    class Meta:
+        index_together = ('content_type', 'object_id')
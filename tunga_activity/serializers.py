@@ -1,9 +1,11 @@
 from actstream.models import Action
 from django.contrib.auth import get_user_model
+from django.db.models.manager import Manager
 from generic_relations.relations import GenericRelatedField
 from rest_framework import serializers
 
 from tunga_activity.models import ActivityReadLog, FieldChangeLog, NotificationReadLog
+from tunga_activity.utils import resolve_activity_objects
 from tunga_comments.models import Comment
 from tunga_comments.serializers import CommentSerializer
 from tunga_messages.models import Message, Channel, ChannelUser
@@ -63,6 +65,15 @@ class FieldChangeLogSerializer(serializers.ModelSerializer):
         return get_instance_type(obj.content_object)
 
 
+class ActivityListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        activities = list(data.all() if isinstance(data, Manager) else data)
+        # Resolve generic relations for the whole page at once, this primes each action's generic foreign key cache
+        resolve_activity_objects(activities)
+        return super(ActivityListSerializer, self).to_representation(activities)
+
+
 class SimpleActivitySerializer(serializers.ModelSerializer):
     action = serializers.CharField(source='verb')
     activity_type = serializers.SerializerMethodField()
@@ -97,6 +108,7 @@ class SimpleActivitySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Action
+        list_serializer_class = ActivityListSerializer
         exclude = (
             'verb', 'actor_object_id', 'actor_content_type', 'action_object_object_id', 'action_object_content_type',
             'target_object_id', 'target_content_type'
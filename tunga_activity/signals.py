@@ -1,12 +1,38 @@
 from actstream import action
-from django.db.models.signals import post_save
+from actstream.models import Action
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 from tunga_activity import verbs
 from tunga_activity.models import FieldChangeLog
+from tunga_activity.utils import index_activity, update_activity_search_index
+from tunga_comments.models import Comment
+from tunga_messages.models import Message
+from tunga_utils.models import Upload
 
 
 @receiver(post_save, sender=FieldChangeLog)
 def activity_handler_new_field_change(sender, instance, created, **kwargs):
     if created:
         action.send(instance.created_by, verb=verbs.CREATE, action_object=instance, target=instance.content_object)
+
+
+@receiver(post_save, sender=Action)
+def activity_handler_index_activity(sender, instance, created, **kwargs):
+    if created:
+        index_activity(instance)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Comment)
+def activity_handler_update_search_index(sender, instance, created, **kwargs):
+    if not created:
+        update_activity_search_index(instance)
+
+
+@receiver(post_save, sender=Upload)
+@receiver(post_delete, sender=Upload)
+def activity_handler_upload_search_index(sender, instance, **kwargs):
+    if isinstance(instance.content_object, (Message, Comment)):
+        # Attachment names are indexed with the message or comment
+        update_activity_search_index(instance.content_object)
@@ -0,0 +1,219 @@
+import os
+import re
+from collections import defaultdict
+
+from actstream.models import Action
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import connections
+
+from tunga_activity.models import FieldChangeLog, ActivitySearchIndex
+from tunga_comments.models import Comment
+from tunga_messages.models import Message, ChannelUser
+from tunga_payments.models import Invoice, Payment
+from tunga_projects.models import Document, Participation, ProgressEvent, ProgressReport
+from tunga_tasks.models import Task, Application, Participation as LegacyParticipation, \
+    ProgressReport as LegacyProgressReport
+from tunga_uploads.models import Upload
+from tunga_utils.models import Upload as LegacyUpload
+
+ACTIVITY_GENERIC_FIELDS = ('actor', 'action_object', 'target')
+
+
+def get_user_relations(prefix=None):
+    """
+    Relations read by the user serializers (avatar_url, company, tax_location, can_contribute)
+    """
+    def with_prefix(name):
+        return prefix and '{}__{}'.format(prefix, name) or name
+    return dict(
+        select_related=[with_prefix('userprofile'), with_prefix('user_company')],
+        prefetch_related=[with_prefix('socialaccount_set')]
+    )
+
+
+def merge_relations(*relations):
+    merged = dict(select_related=[], prefetch_related=[])
+    for item in relations:
+        merged['select_related'].extend(item.get('select_related', []))
+        merged['prefetch_related'].extend(item.get('prefetch_related', []))
+    return merged
+
+
+def get_activity_object_relations():
+    """
+    Relations loaded with each activity object type so the nested activity serializers don't query per row
+    """
+    return {
+        get_user_model(): get_user_relations(),
+        Message: merge_relations(
+            get_user_relations('user'), dict(select_related=['channel'], prefetch_related=['attachments'])
+        ),
+        ChannelUser: merge_relations(get_user_relations('user'), dict(select_related=['channel'])),
+        Comment: merge_relations(get_user_relations('user'), dict(prefetch_related=['uploads'])),
+        Task: get_user_relations('user'),
+        Application: merge_relations(get_user_relations('user'), dict(select_related=['task'])),
+        LegacyParticipation: merge_relations(
+            get_user_relations('user'), get_user_relations('created_by'), dict(select_related=['task'])
+        ),
+        LegacyProgressReport: merge_relations(
+            get_user_relations('user'), dict(select_related=['event'], prefetch_related=['uploads'])
+        ),
+        Document: merge_relations(get_user_relations('created_by'), dict(select_related=['project'])),
+        Participation: merge_relations(
+            get_user_relations('user'), get_user_relations('created_by'), dict(select_related=['project'])
+        ),
+        ProgressEvent: dict(select_related=['project']),
+        ProgressReport: merge_relations(get_user_relations('user'), dict(select_related=['event'])),
+        Invoice: merge_relations(get_user_relations('user'), dict(select_related=['project'])),
+        Payment: dict(select_related=['invoice']),
+        Upload: get_user_relations('user'),
+        FieldChangeLog: merge_relations(
+            get_user_relations('created_by'), dict(prefetch_related=['content_object'])
+        ),
+    }
+
+
+def get_activity_object_queryset(model):
+    queryset = model._default_manager.all()
+    relations = get_activity_object_relations().get(model, None)
+    if relations:
+        if relations['select_related']:
+            queryset = queryset.select_related(*relations['select_related'])
+        if relations['prefetch_related']:
+            queryset = queryset.prefetch_related(*relations['prefetch_related'])
+    return queryset
+
+
+def resolve_activity_objects(actions):
+    """
+    Loads the actors, action objects and targets of a page of actions with one query (plus prefetches) per type.
+    The generic foreign key caches of the actions are primed with the loaded objects.
+    :param actions: list of Action instances
+    :return: dict mapping (content_type_id, object_id) to the loaded object
+    """
+    ids_by_type = defaultdict(set)
+    for activity in actions:
+        for name in ACTIVITY_GENERIC_FIELDS:
+            field = getattr(Action, name)
+            content_type_id = getattr(activity, '{}_id'.format(field.ct_field))
+            object_id = getattr(activity, field.fk_field)
+            if content_type_id and object_id is not None:
+                ids_by_type[content_type_id].add(object_id)
+
+    resolved = dict()
+    for content_type_id, object_ids in ids_by_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            # Stale content type for a removed model
+            continue
+        pks = dict()
+        for object_id in object_ids:
+            try:
+                pks[model._meta.pk.to_python(object_id)] = object_id
+            except ValidationError:
+                continue
+        for pk, instance in get_activity_object_queryset(model).in_bulk(list(pks.keys())).items():
+            resolved[(content_type_id, str(pks.get(pk, pk)))] = instance
+
+    for activity in actions:
+        for name in ACTIVITY_GENERIC_FIELDS:
+            field = getattr(Action, name)
+            content_type_id = getattr(activity, '{}_id'.format(field.ct_field))
+            object_id = getattr(activity, field.fk_field)
+            if content_type_id and object_id is not None:
+                instance = resolved.get((content_type_id, str(object_id)), None)
+                if instance is not None:
+                    setattr(activity, field.cache_attr, instance)
+    return resolved
+
+
+def get_activity_search_content(instance):
+    """
+    Text indexed for a message, comment or (legacy) upload activity
+    """
+    if isinstance(instance, Message):
+        parts = [instance.body] + [os.path.basename(upload.file.name) for upload in instance.attachments.all()]
+    elif isinstance(instance, Comment):
+        parts = [instance.body] + [os.path.basename(upload.file.name) for upload in instance.uploads.all()]
+    elif isinstance(instance, LegacyUpload):
+        parts = [os.path.basename(instance.file.name)]
+    else:
+        return None
+    return '\n'.join([part for part in parts if part])
+
+
+def update_activity_search_index(instance):
+    """
+    (Re)indexes all actions whose action object is the given message, comment or upload
+    """
+    content = get_activity_search_content(instance)
+    if content is None:
+        return
+    content_type = ContentType.objects.get_for_model(instance)
+    action_ids = Action.objects.filter(
+        action_object_content_type=content_type, action_object_object_id=str(instance.id)
+    ).values_list('id', flat=True)
+    for action_id in action_ids:
+        ActivitySearchIndex.objects.update_or_create(
+            action_id=action_id, defaults=dict(content_type=content_type, object_id=instance.id, content=content)
+        )
+
+
+def index_activity(activity):
+    if activity.action_object_content_type_id is None:
+        return
+    model = ContentType.objects.get_for_id(activity.action_object_content_type_id).model_class()
+    if model not in [Message, Comment, LegacyUpload]:
+        return
+    action_object = activity.action_object
+    if action_object is None:
+        return
+    ActivitySearchIndex.objects.update_or_create(
+        action_id=activity.id, defaults=dict(
+            content_type_id=activity.action_object_content_type_id,
+            object_id=action_object.id,
+            content=get_activity_search_content(action_object)
+        )
+    )
+
+
+def get_search_tokens(search_terms):
+    tokens = []
+    for term in search_terms:
+        tokens.extend(re.findall(r'\w+', term, re.UNICODE))
+    return tokens
+
+
+def search_activity_index(search_terms, model=None):
+    """
+    Matches all search terms (as word prefixes) against the activity search index.
+    Uses the FULLTEXT index on MySQL and the GIN index on PostgreSQL.
+    :param search_terms: list of search terms
+    :param model: limit results to activity on this model (e.g Message)
+    :return: ActivitySearchIndex queryset, join back with .values('action_id') or .values('object_id')
+    """
+    queryset = ActivitySearchIndex.objects.all()
+    if model:
+        queryset = queryset.filter(content_type=ContentType.objects.get_for_model(model))
+
+    tokens = get_search_tokens(search_terms)
+    if not tokens:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'mysql':
+        queryset = queryset.extra(
+            where=['MATCH (content) AGAINST (%s IN BOOLEAN MODE)'],
+            params=[' '.join(['+{}*'.format(token) for token in tokens])]
+        )
+    elif vendor == 'postgresql':
+        queryset = queryset.extra(
+            where=["to_tsvector('simple', content) @@ to_tsquery('simple', %s)"],
+            params=[' & '.join(['{}:*'.format(token) for token in tokens])]
+        )
+    else:
+        for token in tokens:
+            queryset = queryset.filter(content__icontains=token)
+    return queryset
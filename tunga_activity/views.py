@@ -2,11 +2,11 @@ from actstream.models import Action
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
-from tunga_activity.filterbackends import ActivityFilterBackend
+from tunga_activity.filterbackends import ActivityFilterBackend, ACTIVITY_FILTER_BACKENDS
 from tunga_activity.filters import ActionFilter
 from tunga_activity.models import NotificationReadLog
 from tunga_activity.serializers import ActivitySerializer, NotificationReadLogSerializer
-from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
+from tunga_utils.pagination import KeysetPagination
 
 
 class ActionViewSet(viewsets.ReadOnlyModelViewSet):
@@ -17,7 +17,8 @@ class ActionViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ActivitySerializer
     permission_classes = [AllowAny]
     filter_class = ActionFilter
-    filter_backends = DEFAULT_FILTER_BACKENDS + (ActivityFilterBackend,)
+    filter_backends = ACTIVITY_FILTER_BACKENDS + (ActivityFilterBackend,)
+    pagination_class = KeysetPagination
     search_fields = (
         'comments__body', 'messages__body', 'uploads__file', 'messages__attachments__file', 'comments__uploads__file'
     )
@@ -1,13 +1,11 @@
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.aggregates import Count, Sum
-from django.db.models.expressions import When, Case, F
-from django.db.models.fields import IntegerField
 from django.db.models.query_utils import Q
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
 
 from tunga_auth.models import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
 from tunga_profiles.models import UserProfile
 from tunga_utils.constants import USER_TYPE_PROJECT_MANAGER, STATUS_INITIAL, STATUS_ACCEPTED
+from tunga_utils.skill_index import annotate_skill_matches, SKILL_INDEX_USERS
 
 
 def my_connections_q_filter(user):
@@ -37,41 +35,7 @@ class UserFilterBackend(DRYPermissionFiltersBase):
                 queryset = queryset.filter(type=USER_TYPE_PROJECT_MANAGER)
             else:
                 queryset = queryset.filter(type=USER_TYPE_PROJECT_OWNER)
-            queryset = queryset.annotate(
-                skills_count=Count('userprofile__skills')
-            ).annotate(
-                skills_rank=Case(
-                    When(
-                        skills_count__gte=3,
-                        then=3
-                    ),
-                    default='skills_count',
-                    output_field=IntegerField()
-                )
-            ).annotate(
-                task_count=Count('task_participants')
-            ).annotate(
-                task_rank=Case(
-                    When(
-                        task_count__gt=3,
-                        then=3
-                    ),
-                    default='task_count',
-                    output_field=IntegerField()
-                )
-            ).annotate(
-                total_rank=F('skills_rank') + F('task_rank')
-            ).annotate(
-                profile_rank=Case(
-                    When(
-                        ~Q(userprofile__bio='') &
-                        Q(userprofile__bio__isnull=False),
-                        then=2 + F('total_rank')
-                    ),
-                    default='total_rank',
-                    output_field=IntegerField()
-                )
-            ).order_by('-profile_rank', 'first_name', 'last_name')
+            queryset = queryset.order_by('-directory_rank', 'first_name', 'last_name')
         elif user_filter in ['team', 'my-project-owners', 'my-clients']:
             if user_filter in ['my-project-owners', 'my-clients']:
                 user_type = USER_TYPE_PROJECT_OWNER
@@ -86,22 +50,10 @@ class UserFilterBackend(DRYPermissionFiltersBase):
         elif user_filter == 'relevant':
             queryset = queryset.filter(type=USER_TYPE_DEVELOPER)
             try:
-                user_skills = request.user.userprofile.skills.all()
-                queryset = queryset.filter(userprofile__skills__in=user_skills)
-                when = []
-                for skill in user_skills:
-                    new_when = When(
-                            userprofile__skills=skill,
-                            then=1
-                        )
-                    when.append(new_when)
-                queryset = queryset.annotate(matches=Sum(
-                    Case(
-                        *when,
-                        default=0,
-                        output_field=IntegerField()
-                    )
-                )).order_by('-matches', 'first_name', 'last_name', '-date_joined')
+                user_skills = request.user.userprofile.skills.all().values_list('id', flat=True)
+                queryset = annotate_skill_matches(
+                    queryset, SKILL_INDEX_USERS, user_skills
+                ).order_by('-matches', 'first_name', 'last_name', '-date_joined')
             except (ObjectDoesNotExist, UserProfile.DoesNotExist):
                 return queryset.none()
         return queryset
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from tunga_auth.utils import flush_last_activity
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=500,
+            help='Number of users updated per statement'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Write buffered user last activity timestamps to the database.
+        """
+        # command to run: python manage.py tunga_flush_last_activity
+
+        total = flush_last_activity(batch_size=options['batch_size'])
+        print('Updated last activity for {} users'.format(total))
@@ -0,0 +1,18 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Backfill stored directory and profile ranks for all users.
+        """
+        # command to run: python manage.py tunga_update_profile_ranks
+
+        users = get_user_model().objects.select_related('userprofile').order_by('id')
+        total = 0
+        for user in users.iterator():
+            user.update_profile_rank()
+            total += 1
+        print('Updated profile rank for {} users'.format(total))
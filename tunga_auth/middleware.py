@@ -1,6 +1,7 @@
-import datetime
-
 from django.utils.deprecation import MiddlewareMixin
+from redis.exceptions import RedisError
+
+from tunga_auth.utils import record_last_activity
 
 
 class UserLastActivityMiddleware(MiddlewareMixin):
@@ -8,8 +9,8 @@ class UserLastActivityMiddleware(MiddlewareMixin):
     def process_response(self, request, response):
         try:
             if request.user.is_authenticated():
-                request.user.last_activity_at = datetime.datetime.utcnow()
-                request.user.save()
-        except AttributeError:
+                # Buffered in redis and written in bulk by tunga_flush_last_activity
+                record_last_activity(request.user.id)
+        except (AttributeError, RedisError):
             pass
         return response
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2026-10-18 09:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_auth', '0020_emailvisitor_via_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tungauser',
+            name='profile_rank',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+    ]
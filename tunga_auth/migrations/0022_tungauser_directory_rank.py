@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2026-10-18 21:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_auth', '0021_tungauser_profile_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tungauser',
+            name='directory_rank',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name='tungauser',
+            name='profile_rank',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -57,6 +57,8 @@ class TungaUser(AbstractUser):
         default=STATUS_INITIAL
     )
     invoice_email = models.EmailField(blank=True, null=True)
+    directory_rank = models.IntegerField(default=0, db_index=True)
+    profile_rank = models.FloatField(default=0)
 
     class Meta(AbstractUser.Meta):
         unique_together = ('email',)
@@ -225,8 +227,17 @@ class TungaUser(AbstractUser):
         else:
             return 'world'
 
-    @property
-    def profile_rank(self):
+    def calculate_directory_rank(self):
+        # Developer directory order: skills (max 3) + task participation (max 3) + 2 for a bio
+        total_score = min(self.task_participants.all().count(), 3)
+        if self.profile:
+            total_score += min(self.profile.skills.all().count(), 3)
+            if self.profile.bio:
+                total_score += 2
+        return total_score
+
+    def calculate_profile_rank(self):
+        # Completeness and experience score
         total_score = 0
         total_score += sum([item.status == STATUS_APPROVED and 0.3 or 0.15 for item in
                             self.project_participation.filter(status__in=[STATUS_INITIAL, STATUS_APPROVED])])
@@ -242,6 +253,15 @@ class TungaUser(AbstractUser):
         total_score += self.education_set.all().count() * 0.04
         return total_score
 
+    def update_profile_rank(self):
+        self.directory_rank = self.calculate_directory_rank()
+        self.profile_rank = self.calculate_profile_rank()
+        # Update without save() to avoid re-triggering post_save handlers
+        TungaUser.objects.filter(id=self.id).update(
+            directory_rank=self.directory_rank, profile_rank=self.profile_rank
+        )
+        return self.profile_rank
+
 
 @python_2_unicode_compatible
 class EmailVisitor(models.Model):
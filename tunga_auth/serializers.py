@@ -7,6 +7,7 @@ from allauth.account.models import EmailAddress
 from django.contrib.auth import get_user_model, login
 from django.core.validators import EmailValidator
 from django.db.models.aggregates import Avg
+from django.db.models.manager import Manager
 from django.db.models.query_utils import Q
 from django.utils import six
 from django.utils.encoding import force_text
@@ -18,6 +19,7 @@ from rest_framework.exceptions import ValidationError
 
 from tunga_auth.forms import TungaPasswordResetForm
 from tunga_auth.models import USER_TYPE_CHOICES, EmailVisitor
+from tunga_auth.utils import get_last_activity_at, get_last_activity_at_map
 from tunga_profiles.notifications import send_developer_invitation_accepted_email
 from tunga_utils.constants import USER_TYPE_DEVELOPER, STATUS_REJECTED, STATUS_INITIAL, STATUS_ACCEPTED
 from tunga_profiles.models import Connection, DeveloperApplication, UserProfile, DeveloperInvitation, Company
@@ -29,6 +31,15 @@ from tunga_utils.serializers import SimpleProfileSerializer, SimpleUserSerialize
 from tunga_utils.validators import validate_email, validate_username
 
 
+class UserListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, Manager) else data)
+        # Read the whole page's buffered last activity at once, UserSerializer picks it up from the context
+        self.context.setdefault('last_activity_at', dict()).update(get_last_activity_at_map(users))
+        return super(UserListSerializer, self).to_representation(users)
+
+
 class UserSerializer(NestedModelSerializer, SimpleUserSerializer, GetCurrentUserAnnotatedSerializerMixin):
     display_name = serializers.CharField(read_only=True, required=False)
     display_type = serializers.CharField(read_only=True, required=False)
@@ -50,14 +61,17 @@ class UserSerializer(NestedModelSerializer, SimpleUserSerializer, GetCurrentUser
     avatar_url = serializers.URLField(read_only=True, required=False)
     exact_code = serializers.CharField(read_only=True, required=False)
     tax_location = serializers.CharField(read_only=True, required=False)
+    last_activity_at = serializers.SerializerMethodField(read_only=True, required=False)
 
     class Meta:
         model = get_user_model()
         exclude = ('password', 'is_superuser', 'groups', 'user_permissions', 'is_active')
         read_only_fields = (
             # 'username', 'email',
-            'date_joined', 'last_login', 'is_staff', 'payoneer_signup_url', 'payoneer_status'
+            'date_joined', 'last_login', 'is_staff', 'payoneer_signup_url', 'payoneer_status',
+            'directory_rank', 'profile_rank'
         )
+        list_serializer_class = UserListSerializer
 
     def validate_username(self, attrs):
         if self.context and self.context.get('request', None):
@@ -84,6 +98,14 @@ class UserSerializer(NestedModelSerializer, SimpleUserSerializer, GetCurrentUser
                 setattr(company, key, value)
             company.save()
 
+    def get_last_activity_at(self, obj):
+        last_activity_at_map = self.context.get('last_activity_at', dict())
+        if obj.id in last_activity_at_map:
+            last_activity_at = last_activity_at_map[obj.id]
+        else:
+            last_activity_at = get_last_activity_at(obj)
+        return last_activity_at and serializers.DateTimeField().to_representation(last_activity_at) or None
+
     def get_can_connect(self, obj):
         current_user = self.get_current_user()
         if current_user:
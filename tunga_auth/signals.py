@@ -1,14 +1,18 @@
 from allauth.account.models import EmailAddress
 from allauth.account.signals import user_signed_up
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed, post_init
 from django.dispatch.dispatcher import receiver
 
 from tunga_auth.models import EmailVisitor
 from tunga_auth.notifications import send_new_user_joined_email, send_new_user_password_email
 from tunga_auth.tasks import sync_hubspot_contact, sync_hubspot_email
+from tunga_profiles.models import UserProfile, Work, Education
+from tunga_projects.models import Participation as ProjectParticipation
+from tunga_tasks.models import Participation as TaskParticipation
 from tunga_utils import algolia_utils
 from tunga_utils.constants import USER_TYPE_PROJECT_OWNER, USER_SOURCE_MANUAL
+from tunga_utils.pdf_utils import invalidate_pdf_cache, get_pdf_cache_scope
 from tunga_utils.serializers import SearchUserSerializer
 
 
@@ -30,6 +34,114 @@ def activity_handler_new_user(sender, instance, created, **kwargs):
             algolia_utils.add_objects([SearchUserSerializer(instance).data])
 
 
+# Fields on the user and profile whose values feed into the stored ranks (only their truthiness counts)
+PROFILE_RANK_FIELDS = {
+    get_user_model(): ('first_name', 'last_name', 'email'),
+    UserProfile: ('bio', 'country', 'city_id', 'street', 'plot_number', 'postal_code', 'id_document'),
+}
+
+
+def get_profile_rank_inputs(sender, instance):
+    return tuple([bool(getattr(instance, field, None)) for field in PROFILE_RANK_FIELDS[sender]])
+
+
+def has_profile_rank_inputs_changed(sender, instance):
+    initial_inputs = getattr(instance, '_profile_rank_inputs', None)
+    current_inputs = get_profile_rank_inputs(sender, instance)
+    instance._profile_rank_inputs = current_inputs
+    return initial_inputs != current_inputs
+
+
+@receiver(post_init, sender=get_user_model())
+@receiver(post_init, sender=UserProfile)
+def activity_handler_profile_rank_init(sender, instance, **kwargs):
+    if instance.pk and not instance.get_deferred_fields():
+        # Snapshot loaded rank inputs so that saves which don't change them skip the rank update
+        instance._profile_rank_inputs = get_profile_rank_inputs(sender, instance)
+
+
+@receiver(post_save, sender=get_user_model())
+def activity_handler_user_profile_rank(sender, instance, created, **kwargs):
+    if has_profile_rank_inputs_changed(sender, instance) or created:
+        instance.update_profile_rank()
+
+
+def update_related_user_profile_rank(instance):
+    user_id = getattr(instance, 'user_id', None)
+    if user_id:
+        user = get_user_model().objects.filter(id=user_id).first()
+        if user:
+            user.update_profile_rank()
+
+
+@receiver(post_save, sender=UserProfile)
+def activity_handler_profile_rank_profile_saved(sender, instance, created, **kwargs):
+    if has_profile_rank_inputs_changed(sender, instance) or created:
+        update_related_user_profile_rank(instance)
+
+
+@receiver(post_save, sender=Work)
+@receiver(post_save, sender=Education)
+@receiver(post_save, sender=TaskParticipation)
+def activity_handler_profile_rank_source_created(sender, instance, created, **kwargs):
+    # Only the number of these rows counts towards the ranks
+    if created:
+        update_related_user_profile_rank(instance)
+
+
+@receiver(post_save, sender=ProjectParticipation)
+def activity_handler_profile_rank_project_participation_saved(sender, instance, **kwargs):
+    update_related_user_profile_rank(instance)
+
+
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_delete, sender=Work)
+@receiver(post_delete, sender=Education)
+@receiver(post_delete, sender=TaskParticipation)
+@receiver(post_delete, sender=ProjectParticipation)
+def activity_handler_profile_rank_source_deleted(sender, instance, **kwargs):
+    update_related_user_profile_rank(instance)
+
+
+@receiver(m2m_changed, sender=UserProfile._meta.get_field('skills').remote_field.through)
+def activity_handler_profile_rank_skills_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # pk_set is None on clear, remember the skill's profiles before their links are removed
+        skills_field = UserProfile._meta.get_field('skills')
+        instance._profile_rank_profile_ids = list(
+            sender.objects.filter(
+                **{skills_field.m2m_reverse_field_name(): instance}
+            ).values_list('{}_id'.format(skills_field.m2m_field_name()), flat=True)
+        )
+        return
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse:
+        # instance is a Skill, pk_set holds the affected profiles
+        if action == 'post_clear':
+            pk_set = getattr(instance, '_profile_rank_profile_ids', None)
+        users = get_user_model().objects.filter(userprofile__id__in=pk_set or [])
+    else:
+        users = get_user_model().objects.filter(userprofile__id=instance.id)
+    for user in users:
+        user.update_profile_rank()
+
+
+@receiver(post_save, sender=get_user_model())
+def activity_handler_user_pdf_cache(sender, instance, **kwargs):
+    invalidate_pdf_cache(get_pdf_cache_scope('profile', instance.id))
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_save, sender=Work)
+@receiver(post_save, sender=Education)
+@receiver(post_delete, sender=Work)
+@receiver(post_delete, sender=Education)
+def activity_handler_profile_pdf_cache(sender, instance, **kwargs):
+    if instance.user_id:
+        invalidate_pdf_cache(get_pdf_cache_scope('profile', instance.user_id))
+
+
 @receiver(user_signed_up)
 def activity_handler_new_signup(request, user, **kwargs):
     send_new_user_joined_email.delay(user.id)
@@ -1,3 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+from tunga_profiles.models import UserProfile, Work, Skill
+from tunga_utils.constants import USER_TYPE_DEVELOPER
+
+
+class ProfileRankTestCase(TestCase):
+
+    def setUp(self):
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret',
+            **dict(type=USER_TYPE_DEVELOPER)
+        )
+
+    def get_ranks(self):
+        user = get_user_model().objects.get(id=self.developer.id)
+        return user.directory_rank, user.profile_rank
+
+    def test_ranks_are_stored_separately(self):
+        profile = UserProfile.objects.create(user=self.developer, bio='Python developer', street='Kampala Road')
+        profile.skills = 'Django, Python'
+        profile.save()
+
+        directory_rank, profile_rank = self.get_ranks()
+        # 2 skills + 2 for the bio
+        self.assertEqual(directory_rank, 4)
+        # email and street
+        self.assertAlmostEqual(profile_rank, 0.2)
+
+        Work.objects.create(
+            user=self.developer, company='Tunga', position='Developer', start_month=1, start_year=2018
+        )
+        directory_rank, profile_rank = self.get_ranks()
+        self.assertEqual(directory_rank, 4)
+        self.assertAlmostEqual(profile_rank, 0.22)
+
+    def test_user_save_updates_rank_only_when_inputs_change(self):
+        get_user_model().objects.filter(id=self.developer.id).update(profile_rank=5)
+
+        developer = get_user_model().objects.get(id=self.developer.id)
+        developer.last_login = None
+        developer.save()
+        self.assertEqual(self.get_ranks()[1], 5)
+
+        developer.first_name = 'David'
+        developer.save()
+        self.assertAlmostEqual(self.get_ranks()[1], 0.2)
+
+    def test_skill_clear_updates_profile_ranks(self):
+        profile = UserProfile.objects.create(user=self.developer)
+        profile.skills = 'Django, Python, React, Go'
+        profile.save()
+        self.assertEqual(self.get_ranks()[0], 3)
+
+        Skill.objects.get(name='Django').userprofile_set.clear()
+        Skill.objects.get(name='Python').userprofile_set.clear()
+        self.assertEqual(self.get_ranks()[0], 2)
@@ -1,10 +1,21 @@
+import datetime
+
 from allauth.socialaccount.providers.github.provider import GitHubProvider
+from dateutil.parser import parse
+from django.contrib.auth import get_user_model
+from django.db.models.expressions import Case, When, Value
+from django.db.models.fields import DateTimeField
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError, ResponseError
 
 from tunga.settings import SOCIAL_CONNECT_USER_TYPE, SOCIAL_CONNECT_TASK, SOCIAL_CONNECT_CALLBACK, SOCIAL_CONNECT_NEXT, \
     SOCIAL_CONNECT_PROJECT
 from tunga_utils.constants import SESSION_VISITOR_EMAIL, USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER, \
     APP_INTEGRATION_PROVIDER_SLACK, APP_INTEGRATION_PROVIDER_HARVEST
 
+LAST_ACTIVITY_BUFFER_KEY = 'user_last_activity'
+LAST_ACTIVITY_FLUSH_KEY = 'user_last_activity:flushing'
+
 
 def create_email_visitor_session(request, email):
     request.session[SESSION_VISITOR_EMAIL] = email
@@ -85,3 +96,82 @@ def get_request_project(request):
         return int(request.GET.get(SOCIAL_CONNECT_PROJECT))
     except:
         return None
+
+
+def get_last_activity_connection():
+    return get_redis_connection('default')
+
+
+def record_last_activity(user_id, timestamp=None):
+    """
+    Buffers the user's last activity in redis, it's written to the database by flush_last_activity
+    """
+    timestamp = timestamp or datetime.datetime.utcnow()
+    get_last_activity_connection().hset(LAST_ACTIVITY_BUFFER_KEY, user_id, timestamp.isoformat())
+
+
+def get_last_activity_at_map(users):
+    """
+    Reads the buffered last activity of several users with one HMGET per hash in a single round trip
+    :return: dict of user id to last activity timestamp
+    """
+    users = list(users)
+    user_ids = [user.id for user in users]
+    buffered = flushing = [None] * len(user_ids)
+    if user_ids:
+        try:
+            pipe = get_last_activity_connection().pipeline(transaction=False)
+            pipe.hmget(LAST_ACTIVITY_BUFFER_KEY, user_ids)
+            pipe.hmget(LAST_ACTIVITY_FLUSH_KEY, user_ids)
+            buffered, flushing = pipe.execute()
+        except RedisError:
+            pass
+
+    last_activity_at_map = dict()
+    for user, buffered_timestamp, flushing_timestamp in zip(users, buffered, flushing):
+        timestamp = buffered_timestamp or flushing_timestamp
+        last_activity_at_map[user.id] = timestamp and parse(timestamp) or user.last_activity_at
+    return last_activity_at_map
+
+
+def get_last_activity_at(user):
+    """
+    user.last_activity_at is only written periodically, the freshest value is still in the redis buffer
+    """
+    return get_last_activity_at_map([user])[user.id]
+
+
+def flush_last_activity(batch_size=500):
+    """
+    Writes buffered last activity timestamps to the database with one UPDATE per batch of users
+    :return: number of users updated
+    """
+    connection = get_last_activity_connection()
+    if not connection.exists(LAST_ACTIVITY_FLUSH_KEY):
+        # A leftover flush key means the last flush failed, retry it before taking new activity
+        try:
+            connection.rename(LAST_ACTIVITY_BUFFER_KEY, LAST_ACTIVITY_FLUSH_KEY)
+        except ResponseError:
+            # Nothing buffered
+            return 0
+
+    buffered = connection.hgetall(LAST_ACTIVITY_FLUSH_KEY)
+    timestamps = dict()
+    for user_id, timestamp in buffered.items():
+        try:
+            timestamps[int(user_id)] = parse(timestamp)
+        except (ValueError, TypeError):
+            continue
+
+    user_ids = sorted(timestamps.keys())
+    for i in range(0, len(user_ids), batch_size):
+        batch = user_ids[i:i + batch_size]
+        get_user_model().objects.filter(id__in=batch).update(
+            last_activity_at=Case(
+                *[When(id=user_id, then=Value(timestamps[user_id])) for user_id in batch],
+                output_field=DateTimeField()
+            )
+        )
+
+    connection.delete(LAST_ACTIVITY_FLUSH_KEY)
+    return len(user_ids)
@@ -25,7 +25,6 @@ from rest_framework.renderers import StaticHTMLRenderer
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_401_UNAUTHORIZED
 from slacker import Slacker
-from weasyprint import HTML
 
 from tunga import settings
 from tunga.settings import GITHUB_SCOPES, COINBASE_CLIENT_ID, COINBASE_CLIENT_SECRET, SOCIAL_CONNECT_ACTION, \
@@ -48,6 +47,7 @@ from tunga_utils.constants import BTC_WALLET_PROVIDER_COINBASE, PAYMENT_METHOD_B
     STATUS_DECLINED, STATUS_PENDING, STATUS_INITIATED
 from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
 from tunga_utils.helpers import get_social_token
+from tunga_utils.pdf_utils import render_pdf, get_pdf_cache_scope
 from tunga_utils.serializers import SimpleUserSerializer
 
 
@@ -193,7 +193,7 @@ class UserViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.Lis
         if request.accepted_renderer.format == 'html':
             return HttpResponse(rendered_html)
 
-        pdf_file = HTML(string=rendered_html, encoding='utf-8').write_pdf()
+        pdf_file = render_pdf(rendered_html, scope=get_pdf_cache_scope('profile', user.id))
         http_response = HttpResponse(pdf_file, content_type='application/pdf')
         http_response['Content-Disposition'] = 'filename="developer_profile.pdf"'
         return http_response
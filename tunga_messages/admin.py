@@ -6,7 +6,7 @@ from tunga_messages.models import Message, Channel, ChannelUser
 class ChannelUserInline(admin.TabularInline):
     model = ChannelUser
     #exclude = ('last_read', 'read_at')
-    readonly_fields = ('last_read', 'last_email_at')
+    readonly_fields = ('last_read', 'last_email_at', 'unread_count', 'last_message_id')
     extra = 1
 
 
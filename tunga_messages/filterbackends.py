@@ -1,6 +1,13 @@
+import operator
+from functools import reduce
+
 from django.db.models.query_utils import Q
+from django.utils import six
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
+from rest_framework.filters import SearchFilter
 
+from tunga_activity.utils import search_activity_index
+from tunga_messages.models import Message, ChannelUser
 from tunga_messages.utils import all_messages_q_filter
 from tunga_utils.constants import CHANNEL_TYPE_SUPPORT, CHANNEL_TYPE_DEVELOPER
 
@@ -9,16 +16,18 @@ class ChannelFilterBackend(DRYPermissionFiltersBase):
 
     def filter_list_queryset(self, request, queryset, view):
         if request.user.is_authenticated():
+            # Subquery rather than a join so channels aren't repeated once per participant
+            user_channels_q = Q(id__in=ChannelUser.objects.filter(user=request.user).values('channel_id'))
             if request.user.is_staff or request.user.is_superuser:
                 queryset = queryset.filter(
-                    Q(channeluser__user=request.user) | Q(type=CHANNEL_TYPE_SUPPORT) | Q(type=CHANNEL_TYPE_DEVELOPER)
+                    user_channels_q | Q(type=CHANNEL_TYPE_SUPPORT) | Q(type=CHANNEL_TYPE_DEVELOPER)
                 )
             elif request.user.is_developer:
                 queryset = queryset.filter(
-                    Q(channeluser__user=request.user) | Q(type=CHANNEL_TYPE_DEVELOPER)
+                    user_channels_q | Q(type=CHANNEL_TYPE_DEVELOPER)
                 )
             else:
-                queryset = queryset.filter(channeluser__user=request.user)
+                queryset = queryset.filter(user_channels_q)
             if not request.query_params.get('type', None):
                 queryset = queryset.exclude(type=CHANNEL_TYPE_SUPPORT)
             return queryset
@@ -31,3 +40,32 @@ class MessageFilterBackend(DRYPermissionFiltersBase):
         if request.user.is_authenticated():
             return queryset.filter(all_messages_q_filter(request.user)).distinct()
         return queryset.none()
+
+
+class MessageSearchFilter(SearchFilter):
+    """
+    Searches message bodies and attachment names through the activity search index,
+    the view's other search_fields are matched with SearchFilter lookups.
+    Like SearchFilter, every term has to match at least one of the search fields.
+    """
+    index_fields = ('body',)
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = getattr(view, 'search_fields', None)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        orm_lookups = [
+            self.construct_search(six.text_type(search_field))
+            for search_field in search_fields if search_field not in self.index_fields
+        ]
+        use_index = len(orm_lookups) < len(search_fields)
+
+        conditions = []
+        for search_term in search_terms:
+            queries = [Q(**{orm_lookup: search_term}) for orm_lookup in orm_lookups]
+            if use_index:
+                queries.append(Q(id__in=search_activity_index([search_term], model=Message).values('object_id')))
+            conditions.append(reduce(operator.or_, queries))
+        return queryset.filter(reduce(operator.and_, conditions))
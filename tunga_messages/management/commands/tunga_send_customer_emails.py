@@ -5,6 +5,7 @@ import datetime
 from actstream.models import Action
 from dateutil.relativedelta import relativedelta
 from django.contrib.contenttypes.models import ContentType
+from django.core.mail import get_connection
 from django.core.management.base import BaseCommand
 from django.db.models.aggregates import Sum, Max
 from django.db.models.expressions import Case, When, F
@@ -16,7 +17,7 @@ from tunga_activity import verbs
 from tunga_messages.models import Channel
 from tunga_profiles.models import Inquirer
 from tunga_utils.constants import CHANNEL_TYPE_SUPPORT
-from tunga_utils.emails import send_mail
+from tunga_utils.emails import send_templated_mail_batch
 
 
 class Command(BaseCommand):
@@ -46,6 +47,8 @@ class Command(BaseCommand):
             )
         ), latest_message=Max('action_targets__id')).filter(new_messages__gt=0)
 
+        channels = []
+        recipients = []
         for channel in customer_channels:
             customer = channel.content_object
             if customer.email:
@@ -64,7 +67,17 @@ class Command(BaseCommand):
                         'messages': messages,
                         'channel_url': '%s/customer/help/%s/' % (TUNGA_URL, channel.id)
                     }
+                    channels.append(channel)
+                    recipients.append((subject, to, ctx, dict()))
 
-                    if send_mail(subject, 'tunga/email/unread_help_messages', to, ctx):
-                        channel.last_read = channel.latest_message
-                        channel.save()
+        # One SMTP connection for the whole run, templates and styles are loaded once per batch
+        connection = get_connection()
+        try:
+            results = send_templated_mail_batch('tunga/email/unread_help_messages', recipients, connection=connection)
+        finally:
+            connection.close()
+
+        for channel, is_sent in zip(channels, results):
+            if is_sent:
+                channel.last_read = channel.latest_message
+                channel.save()
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import json
+from collections import defaultdict
 
+from actstream.models import Action
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.mail import get_connection
 from django.core.management.base import BaseCommand
 from django.db.models.aggregates import Sum
 from django.db.models.expressions import Case, When, F
@@ -12,13 +18,22 @@ from django.db.models.query_utils import Q
 
 from tunga.settings import TUNGA_URL
 from tunga_activity import verbs
-from tunga_messages.models import ChannelUser
+from tunga_messages.models import ChannelUser, Channel
 from tunga_utils.constants import CHANNEL_TYPE_DIRECT
-from tunga_utils.emails import send_mail
+from tunga_utils.emails import send_templated_mail_batch
+from tunga_utils.models import SiteMeta
+
+MESSAGE_EMAILS_STATE_KEY = 'message_emails_state'
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', dest='full', default=False,
+            help='Rescan all channel activity instead of only activity since the last run'
+        )
+
     def handle(self, *args, **options):
         """
         Send new message notifications
@@ -27,6 +42,99 @@ class Command(BaseCommand):
         utc_now = datetime.datetime.utcnow()
         min_date = utc_now - relativedelta(minutes=15)  # 15 minute window to read new messages
         min_last_email_date = utc_now - relativedelta(hours=3)  # Limit to 1 email every 3 hours per channel
+
+        # One SMTP connection for the whole run
+        self.connection = get_connection()
+        try:
+            state = self.get_state()
+            if options['full'] or state is None:
+                self.send_full_scan_emails(min_date, min_last_email_date)
+                latest_action = self.get_channel_message_actions().filter(
+                    timestamp__lte=min_date
+                ).order_by('-id').first()
+                state = dict(cursor=latest_action and latest_action.id or 0, pending=dict())
+            else:
+                state = self.send_incremental_emails(state, min_date, min_last_email_date)
+            self.save_state(state)
+        finally:
+            self.connection.close()
+
+    def get_state(self):
+        """
+        :return: dict with the last processed action id (cursor) and unsent action ids of throttled channel users
+        """
+        try:
+            return json.loads(SiteMeta.objects.get(meta_key=MESSAGE_EMAILS_STATE_KEY).meta_value)
+        except (SiteMeta.DoesNotExist, ValueError):
+            return None
+
+    def save_state(self, state):
+        SiteMeta.objects.update_or_create(
+            meta_key=MESSAGE_EMAILS_STATE_KEY, defaults=dict(meta_value=json.dumps(state))
+        )
+
+    def get_channel_message_actions(self):
+        return Action.objects.filter(
+            target_content_type=ContentType.objects.get_for_model(Channel),
+            verb__in=[verbs.SEND, verbs.UPLOAD]
+        )
+
+    def send_incremental_emails(self, state, min_date, min_last_email_date):
+        cursor = state.get('cursor', 0)
+        pending = dict(
+            (int(channel_user_id), action_ids) for channel_user_id, action_ids in state.get('pending', dict()).items()
+        )
+
+        # Only actions older than the read window, stopping at the first newer one so the cursor stays contiguous
+        new_actions = list()
+        for action in self.get_channel_message_actions().filter(id__gt=cursor).order_by('id').values(
+                'id', 'target_object_id', 'actor_content_type_id', 'actor_object_id', 'timestamp'):
+            if action['timestamp'] > min_date:
+                break
+            new_actions.append(action)
+            cursor = action['id']
+
+        channel_actions = defaultdict(list)
+        for action in new_actions:
+            channel_actions[int(action['target_object_id'])].append(action)
+
+        user_content_type_id = ContentType.objects.get_for_model(get_user_model()).id
+        user_channels = ChannelUser.objects.filter(
+            Q(channel_id__in=list(channel_actions.keys())) | Q(id__in=list(pending.keys()))
+        ).select_related('channel', 'user')
+
+        next_pending = dict()
+        email_channels = []
+        for user_channel in user_channels:
+            action_ids = set(pending.get(user_channel.id, []))
+            for action in channel_actions.get(user_channel.channel_id, []):
+                if action['actor_content_type_id'] == user_content_type_id and \
+                        str(action['actor_object_id']) == str(user_channel.user_id):
+                    # Users don't get notified about their own messages
+                    continue
+                if user_channel.last_email_at and action['timestamp'] <= user_channel.last_email_at:
+                    continue
+                action_ids.add(action['id'])
+
+            action_ids = [action_id for action_id in action_ids if action_id > user_channel.last_read]
+            if not action_ids:
+                continue
+
+            if user_channel.last_email_at and user_channel.last_email_at >= min_last_email_date:
+                # Throttled, keep the messages for a later run
+                next_pending[user_channel.id] = sorted(action_ids)
+                continue
+
+            user_channel.new_messages = len(action_ids)
+            user_channel.action_ids = sorted(action_ids)
+            email_channels.append(user_channel)
+
+        for user_channel, is_sent in zip(email_channels, self.send_channel_emails(email_channels)):
+            if not is_sent:
+                next_pending[user_channel.id] = user_channel.action_ids
+        return dict(cursor=cursor, pending=next_pending)
+
+    def send_full_scan_emails(self, min_date, min_last_email_date):
         commission_date = parse('2016-08-08 00:00:00')  # Don't notify about events before the commissioning date
 
         user_channels = ChannelUser.objects.filter(
@@ -48,26 +156,44 @@ class Command(BaseCommand):
             )
         )).filter(new_messages__gt=0)
 
-        for user_channel in user_channels:
-            channel_name = user_channel.channel.get_channel_display_name(user_channel.user)
-
-            to = [user_channel.user.email]
-            if user_channel.channel.type == CHANNEL_TYPE_DIRECT:
-                conversation_subject = "New message{} from {}".format(
-                    user_channel.new_messages == 1 and '' or 's',
-                    channel_name
-                )
-            else:
-                conversation_subject = "Conversation: {}".format(channel_name)
-            subject = conversation_subject
-            ctx = {
-                'receiver': user_channel.user,
-                'new_messages': user_channel.new_messages,
-                'channel_name': channel_name,
-                'channel': user_channel.channel,
-                'channel_url': '%s/conversation/%s/' % (TUNGA_URL, user_channel.channel.id)
-            }
-
-            if send_mail(subject, 'tunga/email/unread_channel_messages', to, ctx):
+        self.send_channel_emails(list(user_channels))
+
+    def send_channel_emails(self, user_channels):
+        """
+        :return: list of booleans in the same order as user_channels, whether each email was sent
+        """
+        results = send_templated_mail_batch(
+            'tunga/email/unread_channel_messages',
+            [self.get_channel_email(user_channel) for user_channel in user_channels],
+            connection=self.connection
+        )
+        for user_channel, is_sent in zip(user_channels, results):
+            if is_sent:
                 user_channel.last_email_at = datetime.datetime.utcnow()
-                user_channel.save()
+                # Only touch last_email_at so concurrent unread counter updates aren't overwritten
+                user_channel.save(update_fields=['last_email_at'])
+        return results
+
+    def get_channel_email(self, user_channel):
+        """
+        :return: (subject, to_emails, context, kwargs) tuple for send_templated_mail_batch
+        """
+        channel_name = user_channel.channel.get_channel_display_name(user_channel.user)
+
+        to = [user_channel.user.email]
+        if user_channel.channel.type == CHANNEL_TYPE_DIRECT:
+            conversation_subject = "New message{} from {}".format(
+                user_channel.new_messages == 1 and '' or 's',
+                channel_name
+            )
+        else:
+            conversation_subject = "Conversation: {}".format(channel_name)
+        subject = conversation_subject
+        ctx = {
+            'receiver': user_channel.user,
+            'new_messages': user_channel.new_messages,
+            'channel_name': channel_name,
+            'channel': user_channel.channel,
+            'channel_url': '%s/conversation/%s/' % (TUNGA_URL, user_channel.channel.id)
+        }
+        return subject, to, ctx, dict()
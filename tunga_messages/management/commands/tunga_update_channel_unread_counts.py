@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from tunga_messages.models import ChannelUser
+from tunga_messages.utils import refresh_channel_user_unread_count
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Recount unread messages for all channel users.
+        """
+        # command to run: python manage.py tunga_update_channel_unread_counts
+
+        total = 0
+        for channel_user in ChannelUser.objects.select_related('channel').iterator():
+            refresh_channel_user_unread_count(channel_user)
+            total += 1
+        print('Updated unread counts for {} channel users'.format(total))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2026-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_messages', '0015_auto_20161106_1029'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channeluser',
+            name='last_message_id',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='channeluser',
+            name='unread_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -154,6 +154,8 @@ class ChannelUser(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_read = models.IntegerField(default=0)
     last_email_at = models.DateTimeField(blank=True, null=True)
+    unread_count = models.IntegerField(default=0)
+    last_message_id = models.IntegerField(default=0)
 
     def __str__(self):
         return '%s - %s' % (self.channel, self.user.get_short_name() or self.user.username)
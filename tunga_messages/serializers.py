@@ -2,7 +2,6 @@ from django.contrib.auth import get_user_model
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from tunga_messages.utils import channel_activity_new_messages_filter
 from tunga_messages.models import Message, Channel, ChannelUser
 from tunga_messages.tasks import get_or_create_direct_channel
 from tunga_utils.mixins import GetCurrentUserAnnotatedSerializerMixin
@@ -139,11 +138,14 @@ class ChannelSerializer(NestedModelSerializer, GetCurrentUserAnnotatedSerializer
         return None
 
     def get_new(self, obj):
+        new_messages = getattr(obj, 'new_messages', None)
+        if new_messages is not None:
+            return new_messages
         user = self.get_current_user()
         if user:
-            return channel_activity_new_messages_filter(
-                queryset=obj.target_actions.filter(channels__channeluser__user=user), user=user
-            ).count()
+            return ChannelUser.objects.filter(channel=obj, user=user).values_list(
+                'unread_count', flat=True
+            ).first() or 0
         return 0
 
     def get_last_read(self, obj):
@@ -1,3 +1,4 @@
+from actstream.models import Action
 from actstream.signals import action
 from django.contrib.contenttypes.models import ContentType
 from django.db.models.signals import post_save
@@ -6,6 +7,7 @@ from django.dispatch.dispatcher import receiver
 from tunga_activity import verbs
 from tunga_messages.models import Message, Channel, ChannelUser
 from tunga_messages.notifications import notify_new_message_slack, notify_new_message_developers
+from tunga_messages.utils import update_channel_unread_counts, refresh_channel_user_unread_count
 from tunga_profiles.models import Inquirer
 from tunga_utils.constants import CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_SUPPORT, APP_INTEGRATION_PROVIDER_SLACK, \
     CHANNEL_TYPE_DEVELOPER
@@ -36,6 +38,7 @@ def activity_handler_channel_user(sender, instance, created, **kwargs):
             instance.user, verb=verbs.ADD, action_object=instance, target=instance.channel,
             timestamp=instance.created_at
         )
+        refresh_channel_user_unread_count(instance)
 
     if instance.channel.type == CHANNEL_TYPE_DIRECT:
         clean_direct_channel(instance.channel)
@@ -65,3 +68,10 @@ def activity_handler_new_message(sender, instance, created, **kwargs):
 
         if instance.channel.type == CHANNEL_TYPE_DEVELOPER and (instance.user.is_staff or instance.user.is_superuser):
             notify_new_message_developers.delay(instance.id)
+
+
+@receiver(post_save, sender=Action)
+def activity_handler_channel_activity(sender, instance, created, **kwargs):
+    if created and instance.verb in [verbs.SEND, verbs.UPLOAD] and \
+            instance.target_content_type_id == ContentType.objects.get_for_model(Channel).id:
+        update_channel_unread_counts(instance)
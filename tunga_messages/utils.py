@@ -1,25 +1,18 @@
-from django.db.models import Q, Case, When, IntegerField, F
-from django.db.models.aggregates import Sum, Max
-from django.db.models.fields import DateTimeField
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q, Case, When, IntegerField, F, Value
+from django.db.models.aggregates import Max
+from django.db.models.expressions import Subquery, OuterRef
+from django.db.models.functions import Coalesce, Greatest
 
 from tunga_activity import verbs
+from tunga_messages.models import ChannelUser
 
 
 def all_messages_q_filter(user):
     return Q(user=user) | Q(channel__channeluser__user=user)
 
 
-def channel_last_read_annotation(user):
-    return Case(
-        When(
-            channeluser__user=user,
-            then='channeluser__last_read'
-        ),
-        default=0,
-        output_field=IntegerField()
-    )
-
-
 def channel_activity_last_read_annotation(user):
     return Case(
         When(
@@ -31,49 +24,63 @@ def channel_activity_last_read_annotation(user):
     )
 
 
-def channel_new_messages_annotation(user):
-    """
-    Queryset needs to annotated with channel_last_read for this to work
-    :param user:
-    :return:
-    """
-    return Sum(
-        Case(
-            When(
-                ~Q(action_targets__actor_object_id=user.id) &
-                Q(action_targets__gt=F('channel_last_read')) &
-                Q(action_targets__verb__in=[verbs.SEND, verbs.UPLOAD]),
-                then=1
+def annotate_channel_queryset_with_new_messages(queryset, user):
+    return queryset.annotate(
+        new_messages=Coalesce(
+            Subquery(
+                ChannelUser.objects.filter(channel=OuterRef('pk'), user=user).values('unread_count')[:1],
+                output_field=IntegerField()
             ),
-            default=0,
-            output_field=IntegerField()
+            0
         )
     )
 
 
-def annotate_channel_queryset_with_new_messages(queryset, user):
-    return queryset.annotate(
-        channel_last_read=channel_last_read_annotation(user)
-    ).annotate(
-        new_messages=channel_new_messages_annotation(user)
+def get_channel_message_activity(channel):
+    return channel.action_targets.filter(verb__in=[verbs.SEND, verbs.UPLOAD])
+
+
+def update_channel_unread_counts(activity):
+    """
+    Bumps the unread counters of channel participants for a new message or upload activity
+    """
+    channel_users = ChannelUser.objects.filter(channel_id=activity.target_object_id)
+    channel_users.update(last_message_id=Greatest('last_message_id', Value(activity.id)))
+
+    if activity.actor_content_type_id == ContentType.objects.get_for_model(get_user_model()).id:
+        # Users don't get notified about their own messages
+        channel_users = channel_users.exclude(user_id=activity.actor_object_id)
+    channel_users.filter(last_read__lt=activity.id).update(unread_count=F('unread_count') + 1)
+
+
+def refresh_channel_user_unread_count(channel_user):
+    """
+    Recounts unread messages after the user's last_read changes
+    """
+    channel_activity = get_channel_message_activity(channel_user.channel)
+    last_message_id = channel_activity.aggregate(latest=Max('id'))['latest'] or 0
+    unread_count = channel_activity.filter(
+        id__gt=channel_user.last_read
+    ).exclude(
+        actor_content_type=ContentType.objects.get_for_model(get_user_model()),
+        actor_object_id=channel_user.user_id
+    ).count()
+    ChannelUser.objects.filter(id=channel_user.id).update(
+        unread_count=unread_count, last_message_id=last_message_id
     )
+    channel_user.unread_count = unread_count
+    channel_user.last_message_id = last_message_id
+    return unread_count
 
 
-def annotate_channel_queryset_with_latest_activity_at(queryset, user):
+def annotate_channel_queryset_with_last_message_id(queryset, user):
     return queryset.annotate(
-        latest_activity_timestamp=Max('action_targets__timestamp'),
-    ).annotate(
-        latest_activity_at=Case(
-            When(
-                latest_activity_timestamp__isnull=True,
-                then='created_at'
-            ),
-            When(
-                latest_activity_timestamp__gt=F('created_at'),
-                then='latest_activity_timestamp'
+        last_message_id=Coalesce(
+            Subquery(
+                ChannelUser.objects.filter(channel=OuterRef('pk'), user=user).values('last_message_id')[:1],
+                output_field=IntegerField()
             ),
-            default='created_at',
-            output_field=DateTimeField()
+            0
         )
     )
 
@@ -6,27 +6,30 @@ from django.views.decorators.csrf import csrf_exempt
 from dry_rest_permissions.generics import DRYObjectPermissions, DRYPermissions
 from rest_framework import viewsets, status
 from rest_framework.decorators import detail_route, list_route, api_view, permission_classes
+from rest_framework.filters import DjangoFilterBackend
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 
+from tunga_activity.filterbackends import ACTIVITY_FILTER_BACKENDS
 from tunga_activity.filters import ActionFilter, MessageActivityFilter
 from tunga_activity.serializers import SimpleActivitySerializer, LastReadActivitySerializer
-from tunga_messages.filterbackends import MessageFilterBackend, ChannelFilterBackend
+from tunga_messages.filterbackends import MessageFilterBackend, ChannelFilterBackend, MessageSearchFilter
 from tunga_messages.filters import MessageFilter, ChannelFilter
 from tunga_messages.models import Message, Channel, ChannelUser
 from tunga_messages.serializers import MessageSerializer, ChannelSerializer, DirectChannelSerializer, \
     SupportChannelSerializer, DeveloperChannelSerializer
 from tunga_messages.tasks import get_or_create_direct_channel, get_or_create_support_channel, create_channel, \
     get_or_create_task_channel
-from tunga_messages.utils import annotate_channel_queryset_with_latest_activity_at
+from tunga_messages.utils import annotate_channel_queryset_with_last_message_id, \
+    annotate_channel_queryset_with_new_messages, refresh_channel_user_unread_count
 from tunga_profiles.models import Inquirer
 from tunga_tasks.models import Task
 from tunga_utils import slack_utils
 from tunga_utils.constants import CHANNEL_TYPE_SUPPORT, APP_INTEGRATION_PROVIDER_SLACK, CHANNEL_TYPE_DEVELOPER
 from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
 from tunga_utils.mixins import SaveUploadsMixin
-from tunga_utils.pagination import LargeResultsSetPagination, DefaultPagination
+from tunga_utils.pagination import LargeResultsSetPagination, KeysetPagination
 
 
 class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
@@ -45,9 +48,12 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
     )
 
     def get_queryset(self):
-        return annotate_channel_queryset_with_latest_activity_at(
-            self.queryset, self.request.user
-        ).distinct().order_by('-latest_activity_at')
+        queryset = self.queryset
+        if self.request.user.is_authenticated():
+            queryset = annotate_channel_queryset_with_new_messages(queryset, self.request.user)
+            queryset = annotate_channel_queryset_with_last_message_id(queryset, self.request.user)
+            return queryset.order_by('-last_message_id', '-created_at')
+        return queryset.order_by('-created_at')
 
     @list_route(
         methods=['post'], url_path='direct',
@@ -188,9 +194,11 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         channel = get_object_or_404(self.get_queryset(), pk=pk)
         if channel.has_object_read_permission(request):
             if request.user.is_authenticated():
-                ChannelUser.objects.update_or_create(
+                channel_user, created = ChannelUser.objects.update_or_create(
                     user=request.user, channel=channel, defaults={'last_read': last_read}
                 )
+                refresh_channel_user_unread_count(channel_user)
+                channel.new_messages = channel_user.unread_count
             else:
                 channel.last_read = last_read
                 channel.save()
@@ -206,9 +214,9 @@ class ChannelViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         permission_classes=[AllowAny],
         serializer_class=SimpleActivitySerializer,
         filter_class=None,
-        filter_backends=DEFAULT_FILTER_BACKENDS,
+        filter_backends=ACTIVITY_FILTER_BACKENDS,
         search_fields=('messages__body', 'uploads__file', 'messages__attachments__file'),
-        pagination_class=DefaultPagination
+        pagination_class=KeysetPagination
     )
     def activity(self, request, pk=None):
         """
@@ -247,7 +255,8 @@ class MessageViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
     serializer_class = MessageSerializer
     permission_classes = [DRYPermissions, DRYObjectPermissions]
     filter_class = MessageFilter
-    filter_backends = DEFAULT_FILTER_BACKENDS + (MessageFilterBackend,)
+    filter_backends = (DjangoFilterBackend, MessageSearchFilter, MessageFilterBackend)
+    pagination_class = KeysetPagination
     search_fields = ('user__username', 'body',)
 
     @detail_route(
@@ -263,9 +272,10 @@ class MessageViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         message = get_object_or_404(self.get_queryset(), pk=pk)
 
         if message.has_object_read_permission(request):
-            ChannelUser.objects.update_or_create(
+            channel_user, created = ChannelUser.objects.update_or_create(
                 user=request.user, channel=message.channel, defaults={'last_read': message.id}
             )
+            refresh_channel_user_unread_count(channel_user)
             response_serializer = ChannelSerializer(message.channel)
             return Response(response_serializer.data)
         return Response(
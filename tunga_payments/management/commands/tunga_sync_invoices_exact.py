@@ -5,7 +5,7 @@ from django.core.management.base import BaseCommand
 
 from tunga_payments.models import Invoice
 from tunga_utils.constants import INVOICE_TYPE_SALE, INVOICE_TYPE_PURCHASE
-from tunga_utils.exact_utils import upload_invoice_v3
+from tunga_utils.exact_utils import upload_invoice_v3, run_exact_sync
 
 
 class Command(BaseCommand):
@@ -23,5 +23,8 @@ class Command(BaseCommand):
             type__in=[INVOICE_TYPE_SALE, INVOICE_TYPE_PURCHASE], paid=True, legacy_id__isnull=True,
             paid_at__gte=past_by_48_hours
         )
-        for invoice in invoices:
-            upload_invoice_v3(invoice)
+        failures = run_exact_sync(
+            list(invoices), lambda invoice, exact_api: upload_invoice_v3(invoice, exact_api=exact_api)
+        )
+        for invoice, error in failures:
+            print('Failed to sync invoice {} with exact: {}'.format(invoice.number, error))
@@ -12,7 +12,6 @@ from django.db import models
 from django.template.loader import render_to_string
 from django.utils.encoding import python_2_unicode_compatible
 from dry_rest_permissions.generics import allow_staff_or_superuser
-from weasyprint import HTML
 
 from tunga import settings
 from tunga.settings import TUNGA_URL
@@ -23,6 +22,7 @@ from tunga_utils.constants import PAYMENT_METHOD_STRIPE, PAYMENT_METHOD_BANK, PA
     INVOICE_TYPE_PURCHASE, PAYMENT_TYPE_PURCHASE, PAYMENT_TYPE_SALE, VAT_LOCATION_WORLD, VAT_LOCATION_EUROPE, \
     VAT_LOCATION_NL, INVOICE_TYPE_SALE, INVOICE_TYPE_CLIENT, INVOICE_PAYMENT_METHOD_CHOICES, STATUS_INITIATED, \
     STATUS_COMPLETED, STATUS_FAILED, STATUS_RETRY
+from tunga_utils.pdf_utils import render_pdf, get_pdf_cache_scope
 from tunga_utils.validators import validate_btc_address_or_none
 
 
@@ -155,7 +155,7 @@ class Invoice(models.Model):
 
     @property
     def pdf(self):
-        return HTML(string=self.html, encoding='utf-8').write_pdf()
+        return render_pdf(self.html, scope=get_pdf_cache_scope('invoice', self.id))
 
     @property
     def download_url(self):
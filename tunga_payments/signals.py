@@ -1,10 +1,11 @@
 from actstream import action
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 from tunga_activity import verbs
 from tunga_payments.models import Invoice, Payment
 from tunga_payments.notifications.generic import notify_invoice
+from tunga_utils.pdf_utils import invalidate_pdf_cache, get_pdf_cache_scope
 
 
 @receiver(post_save, sender=Invoice)
@@ -29,3 +30,16 @@ def activity_handler_new_payment(sender, instance, created, **kwargs):
             instance.created_by or instance.invoice.created_by,
             verb=verbs.CREATE, action_object=instance, target=instance.invoice
         )
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def activity_handler_invoice_pdf_cache(sender, instance, **kwargs):
+    invalidate_pdf_cache(get_pdf_cache_scope('invoice', instance.id))
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def activity_handler_payment_pdf_cache(sender, instance, **kwargs):
+    if instance.invoice_id:
+        invalidate_pdf_cache(get_pdf_cache_scope('invoice', instance.invoice_id))
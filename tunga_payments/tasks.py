@@ -1,67 +1,242 @@
 import datetime
-from decimal import Decimal
+import time
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
 
+from concurrent.futures import ThreadPoolExecutor
+from django.db.models import Case, When, Value, TextField
+from django_redis import get_redis_connection
 from django_rq.decorators import job
+from redis.exceptions import LockError
 
-from tunga.settings import PAYONEER_USERNAME, PAYONEER_PASSWORD, PAYONEER_PARTNER_ID
+from tunga.settings import PAYONEER_USERNAME, PAYONEER_PASSWORD, PAYONEER_PARTNER_ID, PAYONEER_MIN_PAYOUT, \
+    PAYONEER_PAYOUT_ORDER, PAYONEER_PAYOUT_MAX_WORKERS, PAYONEER_PAYOUT_LOCK_TIMEOUT, PAYONEER_REQUEST_TIMEOUT
 from tunga_payments.models import Payment, Invoice
 from tunga_payments.notifications.generic import notify_paid_invoice
+from tunga_profiles.utils import invalidate_notification_sections, get_project_notification_user_ids
 from tunga_utils import payoneer_utils
 from tunga_utils.constants import PAYMENT_METHOD_PAYONEER, CURRENCY_EUR, STATUS_APPROVED, INVOICE_TYPE_PURCHASE, \
-    STATUS_FAILED, STATUS_RETRY, STATUS_INITIATED
-from tunga_utils.helpers import clean_instance
+    STATUS_FAILED, STATUS_RETRY, STATUS_INITIATED, PAYOUT_ORDER_FIFO, PAYOUT_ORDER_LARGEST_FIRST, \
+    NOTIFICATION_SECTION_INVOICES, NOTIFICATION_SECTION_ACTIVITIES
+from tunga_utils.helpers import clean_instance, bulk_create_with_signals
+from tunga_utils.pdf_utils import invalidate_pdf_cache, get_pdf_cache_scope
 
+PAYOUT_LOCK_KEY = 'payoneer_payouts_lock'
 
-@job
-def make_payout(invoice):
-    invoice = clean_instance(invoice, Invoice)
 
-    if invoice.legacy_id or invoice.type != INVOICE_TYPE_PURCHASE or invoice.status != STATUS_APPROVED or invoice.paid:
-        # Only payout non-legacy non-paid approved purchase invoices
-        return
+def plan_payouts(invoices, balance, order=PAYOUT_ORDER_FIFO):
+    """
+    Allocates one balance snapshot to invoices so the balance is never overcommitted
+    :param invoices: payable invoices
+    :param balance: available balance
+    :param order: PAYOUT_ORDER_FIFO (oldest invoices first) or PAYOUT_ORDER_LARGEST_FIRST
+    :return: list of invoices to pay
+    """
+    if order == PAYOUT_ORDER_LARGEST_FIRST:
+        invoices = sorted(invoices, key=lambda invoice: (-invoice.amount, invoice.issued_at, invoice.id))
+    else:
+        invoices = sorted(invoices, key=lambda invoice: (invoice.issued_at, invoice.id))
+
+    planned = []
+    for invoice in invoices:
+        if Decimal(PAYONEER_MIN_PAYOUT) <= invoice.amount <= balance:
+            # Payments must be more than the minimum and less than the remaining balance
+            planned.append(invoice)
+            balance -= invoice.amount
+    return planned
 
-    payoneer_client = payoneer_utils.get_client(
-        PAYONEER_USERNAME, PAYONEER_PASSWORD, PAYONEER_PARTNER_ID
+
+def get_payable_invoices(invoice_ids=None):
+    """
+    Non-legacy non-paid approved purchase invoices without a payment, with a payment marked for retry
+    or with an initiated payment whose outcome is unknown (e.g the request timed out).
+    Initiated payments are resent with the same idempotency key to reconcile them.
+    """
+    invoices = Invoice.objects.filter(
+        type=INVOICE_TYPE_PURCHASE, status=STATUS_APPROVED, paid=False, legacy_id__isnull=True
+    ).select_related('user', 'project')
+    if invoice_ids is not None:
+        invoices = invoices.filter(id__in=invoice_ids)
+    invoices = list(invoices)
+
+    payment_statuses = defaultdict(set)
+    for invoice_id, payment_method, status in Payment.objects.filter(
+            invoice_id__in=[invoice.id for invoice in invoices]).values_list('invoice_id', 'payment_method', 'status'):
+        # Payments recorded for other methods (e.g bank transfers) are never paid out, whatever their status
+        payment_statuses[invoice_id].add(payment_method == PAYMENT_METHOD_PAYONEER and status or None)
+    return [
+        invoice for invoice in invoices
+        if payment_statuses[invoice.id].issubset([STATUS_RETRY, STATUS_INITIATED])
+    ]
+
+
+def get_unreconciled_invoice_ids(invoices):
+    """
+    Invoices with an initiated Payoneer payment left by an earlier batch, it may or may not have been paid out
+    """
+    return set(
+        Payment.objects.filter(
+            invoice_id__in=[invoice.id for invoice in invoices], payment_method=PAYMENT_METHOD_PAYONEER,
+            status=STATUS_INITIATED
+        ).values_list('invoice_id', flat=True)
     )
 
-    balance = payoneer_client.get_balance()
-    if Decimal(20) <= invoice.amount <= balance.get('accountbalance', 0):
-        # Payments must be more than EUR 20 and less than the balance
 
-        payment, created = Payment.objects.get_or_create(
-            invoice=invoice, defaults=dict(
-                amount=invoice.amount, payment_method=PAYMENT_METHOD_PAYONEER
+def initiate_payments(invoices):
+    """
+    Records initiated payments for the invoices before paying them so they are never paid twice
+    :return: dict of invoice id to payment id
+    """
+    invoice_ids = [invoice.id for invoice in invoices]
+    payoneer_payments = Payment.objects.filter(invoice_id__in=invoice_ids, payment_method=PAYMENT_METHOD_PAYONEER)
+    existing_payments = dict(
+        payoneer_payments.filter(status__in=[STATUS_RETRY, STATUS_INITIATED]).values_list('invoice_id', 'id')
+    )
+    payoneer_payments.filter(status=STATUS_RETRY).update(status=STATUS_INITIATED)
+
+    new_invoice_ids = [invoice_id for invoice_id in invoice_ids if invoice_id not in existing_payments]
+    payments = dict(existing_payments)
+    for payment in bulk_create_with_signals(
+        Payment, [
+            Payment(
+                invoice=invoice, amount=invoice.amount, payment_method=PAYMENT_METHOD_PAYONEER,
+                currency=invoice.currency or CURRENCY_EUR, status=STATUS_INITIATED, created_by=invoice.created_by
+            ) for invoice in invoices if invoice.id in new_invoice_ids
+        ],
+        lookup_fields=('invoice_id', 'payment_method', 'status'),
+        queryset=Payment.objects.select_related('invoice')
+    ):
+        payments[payment.invoice_id] = payment.id
+    return payments
+
+
+def get_payout_idempotency_key(invoice_id):
+    # Payoneer rejects payment ids it has already processed, so retries never pay an invoice twice
+    return 'invoice{}'.format(invoice_id)
+
+
+def complete_payments(invoices, payments, transactions):
+    """
+    Writes the payout results for the whole batch.
+    Payments whose outcome is unknown (request errors, unparsable responses) are left initiated
+    and reconciled by the next batch.
+    :param invoices: invoices in the batch
+    :param payments: dict of invoice id to payment id
+    :param transactions: dict of invoice id to Payoneer response, None if the request failed
+    :return: ids of paid invoices
+    """
+    paid_at = datetime.datetime.utcnow()
+    refs = dict()
+    failed_payment_ids = []
+    for invoice_id, transaction in transactions.items():
+        status = transaction and transaction.get('status', None) or None
+        if status == payoneer_utils.PAYONEER_STATUS_SUCCESS:
+            refs[payments[invoice_id]] = transaction.get('paymentid', None) or get_payout_idempotency_key(invoice_id)
+        elif status == payoneer_utils.PAYONEER_STATUS_DUPLICATE_PAYMENT:
+            # Paid by an earlier batch whose response was lost
+            refs[payments[invoice_id]] = get_payout_idempotency_key(invoice_id)
+        elif status:
+            failed_payment_ids.append(payments[invoice_id])
+
+    if failed_payment_ids:
+        Payment.objects.filter(id__in=failed_payment_ids).update(status=STATUS_FAILED)
+
+    paid_invoice_ids = [invoice_id for invoice_id in transactions if payments[invoice_id] in refs]
+    if refs:
+        Payment.objects.filter(id__in=list(refs.keys())).update(
+            paid_at=paid_at, ref=Case(
+                *[When(id=payment_id, then=Value(ref)) for payment_id, ref in refs.items()],
+                output_field=TextField()
             )
         )
+        Invoice.objects.filter(id__in=paid_invoice_ids).update(paid=True, paid_at=paid_at)
+
+    # Queryset updates skip the signals that invalidate cached invoice PDFs and notifications
+    for invoice_id in transactions:
+        invalidate_pdf_cache(get_pdf_cache_scope('invoice', invoice_id))
+
+    paid_invoices = [invoice for invoice in invoices if invoice.id in paid_invoice_ids]
+    invalidate_notification_sections([invoice.user_id for invoice in paid_invoices], [NOTIFICATION_SECTION_INVOICES])
+    project_user_ids = set()
+    for project_id in set([invoice.project_id for invoice in paid_invoices]):
+        project_user_ids.update(get_project_notification_user_ids(project_id))
+    invalidate_notification_sections(project_user_ids, [NOTIFICATION_SECTION_ACTIVITIES])
+    return paid_invoice_ids
 
-        if created or (payment and payment.status == STATUS_RETRY):
-            if payment.status == STATUS_RETRY:
-                payment.status = STATUS_INITIATED
-                payment.save()
 
-            transaction = payoneer_client.make_payment(
-                PAYONEER_PARTNER_ID, 'invoice{}'.format(invoice.id), invoice.user.id, invoice.amount,
+@job
+def make_payouts(invoice_ids=None, order=PAYONEER_PAYOUT_ORDER):
+    """
+    Pays out approved purchase invoices as one batch against a single balance snapshot
+    :param invoice_ids: limit the batch to these invoices
+    :param order: PAYOUT_ORDER_FIFO or PAYOUT_ORDER_LARGEST_FIRST
+    """
+    lock = get_redis_connection().lock(PAYOUT_LOCK_KEY, timeout=PAYONEER_PAYOUT_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        # Another batch is running, its snapshot doesn't account for payouts made by this one
+        return
+    # Don't start payouts whose response could arrive after the lock has expired
+    deadline = time.time() + PAYONEER_PAYOUT_LOCK_TIMEOUT - PAYONEER_REQUEST_TIMEOUT
+
+    try:
+        invoices = get_payable_invoices(invoice_ids=invoice_ids)
+        if not invoices:
+            return
+
+        payoneer_client = payoneer_utils.get_client(
+            PAYONEER_USERNAME, PAYONEER_PASSWORD, PAYONEER_PARTNER_ID
+        )
+
+        balance = payoneer_client.get_balance() or dict()
+        try:
+            balance = Decimal(balance.get('accountbalance', 0))
+        except InvalidOperation:
+            return
+
+        # Unreconciled payouts are always resent, Payoneer answers with a duplicate payment status if they were paid.
+        # Their amounts are reserved in case they weren't.
+        unreconciled_ids = get_unreconciled_invoice_ids(invoices)
+        unreconciled_invoices = [invoice for invoice in invoices if invoice.id in unreconciled_ids]
+        balance = max(balance - sum([invoice.amount for invoice in unreconciled_invoices]), Decimal(0))
+        invoices = unreconciled_invoices + plan_payouts(
+            [invoice for invoice in invoices if invoice.id not in unreconciled_ids], balance, order=order
+        )
+        if not invoices:
+            return
+
+        payments = initiate_payments(invoices)
+
+        def pay(invoice):
+            if time.time() > deadline:
+                # Left initiated and paid by the next batch
+                return None
+            return payoneer_client.make_payment(
+                PAYONEER_PARTNER_ID, get_payout_idempotency_key(invoice.id), invoice.user.id, invoice.amount,
                 invoice.full_title
             )
 
-            if transaction.get('status', None) == '000':
-                paid_at = datetime.datetime.utcnow()
-
-                # Update invoice
-                invoice.paid = True
-                invoice.paid_at = paid_at
-                invoice.save()
-
-                payment.invoice = invoice
-                payment.amount = invoice.amount
-                payment.payment_method = PAYMENT_METHOD_PAYONEER
-                payment.currency = invoice.currency or CURRENCY_EUR
-                payment.ref = transaction.get('paymentid', None)
-                payment.paid_at = paid_at
-                payment.created_by = invoice.created_by
-                payment.save()
-
-                notify_paid_invoice.delay(invoice)
-            else:
-                payment.status = STATUS_FAILED
-                payment.save()
+        executor = ThreadPoolExecutor(max_workers=PAYONEER_PAYOUT_MAX_WORKERS)
+        futures = dict((invoice.id, executor.submit(pay, invoice)) for invoice in invoices)
+        executor.shutdown(wait=True)
+
+        transactions = dict()
+        for invoice_id, future in futures.items():
+            # The outcome of requests that errored out (e.g timeouts) is unknown, they are reconciled later
+            transactions[invoice_id] = not future.exception() and future.result() or None
+
+        paid_invoice_ids = complete_payments(invoices, payments, transactions)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # Lock expired while the batch was running
+            pass
+
+    for invoice_id in paid_invoice_ids:
+        notify_paid_invoice.delay(invoice_id)
+
+
+@job
+def make_payout(invoice):
+    invoice = clean_instance(invoice, Invoice)
+    make_payouts(invoice_ids=[invoice.id])
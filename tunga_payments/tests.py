@@ -6,15 +6,20 @@ from datetime import datetime
 
 from django.contrib.auth import get_user_model
 # Create your tests here.
-from django.test import RequestFactory
+from django.test import RequestFactory, TestCase
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from tunga.settings import PAYONEER_PAYOUT_MAX_WORKERS
 from tunga_payments.models import Invoice, Payment
+from tunga_payments.tasks import make_payouts
 from tunga_projects.models import Project
+from tunga_utils import payoneer_utils
 from tunga_utils.constants import USER_TYPE_PROJECT_OWNER, USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_MANAGER, \
-    TASK_TYPE_WEB, TASK_SCOPE_PROJECT, TASK_SCOPE_TASK
+    TASK_TYPE_WEB, TASK_SCOPE_PROJECT, TASK_SCOPE_TASK, INVOICE_TYPE_PURCHASE, STATUS_APPROVED, \
+    PAYOUT_ORDER_LARGEST_FIRST, STATUS_INITIATED, PAYMENT_METHOD_BANK
+from tunga_utils.payoneer_stub import PayoneerStubServer
 
 
 class APIInvoiceTestCase(APITestCase):
@@ -371,3 +376,121 @@ class APIPaymentTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         response = self.client.get('/api/payments/%s/' % payment.id)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class PayoutTestCase(TestCase):
+
+    def setUp(self):
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret',
+            **dict(type=USER_TYPE_DEVELOPER)
+        )
+        self.admin = get_user_model().objects.create_superuser(
+            'admin', 'admin@example.com', 'secret'
+        )
+        self.project = Project.objects.create(
+            title='Tunga Dev Phase 1', description='Web test project', user=self.admin, deadline=datetime(2018, 8, 21)
+        )
+
+        self.server = PayoneerStubServer(balance=1000, latency=0.05)
+        self.server.start()
+        self.api_url = payoneer_utils.TungaPayoneer.PAYONEER_API_URL
+        payoneer_utils.TungaPayoneer.PAYONEER_API_URL = self.server.url
+
+    def tearDown(self):
+        payoneer_utils.TungaPayoneer.PAYONEER_API_URL = self.api_url
+        self.server.stop()
+
+    def create_invoices(self, amounts):
+        return [
+            Invoice.objects.create(
+                project=self.project, user=self.developer, created_by=self.admin, type=INVOICE_TYPE_PURCHASE,
+                status=STATUS_APPROVED, amount=amount, issued_at=datetime(2018, 1, idx + 1)
+            ) for idx, amount in enumerate(amounts)
+        ]
+
+    def assertPaid(self, invoices):
+        self.assertEqual(
+            sorted(self.server.payments.keys()), sorted(['invoice{}'.format(invoice.id) for invoice in invoices])
+        )
+        self.assertEqual(
+            set(Invoice.objects.filter(paid=True).values_list('id', flat=True)),
+            set([invoice.id for invoice in invoices])
+        )
+        for invoice in invoices:
+            payment = Payment.objects.get(invoice=invoice)
+            self.assertEqual(payment.ref, 'invoice{}'.format(invoice.id))
+            self.assertIsNotNone(payment.paid_at)
+
+    def test_payouts_fifo(self):
+        invoices = self.create_invoices([400, 300, 500, 10])
+
+        make_payouts()
+
+        # One balance snapshot, the 500 doesn't fit in what's left and 10 is below the minimum
+        self.assertEqual(self.server.balance_requests, 1)
+        self.assertEqual(self.server.balance, 300)
+        self.assertPaid(invoices[:2])
+
+    def test_payouts_largest_first(self):
+        invoices = self.create_invoices([400, 300, 500])
+
+        make_payouts(order=PAYOUT_ORDER_LARGEST_FIRST)
+
+        self.assertEqual(self.server.balance, 100)
+        self.assertPaid([invoices[0], invoices[2]])
+
+    def test_payouts_are_idempotent(self):
+        invoices = self.create_invoices([400, 300])
+
+        make_payouts()
+        make_payouts()
+
+        self.assertEqual(self.server.balance, 300)
+        self.assertPaid(invoices)
+
+    def test_interrupted_payouts_are_reconciled(self):
+        invoices = self.create_invoices([400, 300])
+        # Payoneer processes the first payout but its response is lost
+        self.server.drop_responses = 1
+
+        make_payouts()
+
+        self.assertEqual(len(self.server.payments), 2)
+        self.assertEqual(self.server.balance, 300)
+        self.assertEqual(Payment.objects.filter(status=STATUS_INITIATED).count(), 2)
+        self.assertEqual(Invoice.objects.filter(paid=True).count(), 1)
+
+        # The next batch resends it with the same payment id, Payoneer answers that it was already paid
+        make_payouts()
+
+        self.assertEqual(len(self.server.payments), 2)
+        self.assertEqual(self.server.balance, 300)
+        self.assertPaid(invoices)
+
+    def test_other_initiated_payments_are_left_alone(self):
+        invoices = self.create_invoices([400, 300])
+        # Manually recorded bank transfer, initiated is the default status of every payment
+        bank_payment = Payment.objects.create(
+            invoice=invoices[0], amount=400, payment_method=PAYMENT_METHOD_BANK, created_by=self.admin
+        )
+
+        make_payouts()
+
+        self.assertEqual(self.server.balance, 700)
+        self.assertPaid(invoices[1:])
+        bank_payment = Payment.objects.get(id=bank_payment.id)
+        self.assertEqual(bank_payment.status, STATUS_INITIATED)
+        self.assertIsNone(bank_payment.ref)
+
+    def test_payouts_run_concurrently(self):
+        invoices = self.create_invoices([25] * 20)
+
+        make_payouts()
+
+        self.assertEqual(self.server.balance_requests, 1)
+        # Payouts overlap, bounded by the worker pool
+        self.assertGreater(self.server.max_active_requests, 1)
+        self.assertLessEqual(self.server.max_active_requests, PAYONEER_PAYOUT_MAX_WORKERS)
+        self.assertEqual(self.server.balance, 500)
+        self.assertPaid(invoices)
@@ -1,14 +1,22 @@
+from actstream.models import Action
 from actstream.signals import action
-from django.db.models.signals import post_save
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_save, post_delete
 from django.dispatch.dispatcher import receiver, Signal
 
 from tunga_activity import verbs
+from tunga_activity.models import NotificationReadLog
+from tunga_payments.models import Invoice
 from tunga_profiles.notifications import send_new_developer_email, send_developer_accepted_email, \
     send_developer_application_received_email, send_new_skill_email, send_developer_invited_email, \
     notify_user_profile_updated_slack, notify_user_request_slack
 from tunga_profiles.models import Connection, DeveloperApplication, Skill, DeveloperInvitation, UserProfile, UserRequest
+from tunga_profiles.utils import invalidate_notification_sections, get_project_notification_user_ids
+from tunga_projects.models import Project, Participation, ProgressEvent, ProgressReport
 from tunga_utils import algolia_utils
-from tunga_utils.constants import REQUEST_STATUS_ACCEPTED, STATUS_ACCEPTED, STATUS_REJECTED
+from tunga_utils.constants import REQUEST_STATUS_ACCEPTED, STATUS_ACCEPTED, STATUS_REJECTED, \
+    NOTIFICATION_SECTION_PROJECTS, NOTIFICATION_SECTION_INVOICES, NOTIFICATION_SECTION_EVENTS, \
+    NOTIFICATION_SECTION_REPORTS, NOTIFICATION_SECTION_ACTIVITIES
 from tunga_utils.serializers import SearchUserSerializer
 from tunga_utils.signals import post_nested_save
 
@@ -67,3 +75,78 @@ def activity_handler_profile_update(sender, profile, **kwargs):
 def activity_handler_user_request(sender, instance, created, **kwargs):
     if created:
         notify_user_request_slack.delay(instance.id)
+
+
+def invalidate_project_notifications(project_id, sections, user_ids=None):
+    user_ids = set(user_ids or [])
+    if project_id:
+        user_ids.update(get_project_notification_user_ids(project_id))
+    invalidate_notification_sections(user_ids, sections)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def activity_handler_project_notifications(sender, instance, **kwargs):
+    invalidate_project_notifications(
+        instance.id,
+        [
+            NOTIFICATION_SECTION_PROJECTS, NOTIFICATION_SECTION_EVENTS,
+            NOTIFICATION_SECTION_REPORTS, NOTIFICATION_SECTION_ACTIVITIES
+        ],
+        user_ids=[instance.user_id, instance.pm_id, instance.owner_id]
+    )
+
+
+@receiver(post_save, sender=Participation)
+@receiver(post_delete, sender=Participation)
+def activity_handler_participation_notifications(sender, instance, **kwargs):
+    invalidate_project_notifications(
+        instance.project_id,
+        [NOTIFICATION_SECTION_PROJECTS, NOTIFICATION_SECTION_EVENTS, NOTIFICATION_SECTION_ACTIVITIES],
+        user_ids=[instance.user_id]
+    )
+
+
+@receiver(post_save, sender=ProgressEvent)
+@receiver(post_delete, sender=ProgressEvent)
+def activity_handler_progress_event_notifications(sender, instance, **kwargs):
+    invalidate_project_notifications(instance.project_id, [NOTIFICATION_SECTION_EVENTS, NOTIFICATION_SECTION_REPORTS])
+
+
+@receiver(post_save, sender=ProgressReport)
+@receiver(post_delete, sender=ProgressReport)
+def activity_handler_progress_report_notifications(sender, instance, **kwargs):
+    invalidate_project_notifications(
+        ProgressEvent.objects.filter(id=instance.event_id).values_list('project_id', flat=True).first(),
+        [NOTIFICATION_SECTION_EVENTS, NOTIFICATION_SECTION_REPORTS],
+        user_ids=[instance.user_id]
+    )
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def activity_handler_invoice_notifications(sender, instance, **kwargs):
+    invalidate_notification_sections([instance.user_id], [NOTIFICATION_SECTION_INVOICES])
+    # Invoice activities are only shown to clients once the invoice is due
+    invalidate_project_notifications(instance.project_id, [NOTIFICATION_SECTION_ACTIVITIES])
+
+
+@receiver(post_save, sender=Action)
+def activity_handler_action_notifications(sender, instance, created, **kwargs):
+    if not created:
+        return
+    project_id = None
+    if instance.target_content_type_id == ContentType.objects.get_for_model(Project).id:
+        project_id = instance.target_object_id
+    elif instance.target_content_type_id == ContentType.objects.get_for_model(ProgressEvent).id:
+        project_id = ProgressEvent.objects.filter(
+            id=instance.target_object_id
+        ).values_list('project_id', flat=True).first()
+    if project_id:
+        invalidate_project_notifications(project_id, [NOTIFICATION_SECTION_ACTIVITIES])
+
+
+@receiver(post_save, sender=NotificationReadLog)
+@receiver(post_delete, sender=NotificationReadLog)
+def activity_handler_notification_read_log(sender, instance, **kwargs):
+    invalidate_notification_sections([instance.user_id], [NOTIFICATION_SECTION_ACTIVITIES])
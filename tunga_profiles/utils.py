@@ -1,7 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
 
-from tunga.settings import DEBUG
+from tunga.settings import DEBUG, NOTIFICATION_CACHE_TIMEOUT
 from tunga_profiles.models import AppIntegration
+from tunga_projects.models import Project, Participation
 from tunga_utils.constants import STATUS_APPROVED, STATUS_PENDING, STATUS_INITIATED
 from tunga_utils.helpers import clean_instance
 
@@ -36,3 +39,44 @@ def get_app_integration(user, provider):
         return AppIntegration.objects.filter(user=user, provider=provider).latest('updated_at')
     except AppIntegration.DoesNotExist:
         return None
+
+
+def get_notification_cache_key(user_id, section):
+    return 'notifications:{}:{}'.format(user_id, section)
+
+
+def get_cached_notification_section(user_id, section, generate):
+    """
+    Returns a cached notification section for the user, calling generate() to rebuild it on a miss
+    """
+    key = get_notification_cache_key(user_id, section)
+    data = cache.get(key)
+    if data is None:
+        data = generate()
+        cache.set(key, data, NOTIFICATION_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_notification_sections(user_ids, sections):
+    """
+    Drops cached notification sections for the users once the current transaction commits
+    """
+    keys = [
+        get_notification_cache_key(user_id, section)
+        for user_id in set(user_ids or []) if user_id
+        for section in sections
+    ]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_project_notification_user_ids(project_id):
+    """
+    Users whose notification sections can include the project
+    """
+    user_ids = set()
+    for project in Project.objects.filter(id=project_id).values('user_id', 'pm_id', 'owner_id'):
+        user_ids.update(project.values())
+    user_ids.update(Participation.objects.filter(project_id=project_id).values_list('user_id', flat=True))
+    user_ids.discard(None)
+    return user_ids
@@ -5,6 +5,8 @@ from actstream.models import Action
 from allauth.socialaccount.providers.github.provider import GitHubProvider
 from dateutil.relativedelta import relativedelta
 from django.contrib.contenttypes.models import ContentType
+from django.db.models.fields import IntegerField
+from django.db.models.functions import Cast
 from django.db.models.query_utils import Q
 from django.shortcuts import get_object_or_404
 from django_countries.fields import CountryField
@@ -26,13 +28,15 @@ from tunga_profiles.models import UserProfile, Education, Work, Connection, Deve
     Company
 from tunga_profiles.serializers import ProfileSerializer, EducationSerializer, WorkSerializer, ConnectionSerializer, \
     DeveloperApplicationSerializer, DeveloperInvitationSerializer, CompanySerializer
+from tunga_profiles.utils import get_cached_notification_section
 from tunga_projects.models import Project, ProgressReport, ProgressEvent, Participation, Document
 from tunga_tasks.utils import get_integration_token
 from tunga_utils import github, slack_utils
 from tunga_utils.constants import APP_INTEGRATION_PROVIDER_SLACK, STATUS_ACCEPTED, \
     STATUS_INITIAL, USER_TYPE_DEVELOPER, \
     PROGRESS_EVENT_DEVELOPER, PROGRESS_EVENT_MILESTONE, PROGRESS_EVENT_PM, NOTIFICATION_TYPE_PROFILE, \
-    NOTIFICATION_TYPE_ACTIVITY
+    NOTIFICATION_TYPE_ACTIVITY, NOTIFICATION_SECTION_PROJECTS, NOTIFICATION_SECTION_INVOICES, \
+    NOTIFICATION_SECTION_EVENTS, NOTIFICATION_SECTION_REPORTS, NOTIFICATION_SECTION_ACTIVITIES
 from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
 
 
@@ -226,126 +230,180 @@ class NotificationView(views.APIView):
                     else:
                         missing_required.append(field)
 
-        running_projects = Project.objects.filter(
-            Q(user=request.user) |
-            Q(pm=request.user) |
-            Q(owner=request.user) |
+        cleared_notifications = [
+            item.notification_id for item in NotificationReadLog.objects.filter(
+                user=user, type=NOTIFICATION_TYPE_PROFILE
+            )
+        ]
+
+        # Sections are cached per user and invalidated by signals on the models behind them (see tunga_profiles.signals)
+        return Response(
+            {
+                'profile': dict(
+                    required=missing_required,
+                    optional=missing_optional,
+                    cleared=cleared_notifications
+                ),
+                'projects': get_cached_notification_section(
+                    user.id, NOTIFICATION_SECTION_PROJECTS, lambda: self.get_projects(user)
+                ),
+                'invoices': get_cached_notification_section(
+                    user.id, NOTIFICATION_SECTION_INVOICES, lambda: self.get_invoices(user)
+                ),
+                'events': get_cached_notification_section(
+                    user.id, NOTIFICATION_SECTION_EVENTS, lambda: self.get_events(user)
+                ),
+                'reports': get_cached_notification_section(
+                    user.id, NOTIFICATION_SECTION_REPORTS, lambda: self.get_reports(user)
+                ),
+                'activities': get_cached_notification_section(
+                    user.id, NOTIFICATION_SECTION_ACTIVITIES, lambda: self.get_activities(request, user)
+                )
+            },
+            status=status.HTTP_200_OK
+        )
+
+    def get_running_projects(self, user):
+        return Project.objects.filter(
+            Q(user=user) |
+            Q(pm=user) |
+            Q(owner=user) |
             (
-                Q(participation__user=request.user) &
+                Q(participation__user=user) &
                 Q(participation__status__in=[STATUS_INITIAL, STATUS_ACCEPTED])
             ), archived=False
         ).distinct()
 
+    def get_projects(self, user):
+        return [dict(
+            id=project.id,
+            title=project.title
+        ) for project in self.get_running_projects(user)]
+
+    def get_invoices(self, user):
         today_end = datetime.datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=999999)
         unpaid_invoices = Invoice.objects.filter(
-            user=request.user, paid=False, issued_at__lte=today_end
-        ).order_by('issued_at')[:5]
+            user=user, paid=False, issued_at__lte=today_end
+        ).select_related('project').order_by('issued_at')[:5]
+
+        return [dict(
+            id=invoice.id,
+            title=invoice.title,
+            full_title=invoice.full_title,
+            issued_at=invoice.issued_at,
+            due_at=invoice.due_at,
+            is_overdue=invoice.is_overdue,
+            project=dict(
+                id=invoice.project.id,
+                title=invoice.project.title
+            )
+        ) for invoice in unpaid_invoices]
 
+    def get_events(self, user):
         upcoming_progress_events = ProgressEvent.objects.filter(
             (
-                Q(project__pm=request.user) &
+                Q(project__pm=user) &
                 Q(type__in=[PROGRESS_EVENT_PM, PROGRESS_EVENT_MILESTONE])
             ) |
             (
-                Q(project__participation__user=request.user) &
+                Q(project__participation__user=user) &
                 Q(project__participation__status=STATUS_ACCEPTED) &
                 Q(type__in=[PROGRESS_EVENT_DEVELOPER, PROGRESS_EVENT_MILESTONE])
             ),
-            ~Q(progressreport__user=request.user),
+            ~Q(progressreport__user=user),
             due_at__gt=datetime.datetime.utcnow() - relativedelta(hours=24)
-        ).order_by('due_at').distinct()[:4]
+        ).select_related('project').order_by('due_at').distinct()[:4]
+
+        return [dict(
+            id=event.id,
+            title=event.title,
+            type=event.type,
+            due_at=event.due_at,
+            project=dict(
+                id=event.project.id,
+                title=event.project.title
+            )
+        ) for event in upcoming_progress_events]
 
+    def get_reports(self, user):
         progress_reports = ProgressReport.objects.filter(
-            Q(event__project__user=request.user) |
-            Q(event__project__pm=request.user) |
-            Q(event__project__owner=request.user),
+            Q(event__project__user=user) |
+            Q(event__project__pm=user) |
+            Q(event__project__owner=user),
             user__type=USER_TYPE_DEVELOPER,
             event__type__in=[PROGRESS_EVENT_DEVELOPER, PROGRESS_EVENT_MILESTONE]
-        ).distinct()[:4]
+        ).select_related('user', 'event', 'event__project').distinct()[:4]
+
+        return [dict(
+            id=report.id,
+            created_at=report.created_at,
+            status=report.status,
+            percentage=report.percentage,
+            user=dict(
+                id=report.user.id,
+                username=report.user.username,
+                display_name=report.user.display_name
+            ),
+            event=dict(
+                id=report.event.id,
+                title=report.event.title,
+                type=report.event.type,
+                due_at=report.event.due_at,
+            ),
+            project=dict(
+                id=report.event.project.id,
+                title=report.event.project.title
+            ),
+        ) for report in progress_reports]
+
+    def get_activities(self, request, user, limit=15, batch_size=50):
+        running_projects = self.get_running_projects(user)
+
+        # Anti-join on the read log instead of loading every read notification id into memory
+        read_activities = NotificationReadLog.objects.filter(
+            user=user, type=NOTIFICATION_TYPE_ACTIVITY
+        ).annotate(action_id=Cast('notification_id', IntegerField())).values('action_id')
 
         raw_activities = Action.objects.filter(
-            ~Q(id__in=[int(item.notification_id) for item in NotificationReadLog.objects.filter(user=user, type=NOTIFICATION_TYPE_ACTIVITY)]) &
-            (
-                Q(projects__in=running_projects) | Q(progress_events__project__in=running_projects)
-            ),
+            Q(projects__in=running_projects) | Q(progress_events__project__in=running_projects),
             action_object_content_type__in=[
                 ContentType.objects.get_for_model(model) for model in [Document, Participation, Invoice, FieldChangeLog]
             ],
-        )
+        ).exclude(id__in=read_activities).order_by('-timestamp', '-id')
 
         invoice_type = ContentType.objects.get_for_model(Invoice)
+        is_client = not (user.is_admin or user.is_project_manager or user.is_developer)
+        today_end = datetime.datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=999999)
 
         cleaned_activities = []
-        is_client = not (user.is_admin or user.is_project_manager or user.is_developer)
-        for activity in raw_activities:
-            if (not is_client) or activity.action_object_content_type != invoice_type or activity.action_object.is_due:
-                cleaned_activities.append(activity)
-        cleaned_activities = cleaned_activities[:15]
+        offset = 0
+        while len(cleaned_activities) < limit:
+            batch = list(raw_activities[offset:offset + batch_size])
+            if not batch:
+                break
+            offset += batch_size
+
+            due_invoice_ids = set()
+            if is_client:
+                # Check Invoice.is_due for the whole batch in one query instead of loading each action_object
+                invoice_ids = [
+                    int(activity.action_object_object_id) for activity in batch
+                    if activity.action_object_content_type_id == invoice_type.id
+                ]
+                if invoice_ids:
+                    due_invoice_ids = set(
+                        str(invoice_id) for invoice_id in Invoice.objects.filter(
+                            id__in=invoice_ids, issued_at__lte=today_end
+                        ).values_list('id', flat=True)
+                    )
 
-        cleared_notifications = [
-            item.notification_id for item in NotificationReadLog.objects.filter(
-                user=user, type=NOTIFICATION_TYPE_PROFILE
-            )
-        ]
+            for activity in batch:
+                if (not is_client) or activity.action_object_content_type_id != invoice_type.id or \
+                        str(activity.action_object_object_id) in due_invoice_ids:
+                    cleaned_activities.append(activity)
+        cleaned_activities = cleaned_activities[:limit]
 
-        return Response(
-            {
-                'profile': dict(
-                    required=missing_required,
-                    optional=missing_optional,
-                    cleared=cleared_notifications
-                ),
-                'projects': [dict(
-                    id=project.id,
-                    title=project.title
-                ) for project in running_projects],
-                'invoices': [dict(
-                    id=invoice.id,
-                    title=invoice.title,
-                    full_title=invoice.full_title,
-                    issued_at=invoice.issued_at,
-                    due_at=invoice.due_at,
-                    is_overdue=invoice.is_overdue,
-                    project=dict(
-                        id=invoice.project.id,
-                        title=invoice.project.title
-                    )
-                ) for invoice in unpaid_invoices],
-                'events': [dict(
-                    id=event.id,
-                    title=event.title,
-                    type=event.type,
-                    due_at=event.due_at,
-                    project=dict(
-                        id=event.project.id,
-                        title=event.project.title
-                    )
-                ) for event in upcoming_progress_events],
-                'reports': [dict(
-                    id=report.id,
-                    created_at=report.created_at,
-                    status=report.status,
-                    percentage=report.percentage,
-                    user=dict(
-                        id=report.user.id,
-                        username=report.user.username,
-                        display_name=report.user.display_name
-                    ),
-                    event=dict(
-                        id=report.event.id,
-                        title=report.event.title,
-                        type=report.event.type,
-                        due_at=report.event.due_at,
-                    ),
-                    project=dict(
-                        id=report.event.project.id,
-                        title=report.event.project.title
-                    ),
-                ) for report in progress_reports],
-                'activities': ActivitySerializer(instance=cleaned_activities, many=True, context=dict(request=request)).data
-            },
-            status=status.HTTP_200_OK
-        )
+        return ActivitySerializer(instance=cleaned_activities, many=True, context=dict(request=request)).data
 
 
 class RepoListView(views.APIView):
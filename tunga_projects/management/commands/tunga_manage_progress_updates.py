@@ -1,12 +1,23 @@
 import datetime
+from collections import defaultdict
 
 from django.core.management.base import BaseCommand
 from django.db.models.query_utils import Q
 
-from tunga_projects.models import Project, ProgressEvent
-from tunga_projects.notifications.generic import remind_progress_event
+from tunga_projects.models import Project, ProgressEvent, Participation
+from tunga_projects.notifications.generic import remind_progress_events
 from tunga_utils.constants import STATUS_ACCEPTED, PROGRESS_EVENT_DEVELOPER, PROGRESS_EVENT_PM, PROGRESS_EVENT_CLIENT, \
     PROGRESS_EVENT_MILESTONE, PROGRESS_EVENT_INTERNAL
+from tunga_utils.helpers import bulk_create_with_signals
+
+AUTOMATIC_EVENT_TITLES = {
+    PROGRESS_EVENT_DEVELOPER: 'Developer Update',
+    PROGRESS_EVENT_PM: 'PM Report',
+    PROGRESS_EVENT_CLIENT: 'Client Survey',
+}
+
+# Reminders per RQ job, so a slow or failing batch only holds up a few reminders
+PROGRESS_REMINDER_BATCH_SIZE = 50
 
 
 class Command(BaseCommand):
@@ -20,63 +31,85 @@ class Command(BaseCommand):
         today_start = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         today_noon = datetime.datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
         today_end = datetime.datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=999999)
+        weekday = today_noon.weekday()
 
-        projects = Project.objects.filter(
+        projects = list(Project.objects.filter(
             Q(deadline__isnull=True) | Q(deadline__gte=today_start), archived=False
+        ).select_related('user', 'owner', 'pm'))
+        project_ids = [project.id for project in projects]
+
+        reminder_ids = []
+
+        # Milestones for today, automatic updates are only scheduled if no general milestone falls on this date
+        milestone_types = defaultdict(set)
+        for milestone in ProgressEvent.objects.filter(
+            project_id__in=project_ids,
+            type__in=[PROGRESS_EVENT_MILESTONE, PROGRESS_EVENT_INTERNAL],
+            due_at__range=[today_start, today_end]
+        ).values('id', 'project_id', 'type', 'last_reminder_at'):
+            milestone_types[milestone['project_id']].add(milestone['type'])
+            if not milestone['last_reminder_at']:
+                reminder_ids.append(milestone['id'])
+
+        projects_with_participants = set(
+            Participation.objects.filter(
+                project_id__in=project_ids, status=STATUS_ACCEPTED, updates_enabled=True
+            ).values_list('project_id', flat=True)
         )
-        for project in projects:
 
-            all_milestones = ProgressEvent.objects.filter(
-                project=project,
-                type__in=[PROGRESS_EVENT_MILESTONE, PROGRESS_EVENT_INTERNAL],
-                due_at__range=[today_start, today_end]
-            )
-
-            general_milestones = []  # For all stakeholders
-            internal_milestones = []  # Only for PMs
-
-            for milestone in all_milestones:
-                # Send reminders for milestones
-                if not milestone.last_reminder_at:
-                    remind_progress_event.delay(milestone.id)
-
-                # Filter milestone types
-                if milestone.type == PROGRESS_EVENT_MILESTONE:
-                    general_milestones.append(milestone)
-                elif milestone.type == PROGRESS_EVENT_INTERNAL:
-                    internal_milestones.append(milestone)
-
-            if not general_milestones:
-                # Automatic updates are only scheduled if no general milestone falls on this date
-
-                weekday = today_noon.weekday()
-
-                participants = project.participation_set.filter(status=STATUS_ACCEPTED, updates_enabled=True)
-                if weekday < 5 and participants:
-                    # Only developer updates btn Monday (0) and Friday (4)
-                    dev_defaults = dict(title='Developer Update')
-                    dev_event, created = ProgressEvent.objects.update_or_create(
-                        project=project, type=PROGRESS_EVENT_DEVELOPER, due_at=today_noon, defaults=dev_defaults
-                    )
-
-                    if not dev_event.last_reminder_at:
-                        remind_progress_event.delay(dev_event.id)
-
-                if weekday in [0, 3] and project.pm and project.pm.is_active and not internal_milestones:
-                    # PM Reports on Monday (0) and Thursday (3)
-                    pm_defaults = dict(title='PM Report')
-                    pm_event, created = ProgressEvent.objects.update_or_create(
-                        project=project, type=PROGRESS_EVENT_PM, due_at=today_noon, defaults=pm_defaults
-                    )
-                    if not pm_event.last_reminder_at:
-                        remind_progress_event.delay(pm_event.id)
-
-                owner = project.owner or project.user
-                if weekday == 0 and participants and owner and owner.is_active:
-                    # Client surveys on Monday (0)
-                    client_defaults = dict(title='Client Survey')
-                    client_event, created = ProgressEvent.objects.update_or_create(
-                        project=project, type=PROGRESS_EVENT_CLIENT, due_at=today_noon, defaults=client_defaults
-                    )
-                    if not client_event.last_reminder_at:
-                        remind_progress_event.delay(client_event.id)
+        needed_events = set()
+        for project in projects:
+            if PROGRESS_EVENT_MILESTONE in milestone_types[project.id]:
+                continue
+
+            has_participants = project.id in projects_with_participants
+            if weekday < 5 and has_participants:
+                # Only developer updates btn Monday (0) and Friday (4)
+                needed_events.add((project.id, PROGRESS_EVENT_DEVELOPER))
+
+            if weekday in [0, 3] and project.pm and project.pm.is_active and \
+                    PROGRESS_EVENT_INTERNAL not in milestone_types[project.id]:
+                # PM Reports on Monday (0) and Thursday (3)
+                needed_events.add((project.id, PROGRESS_EVENT_PM))
+
+            owner = project.owner or project.user
+            if weekday == 0 and has_participants and owner and owner.is_active:
+                # Client surveys on Monday (0)
+                needed_events.add((project.id, PROGRESS_EVENT_CLIENT))
+
+        if needed_events:
+            self.create_events(needed_events, today_noon)
+
+            for event in ProgressEvent.objects.filter(
+                project_id__in=set([project_id for project_id, event_type in needed_events]),
+                type__in=list(AUTOMATIC_EVENT_TITLES.keys()), due_at=today_noon, last_reminder_at__isnull=True
+            ).values('id', 'project_id', 'type'):
+                if (event['project_id'], event['type']) in needed_events:
+                    reminder_ids.append(event['id'])
+
+        for i in range(0, len(reminder_ids), PROGRESS_REMINDER_BATCH_SIZE):
+            remind_progress_events.delay(reminder_ids[i:i + PROGRESS_REMINDER_BATCH_SIZE])
+
+    def create_events(self, needed_events, due_at):
+        """
+        Inserts the missing events with one query and sends their post_save signals (activity, notifications)
+        """
+        existing_events = set(
+            ProgressEvent.objects.filter(
+                project_id__in=set([project_id for project_id, event_type in needed_events]),
+                type__in=list(AUTOMATIC_EVENT_TITLES.keys()), due_at=due_at
+            ).values_list('project_id', 'type')
+        )
+        missing_events = needed_events - existing_events
+        if not missing_events:
+            return
+
+        bulk_create_with_signals(
+            ProgressEvent, [
+                ProgressEvent(
+                    project_id=project_id, type=event_type, due_at=due_at, title=AUTOMATIC_EVENT_TITLES[event_type]
+                ) for project_id, event_type in missing_events
+            ],
+            lookup_fields=('project_id', 'type', 'due_at'),
+            queryset=ProgressEvent.objects.select_related('project__owner', 'project__user')
+        )
@@ -1,3 +1,5 @@
+import logging
+
 from django_rq import job
 
 from tunga_projects.notifications.email import notify_new_participant_email_dev, \
@@ -5,6 +7,8 @@ from tunga_projects.notifications.email import notify_new_participant_email_dev,
 from tunga_projects.notifications.slack import notify_new_progress_report_slack, \
     notify_missed_progress_event_slack, notify_new_project_slack, notify_interest_poll_status_slack
 
+logger = logging.getLogger(__name__)
+
 
 @job
 def notify_new_project(project):
@@ -21,6 +25,16 @@ def remind_progress_event(progress_event):
     remind_progress_event_email(progress_event)
 
 
+@job
+def remind_progress_events(progress_events):
+    for progress_event in progress_events:
+        try:
+            remind_progress_event_email(progress_event)
+        except Exception:
+            # Don't let one failed reminder stop the rest of the batch
+            logger.exception('Failed to send progress event reminder for %s', progress_event)
+
+
 @job
 def notify_new_progress_report(progress_report):
     notify_new_progress_report_email_client(progress_report)
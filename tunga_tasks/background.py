@@ -1,113 +1,254 @@
 # -*- coding: utf-8 -*-
 
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zipfile
 from copy import copy
 
+from django.db import connections
 from django.db.models.query_utils import Q
 from django.template.loader import render_to_string
 from django_rq.decorators import job
+from pdfrw import PdfReader, PdfWriter
 from weasyprint import HTML
 
 from tunga_profiles.models import DeveloperNumber
 from tunga_tasks.models import Task
 from tunga_utils import bitcoin_utils
 from tunga_utils.constants import PAYMENT_METHOD_BITCOIN, VAT_LOCATION_WORLD
+from tunga_utils.pdf_utils import PdfJobResult, PdfJobError
 from tunga_utils.serializers import InvoiceUserSerializer, TaskInvoiceSerializer
 
 
-@job
-def process_invoices(pk, invoice_types=('client',), user_id=None, developer_ids=None, is_admin=False, filepath=None):
+def get_invoice_tasks(pk, user_id=None, is_admin=False):
     """
-    :param pk: id of the task
-    :param invoice_types: tuple of invoice types to generate e.g 'client', 'developer', 'tunga'
-    :param user_id: user viewing the invoice(s)
-    :param developer_ids: participant invoices to generate. only applies to 'developer' and 'tunga' invoices
-    :param is_admin: is requester an admin?
-    :param filepath: file to store invoice in
-    :return:
+    :param pk: id of the task or 'all' for all closed tasks with invoices visible to the user
     """
-    all_invoices = list()
-
     if pk == 'all':
         tasks = Task.objects.filter(closed=True, taskinvoice__isnull=False)
         if user_id and not is_admin:
             tasks = tasks.filter(
                 Q(user_id=user_id) | Q(owner_id=user_id) | Q(pm_id=user_id) | Q(participant__user_id=user_id))
-        tasks = tasks.distinct()
-    else:
-        tasks = Task.objects.filter(id=pk)
-
-    for task in tasks:
-        invoice = task.invoice
-        if invoice:
-            invoice = invoice.clean_invoice()
-            if invoice.number:
-                initial_invoice_data = TaskInvoiceSerializer(invoice).data
-                initial_invoice_data['date'] = task.invoice.created_at.strftime('%d %B %Y')
-
-                task_owner = task.user
-                if task.owner:
-                    task_owner = task.owner
-
-                participation_shares = task.get_participation_shares()
-                common_developer_info = list()
-                for share_info in participation_shares:
-                    participant = share_info['participant']
-                    developer, created = DeveloperNumber.objects.get_or_create(user=participant.user)
-
-                    amount_details = invoice.get_amount_details(share=share_info['share'])
-
-                    if (not developer_ids or participant.user.id in developer_ids) and \
-                            not (participant.prepaid or (participant.prepaid is None and participant.user.is_internal)):
-                        common_developer_info.append({
-                            'developer': InvoiceUserSerializer(participant.user).data,
-                            'amount': amount_details,
-                            'dev_number': developer.number or '',
-                            'participant': participant
-                        })
-
-                for invoice_type in invoice_types:
-                    if invoice_type == 'developer' and invoice.version > 1:
-                        continue
-                    task_developers = []
-                    invoice_data = copy(initial_invoice_data)
-
-                    if invoice_type == 'client':
-                        invoice_data['number_client'] = invoice.invoice_id(invoice_type='client')
-                        task_developers = [dict()]
-                    else:
-                        for common_info in common_developer_info:
-                            final_dev_info = copy(common_info)
-                            final_dev_info['number'] = invoice.invoice_id(
-                                invoice_type=invoice_type,
-                                user=common_info['participant'] and common_info['participant'].user or None
-                            )
-
-                            participant_payment_method = None
-                            if common_info['participant']:
-                                try:
-                                    participant_payment = common_info['participant'].participantpayment_set.filter().latest('created_at')
-                                    if participant_payment and bitcoin_utils.is_valid_btc_address(participant_payment.destination):
-                                        participant_payment_method = PAYMENT_METHOD_BITCOIN
-                                except:
-                                    pass
-
-                            final_dev_info['payment_method'] = participant_payment_method
-                            task_developers.append(final_dev_info)
-
-                    invoice_data['developers'] = task_developers
-
-                    all_invoices.append(
-                        dict(
+        return tasks.distinct()
+    return Task.objects.filter(id=pk)
+
+
+def get_task_invoices(task, invoice_types=('client',), developer_ids=None):
+    """
+    :return: list of invoice contexts for the task, one per invoice type
+    """
+    task_invoices = list()
+    invoice = task.invoice
+    if invoice:
+        invoice = invoice.clean_invoice()
+        if invoice.number:
+            initial_invoice_data = TaskInvoiceSerializer(invoice).data
+            initial_invoice_data['date'] = task.invoice.created_at.strftime('%d %B %Y')
+
+            task_owner = task.user
+            if task.owner:
+                task_owner = task.owner
+
+            participation_shares = task.get_participation_shares()
+            common_developer_info = list()
+            for share_info in participation_shares:
+                participant = share_info['participant']
+                developer, created = DeveloperNumber.objects.get_or_create(user=participant.user)
+
+                amount_details = invoice.get_amount_details(share=share_info['share'])
+
+                if (not developer_ids or participant.user.id in developer_ids) and \
+                        not (participant.prepaid or (participant.prepaid is None and participant.user.is_internal)):
+                    common_developer_info.append({
+                        'developer': InvoiceUserSerializer(participant.user).data,
+                        'amount': amount_details,
+                        'dev_number': developer.number or '',
+                        'participant': participant
+                    })
+
+            for invoice_type in invoice_types:
+                if invoice_type == 'developer' and invoice.version > 1:
+                    continue
+                task_developers = []
+                invoice_data = copy(initial_invoice_data)
+
+                if invoice_type == 'client':
+                    invoice_data['number_client'] = invoice.invoice_id(invoice_type='client')
+                    task_developers = [dict()]
+                else:
+                    for common_info in common_developer_info:
+                        final_dev_info = copy(common_info)
+                        final_dev_info['number'] = invoice.invoice_id(
                             invoice_type=invoice_type,
-                            invoice=invoice_data,
-                            location=invoice_type == 'client' and invoice.vat_location_client or VAT_LOCATION_WORLD
+                            user=common_info['participant'] and common_info['participant'].user or None
                         )
+
+                        participant_payment_method = None
+                        if common_info['participant']:
+                            try:
+                                participant_payment = common_info['participant'].participantpayment_set.filter().latest('created_at')
+                                if participant_payment and bitcoin_utils.is_valid_btc_address(participant_payment.destination):
+                                    participant_payment_method = PAYMENT_METHOD_BITCOIN
+                            except:
+                                pass
+
+                        final_dev_info['payment_method'] = participant_payment_method
+                        task_developers.append(final_dev_info)
+
+                invoice_data['developers'] = task_developers
+
+                task_invoices.append(
+                    dict(
+                        invoice_type=invoice_type,
+                        invoice=invoice_data,
+                        location=invoice_type == 'client' and invoice.vat_location_client or VAT_LOCATION_WORLD
                     )
+                )
+    return task_invoices
+
+
+def render_invoices_html(invoices):
     ctx = dict(
-        invoices=all_invoices
+        invoices=invoices
     )
+    return render_to_string("tunga/pdf/invoice.html", context=ctx).encode(encoding="UTF-8")
+
+
+@job
+def process_invoices(pk, invoice_types=('client',), user_id=None, developer_ids=None, is_admin=False, filepath=None):
+    """
+    :param pk: id of the task
+    :param invoice_types: tuple of invoice types to generate e.g 'client', 'developer', 'tunga'
+    :param user_id: user viewing the invoice(s)
+    :param developer_ids: participant invoices to generate. only applies to 'developer' and 'tunga' invoices
+    :param is_admin: is requester an admin?
+    :param filepath: file to store invoice in
+    :return:
+    """
+    all_invoices = list()
+    for task in get_invoice_tasks(pk, user_id=user_id, is_admin=is_admin):
+        all_invoices.extend(get_task_invoices(task, invoice_types=invoice_types, developer_ids=developer_ids))
 
-    rendered_html = render_to_string("tunga/pdf/invoice.html", context=ctx).encode(encoding="UTF-8")
+    rendered_html = render_invoices_html(all_invoices)
     if filepath:
         HTML(string=rendered_html, encoding='utf-8').write_pdf(filepath)
     return rendered_html
+
+
+def _init_invoice_worker():
+    # Forked workers must not reuse the parent's database connections
+    connections.close_all()
+
+
+def _render_invoice_chunk(params):
+    """
+    Renders a chunk of tasks to temporary PDF files
+    :return: list of (name, path) tuples, one per task when split is set otherwise one for the whole chunk
+    """
+    task_ids, invoice_types, developer_ids, split, tmp_dir = params
+
+    groups = list()
+    for task in Task.objects.filter(id__in=task_ids).order_by('id'):
+        invoices = get_task_invoices(task, invoice_types=invoice_types, developer_ids=developer_ids)
+        if not invoices:
+            continue
+        if split or not groups:
+            groups.append(('invoice_{}'.format(task.id), invoices))
+        else:
+            groups[0][1].extend(invoices)
+
+    rendered = list()
+    for name, invoices in groups:
+        fd, path = tempfile.mkstemp(dir=tmp_dir, suffix='.pdf')
+        os.close(fd)
+        HTML(string=render_invoices_html(invoices), encoding='utf-8').write_pdf(path)
+        rendered.append((name, path))
+    return rendered
+
+
+def render_invoices_bulk(
+        output, pk='all', invoice_types=('client',), user_id=None, developer_ids=None, is_admin=False,
+        workers=1, chunk_size=25, output_format='zip', progress=None):
+    """
+    Renders invoices in chunks of tasks across a process pool and streams the results into output.
+    Only one chunk per worker is laid out at a time and ZIP output keeps memory bounded.
+    Merged PDF output holds the parsed pages of every chunk until the file is written,
+    so it's only meant for smaller sets.
+    :param output: file path or file object to write to
+    :param workers: number of rendering processes, 1 renders in the current process
+    :param chunk_size: number of tasks rendered together
+    :param output_format: 'zip' for a ZIP with one PDF per task or 'pdf' for one merged PDF
+    :param progress: optional callable receiving (chunks_done, total_chunks)
+    :return: number of rendered files
+    """
+    task_ids = list(
+        get_invoice_tasks(pk, user_id=user_id, is_admin=is_admin).order_by('id').values_list('id', flat=True)
+    )
+    chunks = [task_ids[i:i + chunk_size] for i in range(0, len(task_ids), chunk_size)]
+    split = output_format == 'zip'
+
+    tmp_dir = tempfile.mkdtemp(prefix='tunga_invoices_')
+    params = [(chunk, invoice_types, developer_ids, split, tmp_dir) for chunk in chunks]
+
+    pool = None
+    if workers > 1:
+        connections.close_all()
+        pool = multiprocessing.Pool(processes=workers, initializer=_init_invoice_worker)
+        results = pool.imap(_render_invoice_chunk, params)
+    else:
+        results = (_render_invoice_chunk(item) for item in params)
+
+    archive = None
+    writer = None
+    if split:
+        archive = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+    else:
+        writer = PdfWriter()
+
+    total_files = 0
+    try:
+        for done, rendered in enumerate(results, start=1):
+            for name, path in rendered:
+                if archive:
+                    archive.write(path, '{}.pdf'.format(name))
+                else:
+                    writer.addpages(PdfReader(path).pages)
+                os.remove(path)
+                total_files += 1
+            if progress:
+                progress(done, len(chunks))
+
+        if archive:
+            archive.close()
+        elif total_files:
+            writer.write(output)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return total_files
+
+
+def render_invoices_pdf(pk, **kwargs):
+    """
+    Renders invoices for async pdf jobs.
+    All invoices are written to a ZIP file on disk (one PDF per task) that the job copies to storage.
+    :return: PDF bytes or a PdfJobResult for all invoices
+    """
+    if pk == 'all':
+        fd, path = tempfile.mkstemp(prefix='tunga_invoices_', suffix='.zip')
+        os.close(fd)
+        try:
+            total_files = render_invoices_bulk(path, pk=pk, output_format='zip', **kwargs)
+        except:
+            os.remove(path)
+            raise
+        if not total_files:
+            os.remove(path)
+            raise PdfJobError('No invoices found')
+        return PdfJobResult(path, content_type='application/zip', extension='zip')
+    rendered_html = process_invoices(pk, **kwargs)
+    return HTML(string=rendered_html, encoding='utf-8').write_pdf()
@@ -5,17 +5,27 @@ import datetime
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.aggregates import Sum
-from django.db.models.expressions import Case, When, F
-from django.db.models.fields import IntegerField
 from django.db.models.query_utils import Q
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
 
 from tunga_profiles.models import UserProfile
+from tunga_tasks.models import TaskVisibility, Quote
 from tunga_utils.constants import VISIBILITY_DEVELOPER, \
-    VISIBILITY_MY_TEAM, TASK_SCOPE_TASK, TASK_SCOPE_ONGOING, TASK_SCOPE_PROJECT, TASK_SOURCE_NEW_USER, STATUS_APPROVED, \
-    STATUS_ACCEPTED, STATUS_INITIAL
+    TASK_SCOPE_TASK, TASK_SCOPE_ONGOING, TASK_SCOPE_PROJECT, TASK_SOURCE_NEW_USER, STATUS_APPROVED, \
+    STATUS_ACCEPTED, STATUS_INITIAL, TASK_VISIBILITY_REASON_CREATOR, TASK_VISIBILITY_REASON_OWNER, \
+    TASK_VISIBILITY_REASON_PM, TASK_VISIBILITY_REASON_ADMIN, TASK_VISIBILITY_REASON_PARTICIPANT, \
+    TASK_VISIBILITY_REASON_REJECTED_PARTICIPANT, TASK_VISIBILITY_REASON_CONNECTION
 from tunga_utils.filterbackends import dont_filter_staff_or_superuser
+from tunga_utils.skill_index import annotate_skill_matches, SKILL_INDEX_TASKS
+
+
+def task_visibility_q_filter(user, reasons):
+    """
+    Filters tasks through the per-user task visibility index
+    """
+    return Q(
+        id__in=TaskVisibility.objects.filter(user_id=user.id, reason__in=reasons).values('task_id')
+    )
 
 
 class ProjectFilterBackend(DRYPermissionFiltersBase):
@@ -45,12 +55,11 @@ class TaskFilterBackend(DRYPermissionFiltersBase):
                 queryset = queryset.filter(closed=True).order_by('paid', 'pay_distributed', 'processing', '-created_at')
             if label_filter != 'payments' or (request.user.is_authenticated() and not request.user.is_admin):
                 queryset = queryset.filter(
-                    Q(user=request.user) |
-                    Q(owner=request.user) |
-                    Q(pm=request.user) |
-                    Q(taskaccess__user=request.user) |
-                    (
-                        Q(participation__user=request.user) & Q(participation__status__in=[STATUS_INITIAL, STATUS_ACCEPTED])
+                    task_visibility_q_filter(
+                        request.user, [
+                            TASK_VISIBILITY_REASON_CREATOR, TASK_VISIBILITY_REASON_OWNER, TASK_VISIBILITY_REASON_PM,
+                            TASK_VISIBILITY_REASON_ADMIN, TASK_VISIBILITY_REASON_PARTICIPANT
+                        ]
                     )
                 )
         elif label_filter in ['leads', 'projects', 'tasks']:
@@ -72,22 +81,10 @@ class TaskFilterBackend(DRYPermissionFiltersBase):
                     queryset = queryset.filter(estimate__status=STATUS_ACCEPTED).exclude(quote__status=STATUS_ACCEPTED)
         elif label_filter == 'skills':
             try:
-                user_skills = request.user.userprofile.skills.all()
-                queryset = queryset.filter(skills__in=user_skills)
-                when = []
-                for skill in user_skills:
-                    new_when = When(
-                        skills=skill,
-                        then=1
-                    )
-                    when.append(new_when)
-                queryset = queryset.annotate(matches=Sum(
-                    Case(
-                        *when,
-                        default=0,
-                        output_field=IntegerField()
-                    )
-                )).order_by('-matches', '-created_at')
+                user_skills = request.user.userprofile.skills.all().values_list('id', flat=True)
+                queryset = annotate_skill_matches(
+                    queryset, SKILL_INDEX_TASKS, user_skills
+                ).order_by('-matches', '-created_at')
             except (ObjectDoesNotExist, UserProfile.DoesNotExist):
                 return queryset.none()
         elif label_filter in ['my-clients', 'project-owners']:
@@ -108,42 +105,40 @@ class TaskFilterBackend(DRYPermissionFiltersBase):
             if request.user.is_staff or request.user.is_superuser:
                 return queryset
             if request.user.is_project_owner:
-                queryset = queryset.filter(Q(user=request.user) | Q(owner=request.user) | Q(taskaccess__user=request.user))
+                queryset = queryset.filter(
+                    task_visibility_q_filter(
+                        request.user,
+                        [TASK_VISIBILITY_REASON_CREATOR, TASK_VISIBILITY_REASON_OWNER, TASK_VISIBILITY_REASON_ADMIN]
+                    )
+                )
             elif request.user.is_developer:
-                return queryset.exclude(
+                participant_reasons = [TASK_VISIBILITY_REASON_PARTICIPANT, TASK_VISIBILITY_REASON_REJECTED_PARTICIPANT]
+                queryset = queryset.exclude(
                     approved=False
                 ).exclude(
-                    ~Q(participation__user=request.user), review=True
+                    Q(review=True) & ~task_visibility_q_filter(request.user, participant_reasons)
                 ).filter(
                     Q(scope=TASK_SCOPE_TASK) |
                     (
                         Q(scope=TASK_SCOPE_PROJECT) & Q(pm_required=False) & ~Q(source=TASK_SOURCE_NEW_USER)
-                    ) | Q(quote__status=STATUS_ACCEPTED)
+                    ) | Q(id__in=Quote.objects.filter(status=STATUS_ACCEPTED).values('task_id'))
                 ).filter(
-                    Q(user=request.user) |
-                    Q(participation__user=request.user) |
-                    (
-                        Q(visibility=VISIBILITY_DEVELOPER) |
-                        (
-                            Q(visibility=VISIBILITY_MY_TEAM) &
-                            (
-                                (
-                                    Q(user__connections_initiated__to_user=request.user) &
-                                    Q(user__connections_initiated__accepted=True)
-                                ) |
-                                (
-                                    Q(user__connection_requests__from_user=request.user) &
-                                    Q(user__connection_requests__status=STATUS_ACCEPTED)
-                                )
-                            )
-                        )
+                    Q(visibility=VISIBILITY_DEVELOPER) |
+                    task_visibility_q_filter(
+                        request.user,
+                        [TASK_VISIBILITY_REASON_CREATOR, TASK_VISIBILITY_REASON_CONNECTION] + participant_reasons
                     )
-                ).distinct()
+                )
+                if label_filter in ['quotes', 'my-clients', 'project-owners']:
+                    # These label filters join multi-valued relations
+                    queryset = queryset.distinct()
+                return queryset
             elif request.user.is_project_manager:
                 queryset = queryset.filter(
-                    Q(user=request.user) |
-                    Q(pm=request.user) |
-                    Q(taskaccess__user=request.user) | (
+                    task_visibility_q_filter(
+                        request.user,
+                        [TASK_VISIBILITY_REASON_CREATOR, TASK_VISIBILITY_REASON_PM, TASK_VISIBILITY_REASON_ADMIN]
+                    ) | (
                         Q(scope=TASK_SCOPE_ONGOING) |
                         (
                             Q(scope=TASK_SCOPE_PROJECT) & (
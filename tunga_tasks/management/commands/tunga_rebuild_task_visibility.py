@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from tunga_tasks.utils import rebuild_task_visibility
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Rebuild the per-user task visibility index from scratch
+        """
+        # command to run: python manage.py tunga_rebuild_task_visibility
+
+        total_entries = rebuild_task_visibility()
+        print('task visibility entries: ', total_entries)
@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from tunga_tasks.background import render_invoices_bulk
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write the invoices to')
+        parser.add_argument(
+            '--workers', type=int, default=1, help='Number of rendering processes'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=25, dest='chunk_size', help='Number of tasks rendered together'
+        )
+        parser.add_argument(
+            '--format', choices=['zip', 'pdf'], default='zip', dest='output_format',
+            help='A ZIP with one PDF per task or one merged PDF (holds all pages in memory)'
+        )
+        parser.add_argument(
+            '--types', default='client', help='Comma separated invoice types e.g client,developer,tunga'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Render invoices for all closed tasks.
+        """
+        # command to run: python manage.py tunga_render_invoices invoices.zip --format=zip --workers=4
+
+        def report_progress(done, total):
+            sys.stdout.write('\rRendered {}/{} chunks'.format(done, total))
+            sys.stdout.flush()
+
+        total_files = render_invoices_bulk(
+            options['output'], invoice_types=options['types'].split(','), is_admin=True,
+            workers=max(options['workers'], 1), chunk_size=max(options['chunk_size'], 1),
+            output_format=options['output_format'], progress=report_progress
+        )
+        print('\nRendered {} invoice files to {}'.format(total_files, options['output']))
@@ -2,7 +2,7 @@ import datetime
 
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
-from django.contrib.contenttypes.models import ContentType
+from django.core.mail import get_connection
 from django.core.management.base import BaseCommand
 from django.db.models.aggregates import Sum
 from django.db.models.expressions import Case, When, F
@@ -13,8 +13,8 @@ from tunga.settings import TUNGA_URL
 from tunga_activity import verbs
 from tunga_activity.models import ActivityReadLog
 from tunga_settings.slugs import TASK_ACTIVITY_UPDATE_EMAIL
-from tunga_tasks.models import Participation, Task
-from tunga_utils.emails import send_mail
+from tunga_tasks.utils import get_missing_task_read_logs, create_task_read_logs
+from tunga_utils.emails import send_templated_mail_batch
 
 
 class Command(BaseCommand):
@@ -25,42 +25,8 @@ class Command(BaseCommand):
         """
         # command to run: python manage.py tunga_send_task_activity_emails
 
-        # Initialize missing logs
-        client_tasks = Task.objects.filter(closed=False).annotate(user_logs=Sum(
-            Case(
-                When(
-                    read_logs__user=F('user'),
-                    then=1
-                ),
-                default=0,
-                output_field=IntegerField()
-            )
-        )).filter(user_logs=0)
-
-        for task in client_tasks:
-            ActivityReadLog.objects.update_or_create(
-                user=task.user,
-                content_type=ContentType.objects.get_for_model(task),
-                object_id=task.id
-            )
-
-        participants = Participation.objects.filter(task__closed=False).annotate(user_logs=Sum(
-            Case(
-                When(
-                    task__read_logs__user=F('user'),
-                    then=1
-                ),
-                default=0,
-                output_field=IntegerField()
-            )
-        )).filter(user_logs=0)
-
-        for participant in participants:
-            ActivityReadLog.objects.update_or_create(
-                user=participant.user,
-                content_type=ContentType.objects.get_for_model(participant.task),
-                object_id=participant.task.id
-            )
+        # Initialize missing logs, mostly created by the task and participation signals already
+        create_task_read_logs(get_missing_task_read_logs())
 
         # Send notifications
         utc_now = datetime.datetime.utcnow()
@@ -94,6 +60,8 @@ class Command(BaseCommand):
             )
         )).filter(new_activity__gt=0)
 
+        user_tasks = list(user_tasks)
+        recipients = []
         for user_task in user_tasks:
             task = user_task.content_object
 
@@ -105,9 +73,16 @@ class Command(BaseCommand):
                 'task': user_task.content_object,
                 'task_url': '%s/task/%s/' % (TUNGA_URL, user_task.object_id)
             }
+            recipients.append((subject, to, ctx, dict(deal_ids=[task.hubspot_deal_id])))
+
+        # One SMTP connection for the whole run, templates and styles are loaded once per batch
+        connection = get_connection()
+        try:
+            results = send_templated_mail_batch('tunga/email/unread_task_activity', recipients, connection=connection)
+        finally:
+            connection.close()
 
-            if send_mail(
-                    subject, 'tunga/email/unread_task_activity', to, ctx, **dict(deal_ids=[task.hubspot_deal_id])
-            ):
+        for user_task, is_sent in zip(user_tasks, results):
+            if is_sent:
                 user_task.last_email_at = datetime.datetime.utcnow()
                 user_task.save()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2018-10-18 09:12
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tunga_tasks', '0173_auto_20180919_0834'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskVisibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(choices=[('creator', 'Created the task'), ('owner', 'Owns the task'), ('pm', 'Manages the task'), ('admin', 'Has admin access'), ('participant', 'Invited or accepted participant'), ('rejected_participant', 'Rejected participant'), ('connection', 'Connected to the task creator')], help_text='creator - Created the task, owner - Owns the task, pm - Manages the task, admin - Has admin access, participant - Invited or accepted participant, rejected_participant - Rejected participant, connection - Connected to the task creator', max_length=30)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibility_index', to='tunga_tasks.Task')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_visibility', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'task visibility',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='taskvisibility',
+            unique_together=set([('user', 'task', 'reason')]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.16 on 2026-10-18 13:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from tunga_utils.constants import LEGACY_PROGRESS_EVENT_TYPE_PERIODIC
+
+
+def set_periodic_due_on(apps, schema_editor):
+    ProgressEvent = apps.get_model('tunga_tasks', 'ProgressEvent')
+
+    # Keep the first periodic update of each day, older duplicates stay without a date
+    scheduled = set()
+    for event_id, task_id, due_at in ProgressEvent.objects.filter(
+        type=LEGACY_PROGRESS_EVENT_TYPE_PERIODIC
+    ).order_by('due_at', 'id').values_list('id', 'task_id', 'due_at').iterator():
+        key = (task_id, due_at.date())
+        if key not in scheduled:
+            scheduled.add(key)
+            ProgressEvent.objects.filter(id=event_id).update(due_on=due_at.date())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_tasks', '0174_taskvisibility'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progressevent',
+            name='due_on',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_periodic_due_on, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='progressevent',
+            unique_together=set([('task', 'due_on')]),
+        ),
+    ]
@@ -53,7 +53,9 @@ from tunga_utils.constants import CURRENCY_EUR, CURRENCY_USD, USER_TYPE_DEVELOPE
     STATUS_CANCELED, STATUS_RETRY, PAYMENT_METHOD_AYDEN, LEGACY_PROGRESS_EVENT_TYPE_MILESTONE_INTERNAL, \
     PAYMENT_METHOD_PAYONEER, DOC_ESTIMATE, DOC_PROPOSAL, DOC_PLANNING, DOC_REQUIREMENTS, DOC_WIREFRAMES, \
     DOC_TIMELINE, DOC_OTHER, LEGACY_PROGRESS_EVENT_TYPE_CLIENT_MID_SPRINT, VAT_LOCATION_NL, VAT_LOCATION_EUROPE, \
-    VAT_LOCATION_WORLD
+    VAT_LOCATION_WORLD, TASK_VISIBILITY_REASON_CREATOR, TASK_VISIBILITY_REASON_OWNER, TASK_VISIBILITY_REASON_PM, \
+    TASK_VISIBILITY_REASON_ADMIN, TASK_VISIBILITY_REASON_PARTICIPANT, TASK_VISIBILITY_REASON_REJECTED_PARTICIPANT, \
+    TASK_VISIBILITY_REASON_CONNECTION
 from tunga_utils.helpers import round_decimal, get_serialized_id, get_tunga_model, get_edit_token_header
 from tunga_utils.models import Upload, Rating, GenericUpload
 from tunga_utils.validators import validate_btc_address, validate_btc_address_or_none
@@ -503,7 +505,8 @@ class Task(models.Model):
                 return True
             if user == self.pm:
                 return True
-            return self.taskaccess_set.filter(user=user).count() == 1
+            # Read from prefetched task access records when available
+            return len([item for item in self.taskaccess_set.all() if item.user_id == user.id]) == 1
         return False
 
     @property
@@ -520,9 +523,42 @@ class Task(models.Model):
             )
         )
 
+    def get_participation_list(self):
+        """
+        Participation for this task, read from prefetched participation when available
+        """
+        prefetched_participation = getattr(self, 'prefetched_participation', None)
+        if prefetched_participation is not None:
+            return prefetched_participation
+        return list(self.participation_set.all())
+
+    def get_prefetched_inclusive_participation(self):
+        """
+        In memory equivalent of subtask_participants_inclusive_filter
+        :return: list of participation or None if participation and sub tasks were not prefetched
+        """
+        prefetched_participation = getattr(self, 'prefetched_participation', None)
+        prefetched_sub_tasks = getattr(self, 'prefetched_sub_tasks', None)
+        if prefetched_participation is None or prefetched_sub_tasks is None:
+            return None
+
+        parent_participant_ids = set([item.user_id for item in prefetched_participation])
+        inclusive_participation = list(prefetched_participation)
+        for sub_task in prefetched_sub_tasks:
+            inclusive_participation.extend([
+                item for item in sub_task.get_participation_list() if item.user_id not in parent_participant_ids
+            ])
+        return inclusive_participation
+
     def get_is_participant(self, user, active_only=True):
+        statuses = active_only and [STATUS_ACCEPTED] or [STATUS_INITIAL, STATUS_ACCEPTED]
+        inclusive_participation = self.get_prefetched_inclusive_participation()
+        if inclusive_participation is not None:
+            return bool([
+                item for item in inclusive_participation if item.user_id == user.id and item.status in statuses
+            ])
         return self.subtask_participants_inclusive_filter.filter(
-            user=user, status__in=active_only and [STATUS_ACCEPTED] or [STATUS_INITIAL, STATUS_ACCEPTED]
+            user=user, status__in=statuses
         ).count() > 0
 
     @staticmethod
@@ -798,6 +834,13 @@ class Task(models.Model):
 
     @property
     def started_at(self):
+        inclusive_participation = self.get_prefetched_inclusive_participation()
+        if inclusive_participation is not None:
+            activation_dates = [
+                item.activated_at for item in inclusive_participation
+                if item.status == STATUS_ACCEPTED and item.activated_at
+            ]
+            return activation_dates and min(activation_dates) or None
         return self.subtask_participants_inclusive_filter.filter(status=STATUS_ACCEPTED).aggregate(
             start_date=Min('activated_at'))['start_date']
 
@@ -807,15 +850,19 @@ class Task(models.Model):
 
     @property
     def assignee(self):
-        try:
-            return self.participation_set.get(
-                assignee=True, status__in=[STATUS_INITIAL, STATUS_ACCEPTED]
-            )
-        except:
-            return None
+        assignees = [
+            item for item in self.get_participation_list()
+            if item.assignee and item.status in [STATUS_INITIAL, STATUS_ACCEPTED]
+        ]
+        if len(assignees) == 1:
+            return assignees[0]
+        return None
 
     @property
     def invoice(self):
+        prefetched_invoices = getattr(self, 'prefetched_invoices', None)
+        if prefetched_invoices is not None:
+            return prefetched_invoices and prefetched_invoices[0] or None
         try:
             return self.taskinvoice_set.all().order_by('-id', '-created_at').first()
         except:
@@ -823,6 +870,9 @@ class Task(models.Model):
 
     @property
     def estimate(self):
+        prefetched_estimates = getattr(self, 'prefetched_estimates', None)
+        if prefetched_estimates is not None:
+            return prefetched_estimates and prefetched_estimates[0] or None
         try:
             return self.estimate_set.all().order_by('-id', '-created_at').first()
         except:
@@ -830,6 +880,9 @@ class Task(models.Model):
 
     @property
     def quote(self):
+        prefetched_quotes = getattr(self, 'prefetched_quotes', None)
+        if prefetched_quotes is not None:
+            return prefetched_quotes and prefetched_quotes[0] or None
         try:
             return self.quote_set.all().order_by('-id', '-created_at').first()
         except:
@@ -954,6 +1007,38 @@ class TaskAccess(models.Model):
         unique_together = ('user', 'task')
 
 
+TASK_VISIBILITY_REASON_CHOICES = (
+    (TASK_VISIBILITY_REASON_CREATOR, 'Created the task'),
+    (TASK_VISIBILITY_REASON_OWNER, 'Owns the task'),
+    (TASK_VISIBILITY_REASON_PM, 'Manages the task'),
+    (TASK_VISIBILITY_REASON_ADMIN, 'Has admin access'),
+    (TASK_VISIBILITY_REASON_PARTICIPANT, 'Invited or accepted participant'),
+    (TASK_VISIBILITY_REASON_REJECTED_PARTICIPANT, 'Rejected participant'),
+    (TASK_VISIBILITY_REASON_CONNECTION, 'Connected to the task creator'),
+)
+
+
+@python_2_unicode_compatible
+class TaskVisibility(models.Model):
+    """
+    Per-user index of the tasks a user can see because of their relationship to the task
+    Kept up to date by signals on Task, Participation, TaskAccess and Connection
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='task_visibility')
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='visibility_index')
+    reason = models.CharField(
+        max_length=30, choices=TASK_VISIBILITY_REASON_CHOICES,
+        help_text=', '.join(['%s - %s' % (item[0], item[1]) for item in TASK_VISIBILITY_REASON_CHOICES])
+    )
+
+    def __str__(self):
+        return '%s - %s (%s)' % (self.user_id, self.task_id, self.reason)
+
+    class Meta:
+        unique_together = ('user', 'task', 'reason')
+        verbose_name_plural = 'task visibility'
+
+
 REQUEST_STATUS_CHOICES = (
     (STATUS_INITIAL, 'Initial'),
     (STATUS_ACCEPTED, 'Accepted'),
@@ -1329,6 +1414,8 @@ class ProgressEvent(models.Model):
         help_text=','.join(['%s - %s' % (item[0], item[1]) for item in PROGRESS_EVENT_TYPE_CHOICES])
     )
     due_at = models.DateTimeField()
+    # Only set for periodic updates, allows at most one periodic update per task per day
+    due_on = models.DateField(blank=True, null=True)
     title = models.CharField(max_length=200, blank=True, null=True)
     description = models.CharField(max_length=1000, blank=True, null=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='legacy_progress_events_created', blank=True,
@@ -1349,6 +1436,7 @@ class ProgressEvent(models.Model):
 
     class Meta:
         # unique_together = ('task', 'due_at')
+        unique_together = ('task', 'due_on')
         ordering = ['-due_at']
 
     @staticmethod
@@ -680,10 +680,10 @@ class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSe
             return False
         user = self.get_current_user()
         if user:
-            if obj.user == user or not user.is_developer or user.pending or not profile_check(user):
+            if obj.user_id == user.id or not user.is_developer or user.pending or not profile_check(user):
                 return False
-            return obj.applicants.filter(id=user.id).count() == 0 and \
-                   obj.participation_set.filter(user=user).count() == 0
+            return not [item for item in obj.application_set.all() if item.user_id == user.id] and \
+                not self.get_user_participation(obj, user)
         return False
 
     def get_can_claim(self, obj):
@@ -718,18 +718,19 @@ class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSe
     def get_my_participation(self, obj):
         user = self.get_current_user()
         if user:
-            try:
-                participation = obj.participation_set.get(user=user)
+            participation = self.get_user_participation(obj, user)
+            if len(participation) == 1:
                 return {
-                    'id': participation.id,
-                    'user': participation.user.id,
-                    'assignee': participation.assignee,
-                    'status': participation.status
+                    'id': participation[0].id,
+                    'user': participation[0].user_id,
+                    'assignee': participation[0].assignee,
+                    'status': participation[0].status
                 }
-            except:
-                pass
         return None
 
+    def get_user_participation(self, obj, user):
+        return [item for item in obj.get_participation_list() if item.user_id == user.id]
+
 
 class MultiTaskPaymentKeyDetailsSerializer(ContentTypeAnnotatedModelSerializer):
     tasks = SimpleTaskSerializer(many=True)
@@ -3,14 +3,16 @@
 from decimal import Decimal
 
 from actstream.signals import action
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch.dispatcher import receiver, Signal
 
 from tunga_activity import verbs
 from tunga_messages.models import Message
 from tunga_messages.tasks import get_or_create_task_channel
+from tunga_profiles.models import Connection
 from tunga_tasks.models import Task, Application, Participation, ProgressEvent, ProgressReport, \
-    IntegrationActivity, Integration, Estimate, Quote, Sprint
+    IntegrationActivity, Integration, Estimate, Quote, Sprint, TaskAccess, TaskInvoice
 from tunga_tasks.notifications.email import notify_estimate_status_email, notify_task_invitation_email, \
     send_task_application_not_selected_email, notify_payment_link_client_email
 from tunga_tasks.notifications.generic import notify_new_task, \
@@ -19,9 +21,11 @@ from tunga_tasks.notifications.generic import notify_new_task, \
 from tunga_tasks.notifications.slack import notify_new_progress_report_slack
 from tunga_tasks.tasks import initialize_task_progress_events, update_task_periodic_updates, \
     create_or_update_hubspot_deal_task
+from tunga_tasks.utils import update_task_visibility, update_connection_task_visibility, get_or_create_task_read_log
 from tunga_utils import hubspot_utils
 from tunga_utils.constants import STATUS_SUBMITTED, STATUS_APPROVED, STATUS_DECLINED, \
     STATUS_ACCEPTED, STATUS_REJECTED, STATUS_INITIAL
+from tunga_utils.pdf_utils import invalidate_pdf_cache, get_pdf_cache_scope
 
 # Task
 task_fully_saved = Signal(providing_args=["task", "new_user"])
@@ -62,6 +66,43 @@ def activity_handler_new_task(sender, instance, created, **kwargs):
     create_or_update_hubspot_deal_task.delay(instance.id)
 
 
+@receiver(post_save, sender=Task)
+def activity_handler_task_read_log(sender, instance, created, **kwargs):
+    if created:
+        get_or_create_task_read_log(instance.user_id, instance.id)
+
+
+@receiver(post_save, sender=Task)
+def task_visibility_handler_task(sender, instance, created, update_fields=None, **kwargs):
+    # Only fields that affect the visibility index trigger an update
+    if created or not update_fields or set(update_fields).intersection(['user', 'owner', 'pm', 'visibility']):
+        update_task_visibility(instance)
+
+
+@receiver(post_save, sender=Participation)
+@receiver(post_save, sender=TaskAccess)
+def task_visibility_handler_task_relation(sender, instance, **kwargs):
+    update_task_visibility(instance.task_id)
+
+
+@receiver(post_delete, sender=Participation)
+@receiver(post_delete, sender=TaskAccess)
+def task_visibility_handler_task_relation_deleted(sender, instance, **kwargs):
+    # Wait for the commit so that cascaded task deletes don't re-create index entries
+    task_id = instance.task_id
+    transaction.on_commit(lambda: update_task_visibility(task_id))
+
+
+@receiver(post_save, sender=Connection)
+def task_visibility_handler_connection(sender, instance, **kwargs):
+    update_connection_task_visibility(instance)
+
+
+@receiver(post_delete, sender=Connection)
+def task_visibility_handler_connection_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: update_connection_task_visibility(instance))
+
+
 @receiver(task_fully_saved, sender=Task)
 def activity_handler_task_fully_saved(sender, task, new_user, **kwargs):
     notify_new_task.delay(task.id, new_user=new_user)
@@ -160,6 +201,12 @@ def activity_handler_new_participant(sender, instance, created, **kwargs):
             update_task_periodic_updates.delay(instance.task.id)
 
 
+@receiver(post_save, sender=Participation)
+def activity_handler_participant_read_log(sender, instance, created, **kwargs):
+    if created:
+        get_or_create_task_read_log(instance.user_id, instance.task_id)
+
+
 @receiver(participation_response, sender=Participation)
 def activity_handler_participation_response(sender, participation, **kwargs):
     if participation.status != STATUS_INITIAL:
@@ -287,3 +334,23 @@ def activity_handler_quote_status_changed(sender, quote, **kwargs):
         task.save()
 
     notify_estimate_status_email(quote.id, estimate_type='quote')
+
+
+@receiver(post_save, sender=Task)
+def activity_handler_task_pdf_cache(sender, instance, **kwargs):
+    invalidate_pdf_cache(get_pdf_cache_scope('task_invoice', instance.id))
+
+
+@receiver(post_save, sender=TaskInvoice)
+def activity_handler_task_invoice_pdf_cache(sender, instance, **kwargs):
+    invalidate_pdf_cache(get_pdf_cache_scope('task_invoice', instance.task_id))
+
+
+@receiver(post_save, sender=Estimate)
+def activity_handler_estimate_pdf_cache(sender, instance, **kwargs):
+    invalidate_pdf_cache(get_pdf_cache_scope('estimate', instance.id))
+
+
+@receiver(post_save, sender=Quote)
+def activity_handler_quote_pdf_cache(sender, instance, **kwargs):
+    invalidate_pdf_cache(get_pdf_cache_scope('quote', instance.id))
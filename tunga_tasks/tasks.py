@@ -16,10 +16,10 @@ from tunga.settings import BITPESA_SENDER
 from tunga_tasks.background import process_invoices
 from tunga_tasks.models import ProgressEvent, Task, ParticipantPayment, \
     TaskInvoice, Participation, MultiTaskPaymentKey, TaskPayment
+from tunga_tasks.utils import get_next_update_at
 from tunga_utils import bitcoin_utils, coinbase_utils, bitpesa, payoneer_utils, exact_utils
 from tunga_utils.constants import CURRENCY_BTC, PAYMENT_METHOD_BTC_WALLET, \
-    PAYMENT_METHOD_BTC_ADDRESS, PAYMENT_METHOD_MOBILE_MONEY, UPDATE_SCHEDULE_HOURLY, UPDATE_SCHEDULE_DAILY, \
-    UPDATE_SCHEDULE_WEEKLY, UPDATE_SCHEDULE_MONTHLY, UPDATE_SCHEDULE_QUATERLY, UPDATE_SCHEDULE_ANNUALLY, \
+    PAYMENT_METHOD_BTC_ADDRESS, PAYMENT_METHOD_MOBILE_MONEY, \
     LEGACY_PROGRESS_EVENT_TYPE_PERIODIC, LEGACY_PROGRESS_EVENT_TYPE_SUBMIT, STATUS_PENDING, STATUS_PROCESSING, \
     STATUS_INITIATED, LEGACY_PROGRESS_EVENT_TYPE_COMPLETE, STATUS_ACCEPTED, \
     LEGACY_PROGRESS_EVENT_TYPE_PM, LEGACY_PROGRESS_EVENT_TYPE_CLIENT, PAYMENT_METHOD_BITCOIN, STATUS_RETRY, \
@@ -92,45 +92,21 @@ def update_task_periodic_updates(task):
             ).aggregate(start_date=Min('activated_at'))['start_date']
 
         if periodic_start_date:
-            period_map = {
-                UPDATE_SCHEDULE_HOURLY: 'hours',
-                UPDATE_SCHEDULE_DAILY: 'days',
-                UPDATE_SCHEDULE_WEEKLY: 'weeks',
-                UPDATE_SCHEDULE_MONTHLY: 'months',
-                UPDATE_SCHEDULE_QUATERLY: {'months': 3},
-                UPDATE_SCHEDULE_ANNUALLY: 'years'
-            }
-            period_info = period_map.get(target_task.update_interval_units, None)
-            if period_info:
-                unit = isinstance(period_info, dict) and period_info.keys()[0] or period_info
-                multiplier = isinstance(period_info, dict) and period_info.values()[0] or 1
-                delta = dict()
-                delta[unit] = multiplier * target_task.update_interval
-                last_update_at = clean_update_datetime(periodic_start_date, target_task)
-                while True:
-                    next_update_at = last_update_at + relativedelta(**delta)
-                    if next_update_at.weekday() in [5, 6]:
-                        # Don't schedule updates on weekends
-                        next_update_at += relativedelta(days=7 - next_update_at.weekday())
-
-                    if next_update_at >= now:
-                        future_by_18_hours = now + relativedelta(hours=18)
-                        if (not target_task.pause_updates_until or target_task.pause_updates_until < next_update_at) \
-                                and next_update_at <= future_by_18_hours and (
-                            not target_task.deadline or next_update_at < target_task.deadline):
-                            num_updates_within_on_same_day = ProgressEvent.objects.filter(
-                                task=target_task, type=LEGACY_PROGRESS_EVENT_TYPE_PERIODIC,
-                                due_at__contains=next_update_at.date()
-                            ).count()
-
-                            if num_updates_within_on_same_day == 0:
-                                # Schedule at most one periodic update for any day
-                                ProgressEvent.objects.update_or_create(
-                                    task=target_task, type=LEGACY_PROGRESS_EVENT_TYPE_PERIODIC, due_at=next_update_at
-                                )
-                        break
-                    else:
-                        last_update_at = next_update_at
+            after = now
+            if target_task.pause_updates_until and target_task.pause_updates_until >= now:
+                after = target_task.pause_updates_until + relativedelta(microseconds=1)
+
+            next_update_at = get_next_update_at(
+                clean_update_datetime(periodic_start_date, target_task),
+                target_task.update_interval, target_task.update_interval_units, after
+            )
+            if next_update_at and next_update_at <= now + relativedelta(hours=18) and (
+                    not target_task.deadline or next_update_at < target_task.deadline):
+                # Schedule at most one periodic update for any day
+                ProgressEvent.objects.get_or_create(
+                    task=target_task, type=LEGACY_PROGRESS_EVENT_TYPE_PERIODIC, due_on=next_update_at.date(),
+                    defaults=dict(due_at=next_update_at)
+                )
 
 
 @job
@@ -625,24 +601,25 @@ def update_multi_tasks(multi_task_key, distribute=False):
 
 
 @job
-def sync_exact_invoices(task, invoice_types=('client', 'tunga', 'developer'), developers=None):
+def sync_exact_invoices(task, invoice_types=('client', 'tunga', 'developer'), developers=None, exact_api=None):
     task = clean_instance(task, Task)
     invoice = task.invoice
     client = task.owner or task.user
 
     admin_emails = ['david@tunga.io', 'bart@tunga.io', 'domieck@tunga.io']
 
+    # PDFs are only rendered for invoices that still need to be uploaded
     if 'client' in invoice_types and task.paid and client.type == USER_TYPE_PROJECT_OWNER \
             and client.email not in admin_emails:
         # Only sync paid invoices whose project owner is not a Tunga admin
-        invoice_file_client = HTML(
-            string=process_invoices(task.id, invoice_types=['client'], user_id=client.id, is_admin=False),
-            encoding='utf-8'
-        ).write_pdf()
         exact_utils.upload_invoice(
-            task, client, 'client', invoice_file_client,
+            task, client, 'client',
+            lambda: HTML(
+                string=process_invoices(task.id, invoice_types=['client'], user_id=client.id, is_admin=False),
+                encoding='utf-8'
+            ).write_pdf(),
             float(invoice.amount.get('total_invoice_client', 0)),
-            vat_location=invoice.vat_location_client
+            vat_location=invoice.vat_location_client, exact_api=exact_api
         )
 
     participation_shares = task.get_participation_shares()
@@ -660,26 +637,27 @@ def sync_exact_invoices(task, invoice_types=('client', 'tunga', 'developer'), de
             amount_details = invoice.get_amount_details(share=share_info['share'])
 
             if 'tunga' in invoice_types:
-                invoice_file_tunga = HTML(
-                    string=process_invoices(
-                        task.id, invoice_types=['tunga'], user_id=dev.id, developer_ids=[dev.id], is_admin=False
-                    ),
-                    encoding='utf-8'
-                ).write_pdf()
                 exact_utils.upload_invoice(
-                    task, dev, 'tunga', invoice_file_tunga,
-                    float(amount_details.get('total_invoice_tunga', 0))
+                    task, dev, 'tunga',
+                    lambda: HTML(
+                        string=process_invoices(
+                            task.id, invoice_types=['tunga'], user_id=dev.id, developer_ids=[dev.id], is_admin=False
+                        ),
+                        encoding='utf-8'
+                    ).write_pdf(),
+                    float(amount_details.get('total_invoice_tunga', 0)), exact_api=exact_api
                 )
 
             if 'developer' in invoice_types and invoice.version == 1:
                 # Developer (tunga invoicing dev) invoices are only part of the old invoice scheme
-                invoice_file_dev = HTML(
-                    string=process_invoices(
-                        task.id, invoice_types=['developer'], user_id=dev.id, developer_ids=[dev.id], is_admin=False
-                    ),
-                    encoding='utf-8'
-                ).write_pdf()
                 exact_utils.upload_invoice(
-                    task, dev, 'developer', invoice_file_dev,
-                    float(amount_details.get('total_invoice_developer', 0))
+                    task, dev, 'developer',
+                    lambda: HTML(
+                        string=process_invoices(
+                            task.id, invoice_types=['developer'], user_id=dev.id, developer_ids=[dev.id],
+                            is_admin=False
+                        ),
+                        encoding='utf-8'
+                    ).write_pdf(),
+                    float(amount_details.get('total_invoice_developer', 0)), exact_api=exact_api
                 )
@@ -3,18 +3,26 @@ from copy import copy
 
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
-from tunga_tasks.models import Task, ProgressEvent
+from tunga_activity.models import ActivityReadLog
+from tunga_profiles.models import Connection, UserProfile
+from tunga_tasks.models import Task, ProgressEvent, Participation, TaskVisibility, TaskInvoice, Estimate, Quote
 from tunga_utils.constants import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER, STATUS_ACCEPTED, TASK_TYPE_WEB, \
     TASK_SCOPE_TASK, USER_TYPE_PROJECT_MANAGER, STATUS_REJECTED, TASK_SCOPE_PROJECT, \
     LEGACY_PROGRESS_EVENT_TYPE_PERIODIC, \
     LEGACY_PROGRESS_REPORT_STATUS_ON_SCHEDULE, LEGACY_PROGRESS_REPORT_STATUS_BEHIND_AND_STUCK, \
     LEGACY_PROGRESS_REPORT_STUCK_REASON_ERROR, \
-    LEGACY_PROGRESS_EVENT_TYPE_CLIENT, LEGACY_PROGRESS_EVENT_TYPE_PM
+    LEGACY_PROGRESS_EVENT_TYPE_CLIENT, LEGACY_PROGRESS_EVENT_TYPE_PM, VISIBILITY_MY_TEAM, \
+    TASK_VISIBILITY_REASON_CREATOR, TASK_VISIBILITY_REASON_CONNECTION, UPDATE_SCHEDULE_HOURLY, UPDATE_SCHEDULE_DAILY, \
+    UPDATE_SCHEDULE_WEEKLY, UPDATE_SCHEDULE_MONTHLY, PAYMENT_METHOD_BANK
+from tunga_tasks.utils import get_next_update_at, get_missing_task_read_logs, create_task_read_logs
 
 
 class APITaskTestCase(APITestCase):
@@ -189,6 +197,118 @@ class APITaskTestCase(APITestCase):
         response = self.client.patch(url, data)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_list_tasks_query_count(self):
+        """
+        Listing tasks runs the same number of queries regardless of the number of tasks
+        """
+        url = '{}?simple=true'.format(reverse('task-list'))
+        self.__auth_project_owner()
+
+        self.__create_task_with_participant()
+        with CaptureQueriesContext(connection) as single_task_queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+        for i in range(4):
+            self.__create_task_with_participant()
+        with CaptureQueriesContext(connection) as multiple_task_queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertLessEqual(len(multiple_task_queries), len(single_task_queries))
+
+    def test_list_tasks_full_query_count(self):
+        """
+        Listing tasks with the full serializer (participation, invoices, estimates and quotes)
+        runs the same number of queries regardless of the number of tasks
+        """
+        url = reverse('task-list')
+        self.__auth_project_owner()
+
+        self.__create_task_with_relations()
+        with CaptureQueriesContext(connection) as single_task_queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+        for i in range(4):
+            self.__create_task_with_relations()
+        with CaptureQueriesContext(connection) as multiple_task_queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertLessEqual(len(multiple_task_queries), len(single_task_queries))
+
+    def test_task_visibility_index(self):
+        """
+        Developers only see team tasks of clients they are connected to
+        """
+        task = self.__create_task()
+        task.visibility = VISIBILITY_MY_TEAM
+        task.approved = True
+        task.save()
+        self.assertTrue(
+            TaskVisibility.objects.filter(
+                user=self.project_owner, task=task, reason=TASK_VISIBILITY_REASON_CREATOR
+            ).count()
+        )
+
+        url = reverse('task-list')
+        self.__auth_developer()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 0)
+
+        Connection.objects.create(
+            from_user=self.project_owner, to_user=self.developer, accepted=True, status=STATUS_ACCEPTED
+        )
+        self.assertTrue(
+            TaskVisibility.objects.filter(
+                user=self.developer, task=task, reason=TASK_VISIBILITY_REASON_CONNECTION
+            ).count()
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_task_read_logs(self):
+        """
+        Task owners and participants get read logs on creation, missing ones are backfilled in bulk
+        """
+        task = self.__create_task_with_participant()
+        read_logs = ActivityReadLog.objects.filter(tasks=task)
+        self.assertEqual(
+            set(read_logs.values_list('user_id', flat=True)), {self.project_owner.id, self.developer.id}
+        )
+
+        read_logs.delete()
+        missing_logs = get_missing_task_read_logs()
+        self.assertEqual(missing_logs, {(self.project_owner.id, task.id), (self.developer.id, task.id)})
+
+        create_task_read_logs(missing_logs)
+        self.assertEqual(read_logs.count(), 2)
+        self.assertEqual(get_missing_task_read_logs(), set())
+
+    def test_list_tasks_skill_matches(self):
+        """
+        Skills filter ranks tasks by the number of skills they share with the user
+        """
+        partial_match = Task.objects.create(
+            title='Task 2', description='Task 2 description', skills='Django', fee=15, user=self.project_owner
+        )
+        full_match = self.__create_task()
+        Task.objects.create(
+            title='Task 3', description='Task 3 description', skills='PHP', fee=15, user=self.project_owner
+        )
+        UserProfile.objects.create(user=self.admin, skills='Django, React.js')
+
+        url = reverse('task-list')
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(url, {'filter': 'skills'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([task['id'] for task in response.data['results']], [full_match.id, partial_match.id])
+
     def test_create_developer_progress_report(self):
         """
         Developer can share progress reports
@@ -419,9 +539,64 @@ class APITaskTestCase(APITestCase):
             skills='Django, React.js', fee=15, user=self.project_owner
         )
 
+    def __create_task_with_participant(self):
+        task = self.__create_task()
+        Participation.objects.create(
+            task=task, user=self.developer, status=STATUS_ACCEPTED, created_by=self.project_owner,
+            activated_at=datetime.datetime.utcnow()
+        )
+        return task
+
+    def __create_task_with_relations(self):
+        task = self.__create_task_with_participant()
+        TaskInvoice.objects.create(
+            task=task, user=self.project_owner, title=task.title, fee=task.fee, client=self.project_owner,
+            developer=self.developer, payment_method=PAYMENT_METHOD_BANK
+        )
+        Estimate.objects.create(user=self.project_manager, task=task, introduction='Estimate introduction')
+        Quote.objects.create(
+            user=self.project_manager, task=task, introduction='Quote introduction', in_scope='In scope',
+            out_scope='Out of scope', assumptions='Assumptions', deliverables='Deliverables',
+            architecture='Architecture', technology='Technology', process='Process', reporting='Reporting'
+        )
+        return task
+
     def __create_progress_event(self, task, event_type=LEGACY_PROGRESS_EVENT_TYPE_PERIODIC):
         if not task:
             task = self.__create_task()
         return ProgressEvent.objects.create(
             task=task, type=event_type, due_at=datetime.datetime.utcnow()
         )
+
+
+class UpdateScheduleTestCase(SimpleTestCase):
+
+    def test_next_update_at(self):
+        start = datetime.datetime(2016, 1, 4, 12)  # Monday
+
+        # Hourly updates years later without stepping through every hour
+        self.assertEqual(
+            get_next_update_at(start, 1, UPDATE_SCHEDULE_HOURLY, datetime.datetime(2018, 10, 17, 9, 30)),
+            datetime.datetime(2018, 10, 17, 10)
+        )
+
+        # Weekend updates move to Monday
+        self.assertEqual(
+            get_next_update_at(start, 1, UPDATE_SCHEDULE_DAILY, datetime.datetime(2018, 10, 19, 13)),
+            datetime.datetime(2018, 10, 22, 12)
+        )
+        self.assertEqual(
+            get_next_update_at(
+                datetime.datetime(2018, 10, 6, 12), 1, UPDATE_SCHEDULE_WEEKLY, datetime.datetime(2018, 10, 18)
+            ),
+            datetime.datetime(2018, 10, 22, 12)
+        )
+
+        # Monthly updates stay on the start day
+        self.assertEqual(
+            get_next_update_at(
+                datetime.datetime(2018, 1, 31, 12), 1, UPDATE_SCHEDULE_MONTHLY, datetime.datetime(2018, 5, 1)
+            ),
+            datetime.datetime(2018, 5, 31, 12)
+        )
+        self.assertIsNone(get_next_update_at(start, 1, 'fortnightly', datetime.datetime(2018, 10, 17)))
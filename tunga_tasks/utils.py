@@ -1,17 +1,41 @@
+import datetime
 import json
 
+from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
-from django.db.models import When, Sum, Case, IntegerField, F
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction, IntegrityError
+from django.db.models import When, Sum, Case, IntegerField, F, Prefetch
+from django.db.models.expressions import Exists, OuterRef
+from django.db.models.query_utils import Q
 from django.utils import six
 
 from allauth.socialaccount.providers.github.provider import GitHubProvider
 
+from tunga_activity.models import ActivityReadLog
 from tunga_auth.filterbackends import my_connections_q_filter
 from tunga_profiles.utils import get_app_integration
-from tunga_tasks.models import Integration, IntegrationMeta
+from tunga_profiles.models import Connection
+from tunga_tasks.models import Integration, IntegrationMeta, Task, TaskInvoice, Estimate, Quote, Participation, \
+    TaskAccess, TaskVisibility
 from tunga_utils.constants import APP_INTEGRATION_PROVIDER_SLACK, APP_INTEGRATION_PROVIDER_HARVEST, STATUS_ACCEPTED, \
-    USER_TYPE_DEVELOPER, VISIBILITY_MY_TEAM
-from tunga_utils.helpers import clean_meta_value, get_social_token, GenericObject
+    USER_TYPE_DEVELOPER, VISIBILITY_MY_TEAM, STATUS_INITIAL, TASK_VISIBILITY_REASON_CREATOR, \
+    TASK_VISIBILITY_REASON_OWNER, TASK_VISIBILITY_REASON_PM, TASK_VISIBILITY_REASON_ADMIN, \
+    TASK_VISIBILITY_REASON_PARTICIPANT, TASK_VISIBILITY_REASON_REJECTED_PARTICIPANT, TASK_VISIBILITY_REASON_CONNECTION, \
+    UPDATE_SCHEDULE_HOURLY, UPDATE_SCHEDULE_DAILY, UPDATE_SCHEDULE_WEEKLY, UPDATE_SCHEDULE_MONTHLY, \
+    UPDATE_SCHEDULE_QUATERLY, UPDATE_SCHEDULE_ANNUALLY
+from tunga_utils.helpers import clean_meta_value, get_social_token, GenericObject, clean_instance, \
+    bulk_create_with_signals
+
+# update schedule units -> (unit, multiplier)
+UPDATE_SCHEDULE_PERIODS = {
+    UPDATE_SCHEDULE_HOURLY: ('hours', 1),
+    UPDATE_SCHEDULE_DAILY: ('days', 1),
+    UPDATE_SCHEDULE_WEEKLY: ('weeks', 1),
+    UPDATE_SCHEDULE_MONTHLY: ('months', 1),
+    UPDATE_SCHEDULE_QUATERLY: ('months', 3),
+    UPDATE_SCHEDULE_ANNUALLY: ('years', 1)
+}
 
 
 def get_task_integration(task, provider):
@@ -136,4 +160,377 @@ def get_suggested_community_receivers(instance, user_type=USER_TYPE_DEVELOPER, r
         queryset = queryset.order_by(*ordering)
     if queryset:
         return queryset[:15]
-    return
\ No newline at end of file
+    return
+
+
+def get_user_query_plan(prefix):
+    """
+    select_related and prefetch_related lookups needed to serialize a related user
+    e.g SimpleUserSerializer reads the profile, company and social accounts (for the avatar)
+    :param prefix: lookup path of the user relative to the queryset model
+    :return: (select_related, prefetch_related)
+    """
+    return (
+        ['{}__userprofile'.format(prefix), '{}__user_company__city'.format(prefix)],
+        ['{}__socialaccount_set'.format(prefix), '{}__user_company__skills'.format(prefix)]
+    )
+
+
+def get_task_query_plan():
+    """
+    Maps Task serializer fields to the select_related and prefetch_related lookups they need
+    """
+    user_plan = get_user_query_plan('user')
+    owner_plan = get_user_query_plan('owner')
+    pm_plan = get_user_query_plan('pm')
+
+    participation_prefetch = Prefetch(
+        'participation_set',
+        queryset=Participation.objects.select_related('user__userprofile', 'user__user_company'),
+        to_attr='prefetched_participation'
+    )
+    inclusive_participation_plan = (
+        [], [
+            participation_prefetch,
+            Prefetch('sub_tasks', queryset=Task.objects.all(), to_attr='prefetched_sub_tasks'),
+            Prefetch('prefetched_sub_tasks__participation_set', to_attr='prefetched_participation')
+        ]
+    )
+    invoices_plan = (
+        [], [
+            Prefetch(
+                'taskinvoice_set',
+                queryset=TaskInvoice.objects.select_related(
+                    'client__userprofile', 'developer__userprofile'
+                ).order_by('-id', '-created_at'),
+                to_attr='prefetched_invoices'
+            )
+        ]
+    )
+    estimates_plan = (
+        ['pm'], [
+            Prefetch(
+                'estimate_set',
+                queryset=Estimate.objects.select_related(
+                    'user', 'moderated_by', 'reviewed_by'
+                ).order_by('-id', '-created_at'),
+                to_attr='prefetched_estimates'
+            )
+        ]
+    )
+    quotes_plan = (
+        [], [
+            Prefetch(
+                'quote_set',
+                queryset=Quote.objects.select_related(
+                    'user', 'moderated_by', 'reviewed_by'
+                ).order_by('-id', '-created_at'),
+                to_attr='prefetched_quotes'
+            )
+        ]
+    )
+
+    return {
+        'user': user_plan,
+        'owner': owner_plan,
+        'pm': pm_plan,
+        'project': (['project'], []),
+        'parent': (['parent__user'], []),
+        'skills': ([], ['skills']),
+        'pay_dev': (['pm'], []),
+        'pay_pm': (['pm'], []),
+        'dev_hrs': (['pm'], []),
+        'pm_hrs': (['pm'], []),
+        'display_fee': (['pm'], []),
+        'amount': (
+            ['pm', 'user__userprofile', 'owner__userprofile'], []
+        ),
+        'can_apply': (
+            ['pm'], [participation_prefetch, 'application_set'] + estimates_plan[1]
+        ),
+        'can_return': estimates_plan,
+        'is_developer_ready': estimates_plan,
+        'requires_estimate': estimates_plan,
+        'estimate': estimates_plan,
+        'quote': quotes_plan,
+        'invoice': invoices_plan,
+        'is_admin': ([], ['taskaccess_set']),
+        'is_participant': inclusive_participation_plan,
+        'started_at': inclusive_participation_plan,
+        'started': inclusive_participation_plan,
+        'my_participation': ([], [participation_prefetch]),
+        'assignee': ([], [participation_prefetch]),
+        'ratings': ([], ['ratings__created_by']),
+        'uploads': ([], ['uploads__user']),
+        'documents': ([], ['taskdocument_set__created_by']),
+        'progress_events': ([], ['progressevent_set__created_by']),
+        'details': (
+            ['project', 'parent__user'] + owner_plan[0] + pm_plan[0],
+            ['skills', 'application_set__user', 'taskaccess_set__user'] + owner_plan[1] + pm_plan[1]
+        )
+    }
+
+
+def optimize_task_queryset(queryset, serializer_class):
+    """
+    Builds a select_related/prefetch_related plan from the fields the serializer will actually render
+    to avoid N+1 queries when listing tasks
+    """
+    select_related = set()
+    prefetch_related = []
+    prefetch_lookups = set()
+
+    query_plan = get_task_query_plan()
+    for field_name in serializer_class().fields.keys():
+        field_select_related, field_prefetch_related = query_plan.get(field_name, ([], []))
+        select_related.update(field_select_related)
+        for lookup in field_prefetch_related:
+            lookup_key = isinstance(lookup, Prefetch) and lookup.prefetch_to or lookup
+            if lookup_key not in prefetch_lookups:
+                prefetch_lookups.add(lookup_key)
+                prefetch_related.append(lookup)
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+
+def get_participation_visibility_reason(status):
+    if status in [STATUS_INITIAL, STATUS_ACCEPTED]:
+        return TASK_VISIBILITY_REASON_PARTICIPANT
+    return TASK_VISIBILITY_REASON_REJECTED_PARTICIPANT
+
+
+def get_task_visibility_entries(task):
+    """
+    Computes the (user_id, reason) pairs that make a task visible to specific users
+    """
+    entries = set()
+    entries.add((task.user_id, TASK_VISIBILITY_REASON_CREATOR))
+    if task.owner_id:
+        entries.add((task.owner_id, TASK_VISIBILITY_REASON_OWNER))
+    if task.pm_id:
+        entries.add((task.pm_id, TASK_VISIBILITY_REASON_PM))
+
+    for user_id in TaskAccess.objects.filter(task=task).values_list('user_id', flat=True):
+        entries.add((user_id, TASK_VISIBILITY_REASON_ADMIN))
+
+    for user_id, status in Participation.objects.filter(task=task).values_list('user_id', 'status'):
+        entries.add((user_id, get_participation_visibility_reason(status)))
+
+    if task.visibility == VISIBILITY_MY_TEAM:
+        connected_user_ids = list(
+            Connection.objects.filter(from_user_id=task.user_id, accepted=True).values_list('to_user_id', flat=True)
+        ) + list(
+            Connection.objects.filter(to_user_id=task.user_id, status=STATUS_ACCEPTED).values_list(
+                'from_user_id', flat=True
+            )
+        )
+        for user_id in connected_user_ids:
+            entries.add((user_id, TASK_VISIBILITY_REASON_CONNECTION))
+    return entries
+
+
+def update_task_visibility(task):
+    """
+    Syncs the task visibility index for a single task
+    """
+    task = clean_instance(task, Task)
+    if not task:
+        return
+
+    entries = get_task_visibility_entries(task)
+    existing_entries = set(TaskVisibility.objects.filter(task=task).values_list('user_id', 'reason'))
+
+    stale_entries = existing_entries - entries
+    if stale_entries:
+        stale_q = Q()
+        for user_id, reason in stale_entries:
+            stale_q |= Q(user_id=user_id, reason=reason)
+        TaskVisibility.objects.filter(task=task).filter(stale_q).delete()
+
+    new_entries = entries - existing_entries
+    if new_entries:
+        try:
+            with transaction.atomic():
+                TaskVisibility.objects.bulk_create([
+                    TaskVisibility(user_id=user_id, task=task, reason=reason) for user_id, reason in new_entries
+                ])
+        except IntegrityError:
+            # A concurrent update already inserted some of the entries
+            for user_id, reason in new_entries:
+                TaskVisibility.objects.get_or_create(user_id=user_id, task=task, reason=reason)
+
+
+def update_connection_task_visibility(connection):
+    """
+    Syncs the task visibility index for team only tasks created by either side of the connection
+    """
+    tasks = Task.objects.filter(
+        user_id__in=[connection.from_user_id, connection.to_user_id], visibility=VISIBILITY_MY_TEAM
+    )
+    for task in tasks:
+        update_task_visibility(task)
+
+
+def rebuild_task_visibility(batch_size=1000):
+    """
+    Rebuilds the task visibility index from scratch using a few grouped queries
+    :return: number of index entries created
+    """
+    entries = set()
+    team_tasks = dict()
+    for task_id, user_id, owner_id, pm_id, visibility in Task.objects.values_list(
+            'id', 'user_id', 'owner_id', 'pm_id', 'visibility'
+    ):
+        entries.add((user_id, task_id, TASK_VISIBILITY_REASON_CREATOR))
+        if owner_id:
+            entries.add((owner_id, task_id, TASK_VISIBILITY_REASON_OWNER))
+        if pm_id:
+            entries.add((pm_id, task_id, TASK_VISIBILITY_REASON_PM))
+        if visibility == VISIBILITY_MY_TEAM:
+            team_tasks.setdefault(user_id, []).append(task_id)
+
+    for user_id, task_id in TaskAccess.objects.values_list('user_id', 'task_id'):
+        entries.add((user_id, task_id, TASK_VISIBILITY_REASON_ADMIN))
+
+    for user_id, task_id, status in Participation.objects.values_list('user_id', 'task_id', 'status'):
+        entries.add((user_id, task_id, get_participation_visibility_reason(status)))
+
+    if team_tasks:
+        connections = list(
+            Connection.objects.filter(from_user_id__in=team_tasks.keys(), accepted=True).values_list(
+                'from_user_id', 'to_user_id'
+            )
+        ) + [
+            (creator_id, user_id) for user_id, creator_id in Connection.objects.filter(
+                to_user_id__in=team_tasks.keys(), status=STATUS_ACCEPTED
+            ).values_list('from_user_id', 'to_user_id')
+        ]
+        for creator_id, user_id in connections:
+            for task_id in team_tasks.get(creator_id, []):
+                entries.add((user_id, task_id, TASK_VISIBILITY_REASON_CONNECTION))
+
+    with transaction.atomic():
+        TaskVisibility.objects.all().delete()
+        TaskVisibility.objects.bulk_create(
+            [TaskVisibility(user_id=user_id, task_id=task_id, reason=reason) for user_id, task_id, reason in entries],
+            batch_size=batch_size
+        )
+    return len(entries)
+
+
+def get_update_occurrence(start, unit, step, index):
+    if unit in ['months', 'years']:
+        # Always offset from start so month end clamping doesn't drift the schedule
+        return start + relativedelta(**{unit: step * index})
+    return start + datetime.timedelta(**{unit: step * index})
+
+
+def get_microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def get_update_occurrence_index(start, unit, step, moment):
+    """
+    :return: smallest index >= 1 for which the occurrence is at or after moment
+    """
+    if moment <= start:
+        return 1
+
+    if unit in ['months', 'years']:
+        months = (moment.year - start.year) * 12 + moment.month - start.month
+        index = max(months // (unit == 'years' and 12 * step or step), 1)
+        # The estimate is off by at most one because of day and time differences
+        while index > 1 and get_update_occurrence(start, unit, step, index - 1) >= moment:
+            index -= 1
+        while get_update_occurrence(start, unit, step, index) < moment:
+            index += 1
+        return index
+
+    step_microseconds = get_microseconds(datetime.timedelta(**{unit: step}))
+    return max(-(-get_microseconds(moment - start) // step_microseconds), 1)
+
+
+def skip_weekend(moment):
+    if moment.weekday() in [5, 6]:
+        # Don't schedule updates on weekends
+        return moment + relativedelta(days=7 - moment.weekday())
+    return moment
+
+
+def get_next_update_at(start, interval, interval_units, after):
+    """
+    Computes the first update at or after a moment for updates every interval units from start,
+    jumping straight to it instead of stepping through past updates. Weekend updates move to the following Monday.
+    :return: datetime or None if the schedule is invalid
+    """
+    unit, multiplier = UPDATE_SCHEDULE_PERIODS.get(interval_units, (None, None))
+    if not unit or not interval:
+        return None
+    step = multiplier * interval
+
+    # Weekend updates move forward by at most 2 days, so occurrences from 2 days before can still land after
+    index = get_update_occurrence_index(start, unit, step, after - datetime.timedelta(days=2))
+    next_update_at = None
+    while True:
+        occurrence = get_update_occurrence(start, unit, step, index)
+        if next_update_at and occurrence >= next_update_at:
+            # Later occurrences can't move before this one
+            return next_update_at
+        update_at = skip_weekend(occurrence)
+        if update_at >= after and (not next_update_at or update_at < next_update_at):
+            next_update_at = update_at
+        index += 1
+
+
+def get_missing_task_read_logs():
+    """
+    Anti-joins open tasks and their participations against the read logs
+    :return: set of (user_id, task_id) for task owners and participants without a read log
+    """
+    content_type = ContentType.objects.get_for_model(Task)
+
+    def read_logs(user_field, task_field):
+        return ActivityReadLog.objects.filter(
+            content_type=content_type, user_id=OuterRef(user_field), object_id=OuterRef(task_field)
+        )
+
+    missing_logs = set(
+        Task.objects.filter(closed=False).annotate(
+            has_read_log=Exists(read_logs('user_id', 'id'))
+        ).filter(has_read_log=False).values_list('user_id', 'id')
+    )
+    missing_logs.update(
+        Participation.objects.filter(task__closed=False).annotate(
+            has_read_log=Exists(read_logs('user_id', 'task_id'))
+        ).filter(has_read_log=False).values_list('user_id', 'task_id')
+    )
+    return missing_logs
+
+
+def create_task_read_logs(user_task_ids):
+    """
+    Creates read logs for (user_id, task_id) pairs with a single insert
+    """
+    user_task_ids = set(user_task_ids)
+    if not user_task_ids:
+        return
+    content_type = ContentType.objects.get_for_model(Task)
+
+    bulk_create_with_signals(
+        ActivityReadLog, [
+            ActivityReadLog(user_id=user_id, content_type=content_type, object_id=task_id)
+            for user_id, task_id in user_task_ids
+        ],
+        lookup_fields=('user_id', 'content_type_id', 'object_id')
+    )
+
+
+def get_or_create_task_read_log(user_id, task_id):
+    return ActivityReadLog.objects.get_or_create(
+        user_id=user_id, content_type=ContentType.objects.get_for_model(Task), object_id=task_id
+    )
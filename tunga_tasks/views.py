@@ -4,13 +4,12 @@ import datetime
 from decimal import Decimal
 from six.moves.urllib_parse import urlencode, quote_plus
 
-import django_rq
 from allauth.socialaccount.providers.github.provider import GitHubProvider
 from dateutil.parser import parse
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Sum
 from django.db.models.query_utils import Q
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, JsonResponse
 from django.shortcuts import redirect
 from django.template.loader import render_to_string
 from django.utils import six
@@ -28,10 +27,10 @@ from rest_framework.renderers import StaticHTMLRenderer
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from stripe.error import InvalidRequestError
-from weasyprint import HTML
 
 from tunga.settings import BITONIC_CONSUMER_KEY, BITONIC_CONSUMER_SECRET, BITONIC_ACCESS_TOKEN, BITONIC_TOKEN_SECRET, \
-    BITONIC_URL, TUNGA_URL
+    BITONIC_URL
+from tunga_activity.filterbackends import ACTIVITY_FILTER_BACKENDS
 from tunga_activity.filters import ActionFilter
 from tunga_activity.models import ActivityReadLog
 from tunga_activity.serializers import SimpleActivitySerializer, LastReadActivitySerializer
@@ -56,12 +55,14 @@ from tunga_tasks.serializers import TaskSerializer, ApplicationSerializer, Parti
     TaskDocumentSerializer
 from tunga_tasks.tasks import complete_bitpesa_payment, \
     update_multi_tasks
-from tunga_tasks.utils import save_integration_tokens, get_integration_token
+from tunga_tasks.utils import save_integration_tokens, get_integration_token, optimize_task_queryset
 from tunga_utils import github, coinbase_utils, bitcoin_utils, bitpesa, stripe_utils
 from tunga_utils.constants import PAYMENT_METHOD_BITONIC, STATUS_ACCEPTED, \
     PAYMENT_METHOD_STRIPE, CURRENCY_EUR, PAYMENT_METHOD_BITCOIN
 from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
 from tunga_utils.mixins import SaveUploadsMixin
+from tunga_utils.pagination import KeysetPagination
+from tunga_utils.pdf_utils import render_pdf, get_pdf_cache_scope, enqueue_pdf_job, get_pdf_job_details
 from tunga_utils.serializers import TaskInvoiceSerializer
 
 
@@ -109,6 +110,13 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
     filter_backends = DEFAULT_FILTER_BACKENDS + (TaskFilterBackend,)
     search_fields = ('title', 'description', 'skills__name')
 
+    def get_queryset(self):
+        queryset = super(TaskViewSet, self).get_queryset()
+        if self.action in ['list', 'retrieve']:
+            # Only load the relations the chosen serializer will render
+            queryset = optimize_task_queryset(queryset, self.get_serializer_class())
+        return queryset
+
     def get_serializer_class(self):
         if self.request.GET.get('simple', False):
             return SimpleTaskSerializer
@@ -195,8 +203,9 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         permission_classes=[IsAuthenticated],
         serializer_class=SimpleActivitySerializer,
         filter_class=None,
-        filter_backends=DEFAULT_FILTER_BACKENDS,
-        search_fields=('comments__body',)
+        filter_backends=ACTIVITY_FILTER_BACKENDS,
+        search_fields=('comments__body',),
+        pagination_class=KeysetPagination
     )
     def activity(self, request, pk=None):
         """
@@ -509,7 +518,9 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
                 if request.accepted_renderer.format == 'html':
                     return HttpResponse(rendered_html)
                 if target_task:
-                    pdf_file = HTML(string=rendered_html, encoding='utf-8').write_pdf()
+                    pdf_file = render_pdf(
+                        rendered_html, scope=get_pdf_cache_scope('task_invoice', target_task.id)
+                    )
                     http_response = HttpResponse(pdf_file, content_type='application/pdf')
                     http_response['Content-Disposition'] = 'filename="invoice_{}.pdf"'.format(
                         target_task and target_task.summary or pk)
@@ -517,13 +528,14 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
             else:
                 return HttpResponse("Could not generate an invoice, Please contact support@tunga.io")
         else:
-            pdf_path = 'media/all_invoices_{}.pdf'.format(
-                str(datetime.datetime.utcnow()).replace('-', '_').replace(' ', '_').replace('.', '_').replace(':', '_'))
-            queue = django_rq.get_queue('default')
-            queue.enqueue(process_invoices, args=(pk,),
-                          kwargs=dict(invoice_types=invoice_types, user_id=request.user.id,
-                                      is_admin=request.user.is_admin, filepath=pdf_path), timeout=900)
-            return HttpResponse("Your pdf has been saved to:  {}/{}".format(TUNGA_URL, pdf_path))
+            pdf_job = enqueue_pdf_job(
+                'tunga_tasks.background.render_invoices_pdf',
+                kwargs=dict(
+                    pk=pk, invoice_types=invoice_types, user_id=request.user.id, is_admin=request.user.is_admin
+                ),
+                user_id=request.user.id
+            )
+            return JsonResponse(get_pdf_job_details(pdf_job), status=status.HTTP_202_ACCEPTED)
 
     @detail_route(
         methods=['get'], url_path='download/estimate',
@@ -568,7 +580,7 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
             if request.accepted_renderer.format == 'html':
                 return HttpResponse(rendered_html)
 
-            pdf_file = HTML(string=rendered_html, encoding='utf-8').write_pdf()
+            pdf_file = render_pdf(rendered_html, scope=get_pdf_cache_scope('estimate', estimate.id))
             http_response = HttpResponse(pdf_file, content_type='application/pdf')
             http_response['Content-Disposition'] = 'filename="estimate.pdf"'
             return http_response
@@ -616,7 +628,7 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
 
             if request.accepted_renderer.format == 'html':
                 return HttpResponse(rendered_html)
-            pdf_file = HTML(string=rendered_html, encoding='utf-8').write_pdf()
+            pdf_file = render_pdf(rendered_html, scope=get_pdf_cache_scope('quote', quote.id))
             http_response = HttpResponse(pdf_file, content_type='application/pdf')
             http_response['Content-Disposition'] = 'filename="task_quote.pdf"'
             return http_response
@@ -937,7 +949,7 @@ class EstimateViewSet(viewsets.ModelViewSet):
             if request.accepted_renderer.format == 'html':
                 return HttpResponse(rendered_html)
 
-            pdf_file = HTML(string=rendered_html, encoding='utf-8').write_pdf()
+            pdf_file = render_pdf(rendered_html, scope=get_pdf_cache_scope('estimate', estimate.id))
             http_response = HttpResponse(pdf_file, content_type='application/pdf')
             http_response['Content-Disposition'] = 'filename="estimate.pdf"'
             return http_response
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from tunga_utils.models import ContactRequest, SiteMeta, InviteRequest, ExternalEvent, SearchEvent
+from tunga_utils.models import ContactRequest, SiteMeta, InviteRequest, ExternalEvent, SearchEvent, HubspotEngagement, \
+    ExactInvoiceSync
 
 
 class AdminAutoCreatedBy(admin.ModelAdmin):
@@ -72,3 +73,16 @@ class ExternalEventAdmin(ReadOnlyModelAdmin):
 class SearchEventAdmin(ReadOnlyModelAdmin):
     list_display = ('user', 'email', 'query', 'page', 'created_at', 'updated_at')
     search_fields = ('query', 'email', 'user__email')
+
+
+@admin.register(HubspotEngagement)
+class HubspotEngagementAdmin(ReadOnlyModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
+
+
+@admin.register(ExactInvoiceSync)
+class ExactInvoiceSyncAdmin(ReadOnlyModelAdmin):
+    list_display = ('reference', 'entry_id', 'created_at', 'updated_at')
+    search_fields = ('reference', 'entry_id')
@@ -63,6 +63,10 @@ PAYMENT_METHOD_STRIPE = 'stripe'
 PAYMENT_METHOD_AYDEN = 'ayden'
 PAYMENT_METHOD_PAYONEER = 'payoneer'
 
+# Payout Orders
+PAYOUT_ORDER_FIFO = 'fifo'
+PAYOUT_ORDER_LARGEST_FIRST = 'largest_first'
+
 # Transaction and Action Statuses
 STATUS_INITIAL = 'initial'
 STATUS_PENDING = 'pending'
@@ -79,6 +83,8 @@ STATUS_CANCELED = 'canceled'
 STATUS_RETRY = 'retry'
 STATUS_INTERESTED = 'interested'
 STATUS_UNINTERESTED = 'uninterested'
+STATUS_SKIPPED = 'skipped'
+STATUS_MISSED = 'missed'
 
 REQUEST_STATUS_CHOICES = (
     (STATUS_INITIAL, 'Initial'),
@@ -103,6 +109,15 @@ VISIBILITY_MY_TEAM = 2
 VISIBILITY_CUSTOM = 3
 VISIBILITY_ONLY_ME = 4
 
+# Task Visibility Index Reasons
+TASK_VISIBILITY_REASON_CREATOR = 'creator'
+TASK_VISIBILITY_REASON_OWNER = 'owner'
+TASK_VISIBILITY_REASON_PM = 'pm'
+TASK_VISIBILITY_REASON_ADMIN = 'admin'
+TASK_VISIBILITY_REASON_PARTICIPANT = 'participant'
+TASK_VISIBILITY_REASON_REJECTED_PARTICIPANT = 'rejected_participant'
+TASK_VISIBILITY_REASON_CONNECTION = 'connection'
+
 # Support Visibility
 VISIBILITY_ALL = 'all'
 VISIBILITY_DEVELOPERS = 'developers'
@@ -329,6 +344,12 @@ NOTIFICATION_TYPE_CHOICES = (
     (NOTIFICATION_TYPE_ACTIVITY, 'Activity')
 )
 
+NOTIFICATION_SECTION_PROJECTS = 'projects'
+NOTIFICATION_SECTION_INVOICES = 'invoices'
+NOTIFICATION_SECTION_EVENTS = 'events'
+NOTIFICATION_SECTION_REPORTS = 'reports'
+NOTIFICATION_SECTION_ACTIVITIES = 'activities'
+
 # Project Stages
 PROJECT_STAGE_OPPORTUNITY = 'opportunity'
 PROJECT_STAGE_ACTIVE = 'active'
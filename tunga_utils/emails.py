@@ -1,13 +1,105 @@
 import re
+import smtplib
+import socket
+import threading
+from collections import OrderedDict
 
+from django.core.mail import get_connection
 from django.core.mail.message import EmailMultiAlternatives
 from django.template.exceptions import TemplateDoesNotExist
-from django.template.loader import render_to_string
+from django.template.loader import get_template
 from premailer import premailer
 
 from tunga.settings import DEFAULT_FROM_EMAIL, EMAIL_SUBJECT_PREFIX
 from tunga_utils.helpers import convert_to_text
-from tunga_utils.hubspot_utils import create_hubspot_engagement
+from tunga_utils.hubspot_utils import queue_hubspot_engagement
+
+
+EMAIL_BASE_TEMPLATE = 'tunga/email/base.html'
+PREMAILER_CACHE_SIZE = 50  # Parsed stylesheets and external stylesheets kept per process
+EMAIL_BATCH_SIZE = 100  # Emails rendered at once by send_templated_mail_batch
+
+
+class CachedPremailer(premailer.Premailer):
+    """
+    Premailer that parses each stylesheet and fetches each external stylesheet once per process.
+    All emails share the stylesheet in the base layout, so only the per email html is processed.
+    Both caches keep the PREMAILER_CACHE_SIZE most recently used entries.
+    """
+    _style_rules = OrderedDict()
+    _external_styles = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def _get_cached(cls, cache, key, load):
+        with cls._cache_lock:
+            value = cache.pop(key, None)
+        if value is None:
+            value = load()
+        with cls._cache_lock:
+            cache[key] = value
+            while len(cache) > PREMAILER_CACHE_SIZE:
+                # Drop the least recently used entry
+                cache.popitem(last=False)
+        return value
+
+    def _parse_style_rules(self, css_body, ruleset_index):
+        rules, leftover = self._get_cached(
+            self._style_rules, (css_body, ruleset_index),
+            lambda: super(CachedPremailer, self)._parse_style_rules(css_body, ruleset_index)
+        )
+        return list(rules), list(leftover)
+
+    def _load_external_url(self, url):
+        return self._get_cached(
+            self._external_styles, url, lambda: super(CachedPremailer, self)._load_external_url(url)
+        )
+
+
+def get_email_templates(template_prefix):
+    """
+    :return: dict of extension (html and txt) -> template for the email, txt is omitted if it doesn't exist
+    """
+    templates = {}
+    for ext in ['html', 'txt']:
+        try:
+            templates[ext] = get_template('{0}.{1}'.format(template_prefix, ext))
+        except TemplateDoesNotExist:
+            if ext == 'txt' and 'html' not in templates:
+                # We need at least one body
+                raise
+    return templates
+
+
+def get_email_base_template():
+    try:
+        return get_template(EMAIL_BASE_TEMPLATE)
+    except TemplateDoesNotExist:
+        return None
+
+
+def get_mail_subject(subject):
+    if not re.match(r'^\[\s*Tunga', subject):
+        subject = '{} {}'.format(EMAIL_SUBJECT_PREFIX, subject)
+    return subject
+
+
+def build_mail(subject, templates, base_template, to_emails, context, bcc=None, cc=None):
+    bodies = {}
+    for ext, template in templates.items():
+        bodies[ext] = template.render(context).strip()
+    if 'txt' not in bodies:
+        # Compose text body from html
+        bodies['txt'] = convert_to_text(bodies['html'])
+
+    msg = EmailMultiAlternatives(subject, bodies['txt'], DEFAULT_FROM_EMAIL, to_emails, bcc=bcc, cc=cc)
+    if 'html' in bodies:
+        if base_template:
+            html_body = base_template.render(dict(email_content=bodies['html'])).strip()
+        else:
+            html_body = bodies['html']
+        msg.attach_alternative(CachedPremailer(html_body).transform(), 'text/html')
+    return msg
 
 
 def render_mail(subject, template_prefix, to_emails, context, bcc=None, cc=None, **kwargs):
@@ -21,53 +113,104 @@ def render_mail(subject, template_prefix, to_emails, context, bcc=None, cc=None,
     :param kwargs:
     :return:
     """
-    from_email = DEFAULT_FROM_EMAIL
-    if not re.match(r'^\[\s*Tunga', subject):
-        subject = '{} {}'.format(EMAIL_SUBJECT_PREFIX, subject)
+    return build_mail(
+        get_mail_subject(subject), get_email_templates(template_prefix), get_email_base_template(),
+        to_emails, context, bcc=bcc, cc=cc
+    )
 
-    bodies = {}
-    for ext in ['html', 'txt']:
+
+def render_mail_batch(template_prefix, recipients, bcc=None, cc=None, **kwargs):
+    """
+    Renders the same email template for many recipients, templates and styles are only loaded once
+    :param template_prefix: path to template for email with extension (e.g hello if template name is hello.html)
+    :param recipients: list of (subject, to_emails, context) tuples
+    :param bcc:
+    :param cc:
+    :param kwargs:
+    :return: list of messages in the same order as recipients
+    """
+    templates = get_email_templates(template_prefix)
+    base_template = get_email_base_template()
+    return [
+        build_mail(get_mail_subject(subject), templates, base_template, to_emails, context, bcc=bcc, cc=cc)
+        for subject, to_emails, context in recipients
+    ]
+
+
+def _send_message(connection, msg):
+    for attempt in range(2):
         try:
-            template_name = '{0}.{1}'.format(template_prefix, ext)
-            bodies[ext] = render_to_string(template_name,
-                                           context).strip()
-        except TemplateDoesNotExist:
-            if ext == 'txt':
-                if 'html' in bodies:
-                    # Compose text body from html
-                    bodies[ext] = convert_to_text(bodies['html'])
-                else:
-                    # We need at least one body
-                    raise
-
-    if bodies:
-        msg = EmailMultiAlternatives(subject, bodies['txt'], from_email, to_emails, bcc=bcc, cc=cc)
-        if 'html' in bodies:
-            try:
-                html_body = render_to_string(
-                    'tunga/email/base.html', dict(email_content=bodies['html'])
-                ).strip()
-            except TemplateDoesNotExist:
-                html_body = bodies['html']
-            msg.attach_alternative(premailer.transform(html_body), 'text/html')
-    else:
-        raise TemplateDoesNotExist
-    return msg
+            connection.open()
+            return bool(connection.send_messages([msg]))
+        except (smtplib.SMTPServerDisconnected, socket.error):
+            # Dropped connection, reconnect and retry the message once
+            connection.close()
+        except smtplib.SMTPException:
+            return False
+    return False
+
+
+def send_mail_batch(messages, connection=None):
+    """
+    Sends messages over a single connection instead of a new SMTP connection per message.
+    :param messages: list of EmailMessage instances e.g from render_mail_batch
+    :param connection: open connection to reuse across batches, a new one is opened and closed if not given
+    :return: list of booleans, whether each message was sent
+    """
+    close_connection = connection is None
+    if connection is None:
+        connection = get_connection()
+
+    results = []
+    try:
+        for msg in messages:
+            results.append(_send_message(connection, msg))
+    finally:
+        if close_connection:
+            connection.close()
+    return results
 
 
-def send_mail(subject, template_prefix, to_emails, context, bcc=None, cc=None, **kwargs):
+def queue_mail_engagement(msg, template_prefix, context, bcc=None, cc=None, **kwargs):
+    # Log engagement in HubSpot, sent in batches by tunga_send_hubspot_engagements
+    kwargs.update(
+        dict(cc=cc, bcc=bcc, context=context, template_prefix=template_prefix)
+    )
+    try:
+        queue_hubspot_engagement(
+            from_email=msg.from_email, to_emails=msg.to, subject=msg.subject, body=msg.body, **kwargs
+        )
+    except:
+        pass
+
+
+def send_mail(subject, template_prefix, to_emails, context, bcc=None, cc=None, connection=None, **kwargs):
     msg = render_mail(subject, template_prefix, to_emails, context, bcc=bcc, cc=cc, **kwargs)
-    is_sent = msg.send()
+    is_sent = send_mail_batch([msg], connection=connection)[0]
     if is_sent:
-        # Log engagement in HubSpot
-        new_kwargs = kwargs
-        new_kwargs.update(
-            dict(cc=cc, bcc=bcc, context=context, template_prefix=template_prefix)
-        )
-        try:
-            create_hubspot_engagement(
-                from_email=msg.from_email, to_emails=msg.to, subject=msg.subject, body=msg.body, **kwargs
-            )
-        except:
-            pass
+        queue_mail_engagement(msg, template_prefix, context, bcc=bcc, cc=cc, **kwargs)
     return is_sent
+
+
+def send_templated_mail_batch(template_prefix, recipients, bcc=None, cc=None, connection=None):
+    """
+    Renders (render_mail_batch) and sends (send_mail_batch) the same email template for many recipients,
+    in batches of EMAIL_BATCH_SIZE. Sent emails are logged in HubSpot like send_mail does.
+    :param template_prefix: path to template for email with extension (e.g hello if template name is hello.html)
+    :param recipients: list of (subject, to_emails, context, kwargs) tuples, kwargs are logged with the engagement
+    :param connection: open connection to reuse, a new one is opened and closed if not given
+    :return: list of booleans in the same order as recipients, whether each email was sent
+    """
+    results = []
+    for i in range(0, len(recipients), EMAIL_BATCH_SIZE):
+        batch = recipients[i:i + EMAIL_BATCH_SIZE]
+        messages = render_mail_batch(
+            template_prefix, [(subject, to_emails, context) for subject, to_emails, context, kwargs in batch],
+            bcc=bcc, cc=cc
+        )
+        batch_results = send_mail_batch(messages, connection=connection)
+        for msg, (subject, to_emails, context, kwargs), is_sent in zip(messages, batch, batch_results):
+            if is_sent:
+                queue_mail_engagement(msg, template_prefix, context, bcc=bcc, cc=cc, **kwargs)
+        results.extend(batch_results)
+    return results
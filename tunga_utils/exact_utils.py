@@ -1,18 +1,30 @@
 import base64
-from six.moves.urllib_parse import urlencode
-
+import hashlib
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db import connections
 from exactonline.api import ExactApi
 from exactonline.exceptions import ObjectDoesNotExist
+from exactonline.http import HTTPError
 from exactonline.resource import POST, GET
 from exactonline.storage import ExactOnlineConfig
+from six.moves.urllib_parse import urlencode
 
 from tunga.settings import EXACT_DOCUMENT_TYPE_PURCHASE_INVOICE, EXACT_DOCUMENT_TYPE_SALES_INVOICE, \
     EXACT_JOURNAL_CLIENT_SALES, EXACT_JOURNAL_DEVELOPER_SALES, EXACT_JOURNAL_DEVELOPER_PURCHASE, \
     EXACT_PAYMENT_CONDITION_CODE_14_DAYS, EXACT_VAT_CODE_NL, EXACT_VAT_CODE_WORLD, EXACT_GL_ACCOUNT_CLIENT_FEE, \
-    EXACT_GL_ACCOUNT_DEVELOPER_FEE, EXACT_GL_ACCOUNT_TUNGA_FEE, EXACT_VAT_CODE_EUROPE
+    EXACT_GL_ACCOUNT_DEVELOPER_FEE, EXACT_GL_ACCOUNT_TUNGA_FEE, EXACT_VAT_CODE_EUROPE, EXACT_RATE_LIMIT, \
+    EXACT_SYNC_MAX_WORKERS, EXACT_ACCOUNT_CACHE_TIMEOUT
 from tunga_utils.constants import CURRENCY_EUR, VAT_LOCATION_NL, VAT_LOCATION_EUROPE, INVOICE_TYPE_SALE, \
     INVOICE_TYPE_PURCHASE
-from tunga_utils.models import SiteMeta
+from tunga_utils.models import SiteMeta, ExactInvoiceSync
+
+EXACT_MAX_ATTEMPTS = 5
+EXACT_TOKEN_REFRESH_INTERVAL = 60  # seconds, refreshes requested by other threads within this window are skipped
 
 
 class ExactStorage(ExactOnlineConfig):
@@ -30,21 +42,140 @@ class ExactStorage(ExactOnlineConfig):
         SiteMeta.objects.update_or_create(meta_key=self.get_meta_key(section, option), defaults=dict(meta_value=value))
 
 
+class RateLimiter(object):
+    """
+    Spaces out calls from all threads of the process so they stay within calls per period
+    """
+
+    def __init__(self, calls, period=60):
+        self.interval = float(period) / calls
+        self.next_call_at = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_call_at - now
+            self.next_call_at = max(now, self.next_call_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+exact_rate_limiter = RateLimiter(EXACT_RATE_LIMIT)
+exact_token_lock = threading.Lock()
+
+
+class ThrottledExactApi(ExactApi):
+    """
+    Exact API client that is safe to share between sync threads.
+    Calls are rate limited, retried when Exact rejects them for exceeding its limits
+    and concurrent token refreshes are collapsed into one (Exact rotates refresh tokens).
+    """
+    refreshed_at = 0
+
+    def rest(self, request):
+        for attempt in range(EXACT_MAX_ATTEMPTS):
+            exact_rate_limiter.wait()
+            try:
+                return super(ThrottledExactApi, self).rest(request)
+            except HTTPError as e:
+                if e.code != 429 or attempt == EXACT_MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(min(5 * 2 ** attempt, 60))
+
+    def refresh_token(self):
+        with exact_token_lock:
+            if time.time() - ThrottledExactApi.refreshed_at < EXACT_TOKEN_REFRESH_INTERVAL:
+                # Another thread just refreshed the tokens
+                return
+            super(ThrottledExactApi, self).refresh_token()
+            ThrottledExactApi.refreshed_at = time.time()
+
+
 def get_api():
     storage = ExactStorage()
-    return ExactApi(storage=storage)
+    return ThrottledExactApi(storage=storage)
 
 
-def get_account_guid(user, invoice_type, exact_api=None):
+def save_exact_relation(relation_dict, exact_api=None):
+    """
+    Creates or updates an Exact relation (account).
+    GUIDs are cached per relation details, so unchanged accounts don't cost any API calls.
+    :return: account GUID
+    """
+    cache_key = 'exact_account:{}'.format(
+        hashlib.sha1(json.dumps(relation_dict, sort_keys=True).encode('utf-8')).hexdigest()
+    )
+    exact_user_id = cache.get(cache_key)
+    if exact_user_id:
+        return exact_user_id
+
     if not exact_api:
         exact_api = get_api()
 
-    exact_user_id = None
     try:
-        exact_user_id = exact_api.relations.get(relation_code=user.exact_code)['ID']
+        exact_user_id = exact_api.relations.get(relation_code=relation_dict['Code'])['ID']
     except (ObjectDoesNotExist, TypeError):
         pass
 
+    if exact_user_id:
+        exact_api.relations.update(exact_user_id, relation_dict)
+    else:
+        exact_user = exact_api.relations.create(relation_dict)
+        exact_user_id = exact_user['ID']
+    cache.set(cache_key, exact_user_id, EXACT_ACCOUNT_CACHE_TIMEOUT)
+    return exact_user_id
+
+
+def get_exact_sync_reference(invoice_type, invoice_number):
+    return '{}:{}'.format(invoice_type, invoice_number)
+
+
+def get_exact_content_hash(content):
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def is_exact_synced(reference, content_hash):
+    return ExactInvoiceSync.objects.filter(
+        reference=reference, content_hash=content_hash, entry_id__isnull=False
+    ).exists()
+
+
+def save_exact_sync(reference, content_hash, entries):
+    """
+    :param entries: created entry or existing entries returned by Exact
+    """
+    if isinstance(entries, list):
+        entries = entries and entries[0] or None
+    ExactInvoiceSync.objects.update_or_create(
+        reference=reference,
+        defaults=dict(content_hash=content_hash, entry_id=entries and entries.get('EntryID', None) or None)
+    )
+
+
+def run_exact_sync(items, sync):
+    """
+    Syncs items on a bounded thread pool, API calls are rate limited across the threads
+    :param items: list of items e.g invoices
+    :param sync: callable taking an item and the shared api client
+    :return: list of (item, exception) for items that failed
+    """
+    exact_api = get_api()
+
+    def run(item):
+        try:
+            sync(item, exact_api)
+        finally:
+            # Pool threads don't close their database connections on their own
+            connections.close_all()
+
+    executor = ThreadPoolExecutor(max_workers=EXACT_SYNC_MAX_WORKERS)
+    futures = [(item, executor.submit(run, item)) for item in items]
+    executor.shutdown(wait=True)
+    return [(item, future.exception()) for item, future in futures if future.exception()]
+
+
+def get_account_guid(user, invoice_type, exact_api=None):
     relation_dict = dict(
         Code=user.exact_code,
         Name=user.display_name,
@@ -58,13 +189,7 @@ def get_account_guid(user, invoice_type, exact_api=None):
 
     relation_dict['IsSales'] = False
     relation_dict['IsSupplier'] = bool(invoice_type != 'client')
-
-    if exact_user_id:
-        exact_api.relations.update(exact_user_id, relation_dict)
-    else:
-        exact_user = exact_api.relations.create(relation_dict)
-        exact_user_id = exact_user['ID']
-    return exact_user_id
+    return save_exact_relation(relation_dict, exact_api=exact_api)
 
 
 def get_entry(invoice_type, invoice_number, exact_user_id, exact_api=None):
@@ -92,17 +217,17 @@ def get_entry(invoice_type, invoice_number, exact_user_id, exact_api=None):
     return existing_invoice_refs
 
 
-def upload_invoice(task, user, invoice_type, invoice_file, amount, vat_location=None):
+def upload_invoice(task, user, invoice_type, invoice_file, amount, vat_location=None, exact_api=None):
     """
     :param task: parent task for the invoice
     :param user: Tunga user related to the invoice e.g a client or a developer
     :param invoice_type: type of invoice e.g 'client', 'developer', 'tunga'
-    :param invoice_file: generated file object for the invoice
+    :param invoice_file: generated file object for the invoice or a callable that generates it
     :param amount:
     :param vat_location: NL, europe or world
+    :param exact_api: shared api client
     :return:
     """
-    exact_api = get_api()
     invoice = task.invoice
 
     if invoice_type == 'developer' and invoice.version > 1:
@@ -111,14 +236,30 @@ def upload_invoice(task, user, invoice_type, invoice_file, amount, vat_location=
 
     invoice_number = invoice.invoice_id(invoice_type=invoice_type, user=user)
 
+    reference = get_exact_sync_reference(invoice_type, invoice_number)
+    content_hash = get_exact_content_hash(dict(
+        task=task.id, summary=task.summary, title=invoice.title, created_at=invoice.created_at,
+        user=user.exact_code, amount=amount, vat_location=vat_location
+    ))
+    if is_exact_synced(reference, content_hash):
+        # Unchanged since the last sync
+        return
+
+    if not exact_api:
+        exact_api = get_api()
+
     exact_user_id = get_account_guid(user, invoice_type, exact_api=exact_api)
 
     existing_invoice_refs = get_entry(invoice_type, invoice_number, exact_user_id, exact_api=exact_api)
 
     if existing_invoice_refs:
         # Stop if entries with invoice ref already exist
+        save_exact_sync(reference, content_hash, existing_invoice_refs)
         return
 
+    if callable(invoice_file):
+        invoice_file = invoice_file()
+
     exact_document = exact_api.restv1(POST(
         'documents/Documents',
         dict(
@@ -140,13 +281,14 @@ def upload_invoice(task, user, invoice_type, invoice_file, amount, vat_location=
         )
     ))
 
+    exact_entry = None
     if invoice_type == 'client':
         vat_code = EXACT_VAT_CODE_WORLD
         if vat_location == VAT_LOCATION_NL:
             vat_code = EXACT_VAT_CODE_NL
         elif vat_location == VAT_LOCATION_EUROPE:
             vat_code = EXACT_VAT_CODE_EUROPE
-        exact_api.restv1(POST(
+        exact_entry = exact_api.restv1(POST(
             'salesentry/SalesEntries',
             dict(
                 Currency=CURRENCY_EUR,
@@ -170,7 +312,7 @@ def upload_invoice(task, user, invoice_type, invoice_file, amount, vat_location=
             )
         ))
     elif invoice_type == 'tunga':
-        exact_api.restv1(POST(
+        exact_entry = exact_api.restv1(POST(
             'purchaseentry/PurchaseEntries',
             dict(
                 Currency=CURRENCY_EUR,
@@ -193,7 +335,7 @@ def upload_invoice(task, user, invoice_type, invoice_file, amount, vat_location=
             )
         ))
     elif invoice_type == 'developer':
-        exact_api.restv1(POST(
+        exact_entry = exact_api.restv1(POST(
             'salesentry/SalesEntries',
             dict(
                 Currency=CURRENCY_EUR,
@@ -215,18 +357,10 @@ def upload_invoice(task, user, invoice_type, invoice_file, amount, vat_location=
                 ]
             )
         ))
+    save_exact_sync(reference, content_hash, exact_entry)
 
 
 def get_account_guid_v3(user, invoice_type=None, exact_api=None):
-    if not exact_api:
-        exact_api = get_api()
-
-    exact_user_id = None
-    try:
-        exact_user_id = exact_api.relations.get(relation_code=user.exact_code)['ID']
-    except (ObjectDoesNotExist, TypeError):
-        pass
-
     profile_source = user.is_project_owner and user.company or user.profile
     account_name = user.display_name
 
@@ -249,13 +383,7 @@ def get_account_guid_v3(user, invoice_type=None, exact_api=None):
 
     relation_dict['IsSales'] = False
     relation_dict['IsSupplier'] = bool(invoice_type != INVOICE_TYPE_SALE)
-
-    if exact_user_id:
-        exact_api.relations.update(exact_user_id, relation_dict)
-    else:
-        exact_user = exact_api.relations.create(relation_dict)
-        exact_user_id = exact_user['ID']
-    return exact_user_id
+    return save_exact_relation(relation_dict, exact_api=exact_api)
 
 
 def get_entry_v3(invoice, exact_user_id, exact_api=None):
@@ -283,23 +411,35 @@ def get_entry_v3(invoice, exact_user_id, exact_api=None):
     return existing_invoice_refs
 
 
-def upload_invoice_v3(invoice):
+def upload_invoice_v3(invoice, exact_api=None):
     """
     :param invoice:
+    :param exact_api: shared api client
     :return:
     """
-    exact_api = get_api()
-
     if invoice.legacy_id or invoice.user.email in ['david@tunga.io', 'bart@tunga.io', 'domieck@tunga.io']:
         # Don't sync legacy and admin invoices
         return
 
+    reference = get_exact_sync_reference(invoice.type, invoice.number)
+    content_hash = get_exact_content_hash(dict(
+        title=invoice.full_title, subtotal=invoice.subtotal, tax_location=invoice.tax_location,
+        issued_at=invoice.issued_at, user=invoice.user.exact_code
+    ))
+    if is_exact_synced(reference, content_hash):
+        # Unchanged since the last sync
+        return
+
+    if not exact_api:
+        exact_api = get_api()
+
     exact_user_id = get_account_guid_v3(invoice.user, invoice_type=invoice.type, exact_api=exact_api)
 
     existing_invoice_refs = get_entry_v3(invoice, exact_user_id, exact_api=exact_api)
 
     if existing_invoice_refs:
         # Stop if entries with invoice ref already exist
+        save_exact_sync(reference, content_hash, existing_invoice_refs)
         return
 
     exact_document = exact_api.restv1(POST(
@@ -323,6 +463,7 @@ def upload_invoice_v3(invoice):
         )
     ))
 
+    exact_entry = None
     if invoice.type == INVOICE_TYPE_SALE:
         vat_location = invoice.tax_location
         vat_code = EXACT_VAT_CODE_WORLD
@@ -331,7 +472,7 @@ def upload_invoice_v3(invoice):
         elif vat_location == VAT_LOCATION_EUROPE:
             vat_code = EXACT_VAT_CODE_EUROPE
 
-        exact_api.restv1(POST(
+        exact_entry = exact_api.restv1(POST(
             'salesentry/SalesEntries',
             dict(
                 Currency=CURRENCY_EUR,
@@ -355,7 +496,7 @@ def upload_invoice_v3(invoice):
             )
         ))
     elif invoice.type == INVOICE_TYPE_PURCHASE:
-        exact_api.restv1(POST(
+        exact_entry = exact_api.restv1(POST(
             'purchaseentry/PurchaseEntries',
             dict(
                 Currency=CURRENCY_EUR,
@@ -377,3 +518,4 @@ def upload_invoice_v3(invoice):
                 ]
             )
         ))
+    save_exact_sync(reference, content_hash, exact_entry)
@@ -6,6 +6,8 @@ import slackdown
 from allauth.socialaccount.models import SocialToken
 from django.apps import apps as django_apps
 from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save
 from django.http import HttpResponseRedirect
 from django.template.defaultfilters import urlizetrunc, safe, striptags
 from django.utils import six
@@ -149,3 +151,45 @@ def clean_meta_value(meta_value):
 
 def get_edit_token_header(request):
     return request.META.get(HEADER_EDIT_TOKEN, None)
+
+
+def bulk_create_with_signals(model, instances, lookup_fields, queryset=None):
+    """
+    Inserts new instances with one query and sends the post_save signals bulk_create skips
+    :param model: model of the instances
+    :param instances: unsaved instances
+    :param lookup_fields: field attnames that identify a row, used to reload the rows and to match existing ones
+    :param queryset: queryset used to reload the new rows e.g with select_related for the signal receivers
+    :return: list of the saved rows
+    """
+    instances = list(instances)
+    if not instances:
+        return []
+
+    def get_key(instance):
+        return tuple([getattr(instance, field) for field in lookup_fields])
+
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(instances)
+    except IntegrityError:
+        # Some rows were created concurrently, fall back to creating them one by one
+        objects = []
+        for instance in instances:
+            defaults = dict([
+                (field.attname, getattr(instance, field.attname)) for field in model._meta.concrete_fields
+                if not field.primary_key and field.attname not in lookup_fields
+            ])
+            obj, created = model.objects.get_or_create(defaults=defaults, **dict(zip(lookup_fields, get_key(instance))))
+            objects.append(obj)
+        return objects
+
+    # bulk_create skips signals and doesn't set ids on all databases, reload the new rows to send them
+    keys = set([get_key(instance) for instance in instances])
+    queryset = (queryset if queryset is not None else model.objects.all()).filter(**dict([
+        ('{}__in'.format(field), set([key[idx] for key in keys])) for idx, field in enumerate(lookup_fields)
+    ]))
+    objects = [obj for obj in queryset if get_key(obj) in keys]
+    for obj in objects:
+        post_save.send(sender=model, instance=obj, created=True, update_fields=None, raw=False, using=obj._state.db)
+    return objects
@@ -1,14 +1,19 @@
 from copy import copy
 
 import datetime
+import json
 import requests
+from django.core.cache import cache
 from django.utils import six
 
 from tunga.settings import HUBSPOT_API_KEY, TUNGA_URL, HUBSPOT_DEFAULT_DEAL_STAGE_MEMBER, HUBSPOT_DEFAULT_DEAL_STAGE_NEW_USER
-from tunga_utils.constants import TASK_SOURCE_NEW_USER, PROJECT_STAGE_OPPORTUNITY
+from tunga_utils.constants import TASK_SOURCE_NEW_USER, PROJECT_STAGE_OPPORTUNITY, STATUS_PENDING, STATUS_COMPLETED, \
+    STATUS_FAILED
+from tunga_utils.models import HubspotEngagement
 
 HUBSPOT_API_BASE_URL = 'https://api.hubapi.com'
 HUBSPOT_ENDPOINT_CREATE_UPDATE_CONTACT = '/contacts/v1/contact/createOrUpdate/email/{contact_email}/'
+HUBSPOT_ENDPOINT_GET_CONTACTS_BY_EMAIL = '/contacts/v1/contact/emails/batch/'
 HUBSPOT_ENDPOINT_CREATE_DEAL = '/deals/v1/deal'
 HUBSPOT_ENDPOINT_CREATE_DEAL_PROPERTY = '/properties/v1/deals/properties/'
 HUBSPOT_ENDPOINT_CREATE_TAG_PROPERTY = '/contacts/v1/properties/tag'
@@ -73,6 +78,11 @@ KEY_VALUE_DEAL_DELETION = 'deal.deletion'
 KEY_VALUE_DEAL_PROPERTY_CHANGE = 'deal.propertyChange'
 KEY_VALUE_PROPERTY_TYPE_DATETIME = 'datetime'
 
+HUBSPOT_CONTACT_VID_CACHE_TIMEOUT = 30 * 24 * 60 * 60  # 30 days
+HUBSPOT_ENGAGEMENT_MAX_ATTEMPTS = 8
+HUBSPOT_ENGAGEMENT_CLAIM_TIMEOUT = 10 * 60  # 10 minutes
+HUBSPOT_ENGAGEMENT_KWARGS = ['cc', 'bcc', 'html', 'deal_ids']
+
 HEADER_SIGNATURE = 'HTTP_X_HUBSPOT_SIGNATURE'
 
 
@@ -118,6 +128,48 @@ def get_hubspot_contact_vid(email, **kwargs):
     return
 
 
+def get_hubspot_contact_vid_cache_key(email):
+    return 'hubspot_contact_vid:{}'.format(email.lower())
+
+
+def get_cached_hubspot_contact_vids(emails):
+    """
+    Maps emails to HubSpot contact VIDs.
+    Uses cached VIDs, looks up the rest with one batch request and only creates contacts that don't exist yet.
+    :return: dict of email -> vid
+    """
+    emails = [email for email in set(emails or []) if email]
+    keys = dict((get_hubspot_contact_vid_cache_key(email), email) for email in emails)
+    vids = dict((keys[key], vid) for key, vid in six.iteritems(cache.get_many(list(keys.keys()))))
+
+    missing = [email for email in emails if email not in vids]
+    if missing:
+        r = requests.get(
+            get_authed_hubspot_endpoint_url(HUBSPOT_ENDPOINT_GET_CONTACTS_BY_EMAIL, HUBSPOT_API_KEY),
+            params=[('email', email) for email in missing],
+            verify=False
+        )
+        if r.status_code == 200:
+            lower_missing = dict((email.lower(), email) for email in missing)
+            for contact in six.itervalues(r.json()):
+                email = contact.get('properties', {}).get('email', {}).get(KEY_VALUE, '')
+                if email and email.lower() in lower_missing and KEY_VID in contact:
+                    vids[lower_missing[email.lower()]] = contact[KEY_VID]
+
+        for email in missing:
+            if email not in vids:
+                vid = get_hubspot_contact_vid(email)
+                if vid:
+                    vids[email] = vid
+
+        new_vids = dict(
+            (get_hubspot_contact_vid_cache_key(email), vids[email]) for email in missing if email in vids
+        )
+        if new_vids:
+            cache.set_many(new_vids, HUBSPOT_CONTACT_VID_CACHE_TIMEOUT)
+    return vids
+
+
 def create_hubspot_deal_property(name, label, description, group_name, property_type, field_type, trials=0):
     r = requests.post(
         get_authed_hubspot_endpoint_url(
@@ -367,11 +419,8 @@ def create_or_update_project_hubspot_deal(project, trials=0, **kwargs):
 
 
 def create_hubspot_engagement(from_email, to_emails, subject, body, **kwargs):
-    contact_vids = []
-    for email in to_emails:
-        vid = get_hubspot_contact_vid(email)
-        if vid:
-            contact_vids.append(vid)
+    vids = get_cached_hubspot_contact_vids(to_emails)
+    contact_vids = [vids[email] for email in to_emails if vids.get(email, None)]
 
     alternatives = kwargs.get('alternatives', ())
     html = kwargs.get('html', '')
@@ -547,3 +596,87 @@ def create_custom_hubspot_engagement(payload):
         response = r.json()
         return response
     return
+
+
+def queue_hubspot_engagement(from_email, to_emails, subject, body, **kwargs):
+    """
+    Records an email engagement in the outbox, send_queued_hubspot_engagements logs it in HubSpot
+    """
+    payload = dict(from_email=from_email, to_emails=list(to_emails or []), subject=subject, body=body)
+    for key in HUBSPOT_ENGAGEMENT_KWARGS:
+        value = kwargs.get(key, None)
+        if value:
+            payload[key] = isinstance(value, (list, tuple)) and list(value) or value
+    return HubspotEngagement.objects.create(subject=(subject or '')[:255], payload=json.dumps(payload))
+
+
+def send_queued_hubspot_engagements(batch_size=50):
+    """
+    Sends due engagements from the outbox, failed attempts are retried with exponential backoff
+    :return: tuple of (sent, retried, failed) counts
+    """
+    utc_now = datetime.datetime.utcnow()
+    claimed_until = utc_now + datetime.timedelta(seconds=HUBSPOT_ENGAGEMENT_CLAIM_TIMEOUT)
+    engagements = []
+    for engagement in HubspotEngagement.objects.filter(
+        status=STATUS_PENDING, next_attempt_at__lte=utc_now
+    ).order_by('next_attempt_at', 'id')[:batch_size]:
+        # Claim the engagement by pushing its next attempt back, concurrent runs skip it if they lose the update.
+        # If this run dies before sending, the engagement is due again once the claim expires
+        if HubspotEngagement.objects.filter(
+            id=engagement.id, status=STATUS_PENDING, next_attempt_at=engagement.next_attempt_at
+        ).update(next_attempt_at=claimed_until):
+            engagement.next_attempt_at = claimed_until
+            engagements.append(engagement)
+    if not engagements:
+        return 0, 0, 0
+
+    payloads = dict()
+    for engagement in engagements:
+        try:
+            payloads[engagement.id] = json.loads(engagement.payload)
+        except ValueError:
+            payloads[engagement.id] = None
+
+    # Resolve all recipients of the batch at once so each engagement only makes the POST
+    all_emails = []
+    for payload in six.itervalues(payloads):
+        if payload:
+            all_emails.extend(payload.get('to_emails', []))
+    try:
+        get_cached_hubspot_contact_vids(all_emails)
+    except Exception:
+        # Recipients are resolved again per engagement
+        pass
+
+    sent = retried = failed = 0
+    for engagement in engagements:
+        payload = payloads[engagement.id]
+        response = None
+        error = None
+        if payload is None:
+            error = 'Invalid payload'
+        else:
+            try:
+                response = create_hubspot_engagement(**payload)
+            except Exception as e:
+                # Record any error on the engagement so it's retried with backoff instead of aborting the batch
+                error = '{}: {}'.format(type(e).__name__, e)
+
+        engagement.attempts += 1
+        if response:
+            engagement.status = STATUS_COMPLETED
+            engagement.engagement_id = str(response.get('engagement', {}).get('id', '') or '') or None
+            engagement.last_error = None
+            sent += 1
+        else:
+            engagement.last_error = error or 'HubSpot rejected the engagement'
+            if payload is None or engagement.attempts >= HUBSPOT_ENGAGEMENT_MAX_ATTEMPTS:
+                engagement.status = STATUS_FAILED
+                failed += 1
+            else:
+                # 2, 4, 8 ... minutes
+                engagement.next_attempt_at = utc_now + datetime.timedelta(minutes=2 ** engagement.attempts)
+                retried += 1
+        engagement.save()
+    return sent, retried, failed
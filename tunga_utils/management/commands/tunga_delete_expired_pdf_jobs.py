@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from tunga_utils.pdf_utils import delete_expired_pdf_job_files
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Delete results of expired PDF jobs from storage
+        """
+        # command to run: python manage.py tunga_delete_expired_pdf_jobs
+
+        deleted = delete_expired_pdf_job_files()
+        print('Deleted {} expired PDF job files'.format(deleted))
@@ -9,6 +9,7 @@ from django.db.models import Q
 
 from tunga_tasks.models import Task, ParticipantPayment
 from tunga_tasks.tasks import sync_exact_invoices
+from tunga_utils.exact_utils import run_exact_sync
 from tunga_utils.constants import USER_TYPE_PROJECT_OWNER, STATUS_ACCEPTED, \
     PAYMENT_METHOD_PAYONEER, PAYMENT_METHOD_BANK
 
@@ -59,6 +60,7 @@ class Command(BaseCommand):
             closed=True
         ).distinct()
 
+        sync_items = []
         for idx, task in enumerate(tasks):
             if not task.invoice:
                 continue
@@ -94,6 +96,15 @@ class Command(BaseCommand):
 
                 invoice_types = list(set(invoice_types))
 
-            sync_exact_invoices(task, invoice_types=invoice_types, developers=developers)
+            sync_items.append((task, invoice_types, developers))
+
+        failures = run_exact_sync(
+            sync_items,
+            lambda item, exact_api: sync_exact_invoices(
+                item[0], invoice_types=item[1], developers=item[2], exact_api=exact_api
+            )
+        )
+        for item, error in failures:
+            print('Failed to sync task {} with exact: {}'.format(item[0].id, error))
 
 
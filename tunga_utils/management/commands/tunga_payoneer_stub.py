@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from tunga_utils.payoneer_stub import PayoneerStubServer
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', dest='port', type=int, default=8090, help='Port to listen on')
+        parser.add_argument('--balance', dest='balance', default='10000', help='Starting account balance in EUR')
+        parser.add_argument(
+            '--latency', dest='latency', type=float, default=0, help='Seconds each request takes'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Run a local Payoneer API stub, point PAYONEER_API_URL at it to test payouts
+        """
+        # command to run: python manage.py tunga_payoneer_stub --port 8090
+
+        server = PayoneerStubServer(port=options['port'], balance=options['balance'], latency=options['latency'])
+        print('Payoneer stub running at {} with a balance of EUR {}'.format(server.url, server.balance))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
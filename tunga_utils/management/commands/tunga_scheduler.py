@@ -1,47 +1,105 @@
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_MISSED
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
-scheduler = BlockingScheduler()
+from tunga.settings import SCHEDULER_MAX_WORKERS
+from tunga_utils.scheduler_utils import exclusive_job, record_job_run
+
+# Jobs run in parallel, each job at most once at a time (coalescing runs it fell behind on)
+scheduler = BlockingScheduler(
+    executors=dict(default=ThreadPoolExecutor(SCHEDULER_MAX_WORKERS)),
+    job_defaults=dict(coalesce=True, max_instances=1)
+)
 
 
 @scheduler.scheduled_job('interval', minutes=5)
+@exclusive_job(minutes=5)
 def make_payouts():
     # Make payouts
     call_command('tunga_make_payouts')
 
 
 @scheduler.scheduled_job('interval', days=1)
+@exclusive_job(days=1)
 def manage_progress_updates():
     # Schedule progress updates and send update reminders
     call_command('tunga_manage_progress_updates')
 
 
 @scheduler.scheduled_job('interval', minutes=10)
+@exclusive_job(minutes=10)
 def send_message_emails():
     # Send new message emails for conversations
     call_command('tunga_send_message_emails')
 
+
+@scheduler.scheduled_job('interval', minutes=10)
+@exclusive_job(minutes=10)
+def send_task_activity_emails():
     # Send new activity emails for tasks
     call_command('tunga_send_task_activity_emails')
 
+
+@scheduler.scheduled_job('interval', minutes=10)
+@exclusive_job(minutes=10)
+def send_customer_emails():
     # Send new message emails for customer support conversations
     call_command('tunga_send_customer_emails')
 
 
+@scheduler.scheduled_job('interval', minutes=1)
+@exclusive_job(minutes=1)
+def flush_last_activity():
+    # Write buffered user last activity to the database
+    call_command('tunga_flush_last_activity')
+
+
+@scheduler.scheduled_job('interval', minutes=1)
+@exclusive_job(minutes=1)
+def send_hubspot_engagements():
+    # Log queued email engagements in HubSpot
+    call_command('tunga_send_hubspot_engagements')
+
+
 @scheduler.scheduled_job('interval', days=1)
+@exclusive_job(days=1)
 def invoice_reminder():
     # Send unpaid invoice reminders
     call_command('tunga_invoice_reminder')
+
+
+@scheduler.scheduled_job('interval', days=1)
+@exclusive_job(days=1)
+def invoice_reminder_escalated():
+    # Send escalated unpaid invoice reminders
     call_command('tunga_invoice_reminder_escalated')
 
 
 @scheduler.scheduled_job('interval', days=1)
+@exclusive_job(days=1)
 def exact_sync():
     # Sync invoices with exact
     call_command('tunga_exact_sync')
 
 
+@scheduler.scheduled_job('interval', hours=1)
+@exclusive_job(hours=1)
+def delete_expired_pdf_jobs():
+    # Delete results of expired PDF jobs from storage
+    call_command('tunga_delete_expired_pdf_jobs')
+
+
+def job_listener(event):
+    job = scheduler.get_job(event.job_id)
+    if job:
+        record_job_run(job.name, event.scheduled_run_time, result=event.retval)
+
+
+scheduler.add_listener(job_listener, EVENT_JOB_EXECUTED | EVENT_JOB_MISSED)
+
+
 class Command(BaseCommand):
 
     def handle(self, *args, **options):
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from tunga_utils.hubspot_utils import send_queued_hubspot_engagements
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=50,
+            help='Number of engagements sent per batch'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Log queued email engagements in HubSpot
+        """
+        # command to run: python manage.py tunga_send_hubspot_engagements
+
+        total_sent = total_retried = total_failed = 0
+        while True:
+            sent, retried, failed = send_queued_hubspot_engagements(batch_size=options['batch_size'])
+            total_sent += sent
+            total_retried += retried
+            total_failed += failed
+            if sent + retried + failed < options['batch_size']:
+                break
+        print('Sent {} HubSpot engagements, {} to retry, {} failed'.format(total_sent, total_retried, total_failed))
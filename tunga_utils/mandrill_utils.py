@@ -7,7 +7,7 @@ from django_rq import job
 
 from tunga.settings import MANDRILL_API_KEY, DEFAULT_FROM_EMAIL
 from tunga_utils.helpers import convert_to_text
-from tunga_utils.hubspot_utils import create_hubspot_engagement
+from tunga_utils.hubspot_utils import queue_hubspot_engagement
 
 
 def get_client():
@@ -72,7 +72,7 @@ def log_emails(responses, to, subject=None, cc=None, bcc=None, deal_ids=None):
                         email_html = sent_details.get('html', '')
                         email_text = sent_details.get('text', '')
 
-                        create_hubspot_engagement(
+                        queue_hubspot_engagement(
                             from_email=sent_details.get('from_email', DEFAULT_FROM_EMAIL),
                             to_emails=isinstance(to, (str, unicode)) and [to] or to,
                             subject=sent_details.get('subject', subject),
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import datetime
 import re
 
 from actstream.models import Action
@@ -16,7 +17,8 @@ from tunga import settings
 from tunga.settings import TUNGA_URL
 from tunga_utils.constants import RATING_CRITERIA_CODING, RATING_CRITERIA_COMMUNICATION, \
     RATING_CRITERIA_SPEED, MONTHS, CONTACT_REQUEST_ITEM_ONBOARDING, CONTACT_REQUEST_ITEM_PROJECT, \
-    CONTACT_REQUEST_ITEM_ONBOARDING_SPECIAL, CONTACT_REQUEST_ITEM_DO_IT_YOURSELF, EVENT_SOURCE_HUBSPOT
+    CONTACT_REQUEST_ITEM_ONBOARDING_SPECIAL, CONTACT_REQUEST_ITEM_DO_IT_YOURSELF, EVENT_SOURCE_HUBSPOT, \
+    STATUS_PENDING, STATUS_COMPLETED, STATUS_FAILED
 from tunga_utils.validators import validate_year, validate_file_size, validate_email
 
 
@@ -222,3 +224,48 @@ class SearchEvent(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+
+
+HUBSPOT_ENGAGEMENT_STATUS_CHOICES = (
+    (STATUS_PENDING, 'Pending'),
+    (STATUS_COMPLETED, 'Completed'),
+    (STATUS_FAILED, 'Failed')
+)
+
+
+@python_2_unicode_compatible
+class HubspotEngagement(models.Model):
+    subject = models.CharField(max_length=255)
+    payload = models.TextField()
+    status = models.CharField(
+        max_length=20, choices=HUBSPOT_ENGAGEMENT_STATUS_CHOICES, default=STATUS_PENDING,
+        help_text=','.join(['%s - %s' % (item[0], item[1]) for item in HUBSPOT_ENGAGEMENT_STATUS_CHOICES])
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=datetime.datetime.utcnow)
+    last_error = models.TextField(blank=True, null=True)
+    engagement_id = models.CharField(max_length=50, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} - {}'.format(self.subject, self.get_status_display())
+
+    class Meta:
+        ordering = ['created_at']
+        index_together = ('status', 'next_attempt_at')
+
+
+@python_2_unicode_compatible
+class ExactInvoiceSync(models.Model):
+    reference = models.CharField(max_length=100, unique=True)
+    content_hash = models.CharField(max_length=64)
+    entry_id = models.CharField(max_length=50, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} - {}'.format(self.reference, self.entry_id)
+
+    class Meta:
+        ordering = ['-updated_at']
@@ -1,4 +1,9 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.response import Response
 
 
 class DefaultPagination(PageNumberPagination):
@@ -11,3 +16,71 @@ class LargeResultsSetPagination(PageNumberPagination):
     page_size = 50
     page_size_query_param = 'page_size'
     max_page_size = 10000
+
+
+def get_approximate_count(queryset, limit=1000):
+    """
+    Cheap row count for large tables.
+    Uses the query planner's estimate on PostgreSQL, elsewhere counts at most limit rows.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+            plan = cursor.fetchone()[0]
+        if not isinstance(plan, list):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    return queryset.order_by()[:limit].count()
+
+
+class KeysetCursorPagination(CursorPagination):
+    ordering = '-id'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+    def get_ordering(self, request, queryset, view):
+        # Keyset pages must follow the indexed ordering, not the view's ordering filters
+        return (self.ordering,)
+
+
+class KeysetPagination(DefaultPagination):
+    """
+    Page number pagination that switches to keyset (cursor) pagination on -id when a cursor param is sent.
+    Keyset pages skip COUNT(*) and OFFSET scans, pass count=true for an approximate count.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    cursor_pagination_class = KeysetCursorPagination
+
+    def __init__(self):
+        self.cursor_paginator = None
+        self.approximate_count = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super(KeysetPagination, self).paginate_queryset(queryset, request, view=view)
+
+        self.cursor_paginator = self.cursor_pagination_class()
+        if request.query_params.get(self.count_query_param, '').lower() in ['1', 'true']:
+            self.approximate_count = get_approximate_count(queryset)
+        return self.cursor_paginator.paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is None:
+            return super(KeysetPagination, self).get_paginated_response(data)
+
+        response_data = OrderedDict()
+        if self.approximate_count is not None:
+            response_data['count'] = self.approximate_count
+        response_data['next'] = self.cursor_paginator.get_next_link()
+        response_data['previous'] = self.cursor_paginator.get_previous_link()
+        response_data['results'] = data
+        return Response(response_data)
+
+    def to_html(self):
+        if self.cursor_paginator is None:
+            return super(KeysetPagination, self).to_html()
+        return self.cursor_paginator.to_html()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib_parse import parse_qs
+
+from tunga_utils.constants import CURRENCY_EUR
+from tunga_utils.payoneer_utils import PAYONEER_STATUS_SUCCESS, PAYONEER_STATUS_DUPLICATE_PAYMENT
+
+
+class PayoneerStubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        params = dict((key, values[0]) for key, values in parse_qs(self.rfile.read(length)).items())
+
+        self.server.request_started()
+        try:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+
+            method = params.get('mname', None)
+            if method == 'GetAccountDetails':
+                body = self.server.get_account_details()
+            elif method == 'PerformPayoutPayment':
+                body = self.server.perform_payout_payment(params)
+            else:
+                body = '<{0}><Code>001</Code><Description>Unknown method</Description></{0}>'.format(method)
+        finally:
+            self.server.request_finished()
+
+        if method == 'PerformPayoutPayment' and self.server.should_drop_response():
+            # Simulates a timeout after the request was processed
+            self.close_connection = 1
+            return
+
+        body = '<?xml version="1.0" encoding="utf-8"?>{}'.format(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PayoneerStubServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the Payoneer API (GetAccountDetails and PerformPayoutPayment) for throughput tests.
+    Payouts are deducted from an in memory balance and payment ids are only accepted once.
+    Set drop_responses to close the connection without answering the next n (processed) payout requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, balance=0, latency=0):
+        """
+        :param balance: starting account balance in EUR
+        :param latency: seconds each request takes
+        """
+        HTTPServer.__init__(self, (host, port), PayoneerStubHandler)
+        self.host, self.port = self.server_address
+        self.balance = Decimal(balance)
+        self.latency = latency
+        self.payments = dict()
+        self.balance_requests = 0
+        self.drop_responses = 0
+        self.active_requests = 0
+        self.max_active_requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(self.host, self.port)
+
+    def request_started(self):
+        with self.lock:
+            self.active_requests += 1
+            self.max_active_requests = max(self.max_active_requests, self.active_requests)
+
+    def request_finished(self):
+        with self.lock:
+            self.active_requests -= 1
+
+    def should_drop_response(self):
+        with self.lock:
+            if self.drop_responses > 0:
+                self.drop_responses -= 1
+                return True
+        return False
+
+    def get_account_details(self):
+        with self.lock:
+            self.balance_requests += 1
+            balance = self.balance
+        return '<GetAccountDetails><AccountBalance>{0:.2f}</AccountBalance><FeesDue>0.00</FeesDue>' \
+               '<Curr>{1}</Curr></GetAccountDetails>'.format(balance, CURRENCY_EUR)
+
+    def perform_payout_payment(self, params):
+        payment_id = params.get('p5', None)
+        amount = Decimal(params.get('p7', 0))
+
+        with self.lock:
+            if payment_id in self.payments:
+                return '<PerformPayoutPayment><Status>{}</Status>' \
+                       '<Description>Payment ID already exists</Description></PerformPayoutPayment>'.format(
+                            PAYONEER_STATUS_DUPLICATE_PAYMENT
+                        )
+            if amount > self.balance:
+                return '<PerformPayoutPayment><Status>002</Status>' \
+                       '<Description>Insufficient funds</Description></PerformPayoutPayment>'
+            self.balance -= amount
+            payoneer_id = uuid.uuid4().hex
+            self.payments[payment_id] = dict(payee_id=params.get('p6', None), amount=amount, payoneer_id=payoneer_id)
+
+        return '<PerformPayoutPayment><Status>{}</Status><Description>Processed Successfully</Description>' \
+               '<PaymentID>{}</PaymentID><PayoneerID>{}</PayoneerID></PerformPayoutPayment>'.format(
+                    PAYONEER_STATUS_SUCCESS, payment_id, payoneer_id
+                )
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
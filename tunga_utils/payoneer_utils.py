@@ -3,9 +3,13 @@
 import requests
 from bs4 import BeautifulSoup
 
-from tunga.settings import PAYONEER_API_URL, TUNGA_URL, PAYONEER_USERNAME, PAYONEER_PASSWORD, PAYONEER_PARTNER_ID
+from tunga.settings import PAYONEER_API_URL, TUNGA_URL, PAYONEER_USERNAME, PAYONEER_PASSWORD, PAYONEER_PARTNER_ID, \
+    PAYONEER_REQUEST_TIMEOUT
 from tunga_utils.constants import CURRENCY_EUR
 
+PAYONEER_STATUS_SUCCESS = '000'
+PAYONEER_STATUS_DUPLICATE_PAYMENT = '009'  # Payment id was already processed
+
 
 class TungaPayoneer(object):
     """
@@ -120,7 +124,10 @@ class TungaPayoneer(object):
         """
         payload = self._create_request_params('GetToken', dict(p4=payee_id))
 
-        response = requests.post(self.PAYONEER_API_URL, data=payload, headers=headers or self.DEFAULT_HEADERS)
+        response = requests.post(
+            self.PAYONEER_API_URL, data=payload, headers=headers or self.DEFAULT_HEADERS,
+            timeout=PAYONEER_REQUEST_TIMEOUT
+        )
 
         try:
             return self._parse_xml_response(response.text, ['token'])
@@ -135,7 +142,10 @@ class TungaPayoneer(object):
         if type(data) is dict:
             xml_data.update(data)
         payload = self._create_request_params('GetTokenXML', dict(xml=self.compose_sign_up_xml(xml_data)))
-        response = requests.post(self.PAYONEER_API_URL, data=payload, headers=headers or self.DEFAULT_HEADERS)
+        response = requests.post(
+            self.PAYONEER_API_URL, data=payload, headers=headers or self.DEFAULT_HEADERS,
+            timeout=PAYONEER_REQUEST_TIMEOUT
+        )
 
         try:
             return self._parse_xml_response(response.text, ['token'])
@@ -147,7 +157,10 @@ class TungaPayoneer(object):
         Get Balance
         """
         payload = self._create_request_params('GetAccountDetails')
-        response = requests.post(self.PAYONEER_API_URL, data=payload, headers=headers or self.DEFAULT_HEADERS)
+        response = requests.post(
+            self.PAYONEER_API_URL, data=payload, headers=headers or self.DEFAULT_HEADERS,
+            timeout=PAYONEER_REQUEST_TIMEOUT
+        )
 
         try:
             return self._parse_xml_response(response.text, ['accountbalance', 'feesdue', 'curr'])
@@ -164,7 +177,10 @@ class TungaPayoneer(object):
                 p8=description, Currency=currency
             )
         )
-        response = requests.post(self.PAYONEER_API_URL, data=payload, headers=headers or self.DEFAULT_HEADERS)
+        response = requests.post(
+            self.PAYONEER_API_URL, data=payload, headers=headers or self.DEFAULT_HEADERS,
+            timeout=PAYONEER_REQUEST_TIMEOUT
+        )
 
         try:
             return self._parse_xml_response(response.text, ['status', 'paymentid', 'payoneerid', 'description'])
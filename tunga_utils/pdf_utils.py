@@ -0,0 +1,307 @@
+import datetime
+import errno
+import hashlib
+import json
+import os
+import shutil
+import socket
+import tempfile
+import uuid
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.utils.module_loading import import_string
+from django_rq.decorators import job
+from weasyprint import HTML
+
+from tunga.settings import PDF_CACHE_ROOT, PDF_CACHE_MAX_SIZE, PDF_CACHE_EVICT_RATIO, PDF_CACHE_VERSION, \
+    PDF_JOB_TIMEOUT, PDF_JOB_FILES_DIR, TUNGA_URL
+from tunga_utils.constants import STATUS_PENDING, STATUS_PROCESSING, STATUS_COMPLETED, STATUS_FAILED
+
+
+class PdfJobResult(object):
+    """
+    File written to disk by a renderer, the job streams it to storage instead of loading it into memory
+    """
+
+    def __init__(self, path, content_type='application/pdf', extension='pdf'):
+        self.path = path
+        self.content_type = content_type
+        self.extension = extension
+
+
+class PdfJobError(Exception):
+    """
+    Raised by renderers when there's nothing to render, the job fails with the message
+    """
+    pass
+
+
+def get_pdf_cache_scope(name, pk):
+    """
+    Cache entries are grouped per source object (e.g invoice 5 -> invoice_5) so they can be invalidated together
+    """
+    return '{}_{}'.format(name, pk)
+
+
+def get_pdf_cache_key(html):
+    if not isinstance(html, bytes):
+        html = html.encode('utf-8')
+    return hashlib.sha256('{}:'.format(PDF_CACHE_VERSION).encode('utf-8') + html).hexdigest()
+
+
+def get_pdf_cache_path(scope, key):
+    return os.path.join(PDF_CACHE_ROOT, scope or 'default', '{}.pdf'.format(key))
+
+
+def _read_cached_pdf(path):
+    try:
+        with open(path, 'rb') as pdf_file:
+            data = pdf_file.read()
+    except IOError:
+        return None
+    try:
+        # Refresh mtime so eviction drops the least recently used files first
+        os.utime(path, None)
+    except OSError:
+        pass
+    return data
+
+
+def _write_cached_pdf(path, data):
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        # Atomic so concurrent readers never see a partial file
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_pdf_cache_size_key():
+    # The cache directory is local to each host
+    return 'pdf_cache_size:{}:{}'.format(socket.gethostname(), PDF_CACHE_ROOT)
+
+
+def _track_pdf_cache_write(size):
+    """
+    Adds a write to the host's estimated cache size, the cache is only walked and evicted once that passes the limit
+    """
+    try:
+        total_size = cache.incr(get_pdf_cache_size_key(), size)
+    except ValueError:
+        # Not known yet (or expired), walk the cache once to find out
+        total_size = None
+    if total_size is None or total_size > PDF_CACHE_MAX_SIZE:
+        evict_pdf_cache()
+
+
+def evict_pdf_cache(max_size=None):
+    """
+    Deletes the least recently used PDFs once the cache is over max_size bytes,
+    down to PDF_CACHE_EVICT_RATIO of it so the next few writes don't trigger another walk
+    """
+    if max_size is None:
+        max_size = PDF_CACHE_MAX_SIZE
+
+    entries = []
+    total_size = 0
+    for root, dirs, files in os.walk(PDF_CACHE_ROOT):
+        for filename in files:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+    evicted = 0
+    if total_size > max_size:
+        for mtime, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            evicted += 1
+            if total_size <= max_size * PDF_CACHE_EVICT_RATIO:
+                break
+    cache.set(get_pdf_cache_size_key(), total_size, None)
+    return evicted
+
+
+def invalidate_pdf_cache(scope):
+    shutil.rmtree(os.path.join(PDF_CACHE_ROOT, scope), ignore_errors=True)
+
+
+def render_pdf(html, scope=None):
+    """
+    Renders html to a PDF, reusing a cached copy when identical html has been rendered before
+    :param html: rendered html
+    :param scope: cache scope from get_pdf_cache_scope, used for invalidation
+    :return: PDF bytes
+    """
+    path = get_pdf_cache_path(scope, get_pdf_cache_key(html))
+    data = _read_cached_pdf(path)
+    if data is not None:
+        return data
+
+    data = HTML(string=html, encoding='utf-8').write_pdf()
+    try:
+        _write_cached_pdf(path, data)
+        _track_pdf_cache_write(len(data))
+    except (IOError, OSError):
+        # Caching is best effort, the PDF is still returned
+        pass
+    return data
+
+
+def get_pdf_job_id(renderer, kwargs, user_id=None, admin_only=False):
+    """
+    Identical render requests map to the same job id so they collapse into one render
+    """
+    return hashlib.sha256(
+        json.dumps([renderer, kwargs, user_id, admin_only], sort_keys=True).encode('utf-8')
+    ).hexdigest()[:32]
+
+
+def get_pdf_job_key(job_id):
+    return 'pdf_job:{}'.format(job_id)
+
+
+def get_pdf_job_file_name(job_id):
+    """
+    Results are kept in the default storage (not the local PDF cache) so any web host can serve them.
+    The storage may be public (e.g MEDIA_ROOT) and job ids are predictable, so names get a random token.
+    Only pdf_job_download reads the name from the job, it's never shown to users.
+    Results can be PDFs or ZIPs (see PdfJobResult)
+    """
+    return '{}/{}-{}'.format(PDF_JOB_FILES_DIR, job_id, uuid.uuid4().hex)
+
+
+def has_pdf_job_file(pdf_job):
+    return bool(pdf_job.get('file', None)) and default_storage.exists(pdf_job['file'])
+
+
+def _save_pdf_job_file(job_id, result):
+    name = get_pdf_job_file_name(job_id)
+    if isinstance(result, PdfJobResult):
+        try:
+            with open(result.path, 'rb') as result_file:
+                return default_storage.save(name, File(result_file))
+        finally:
+            try:
+                os.remove(result.path)
+            except OSError:
+                pass
+    return default_storage.save(name, ContentFile(result))
+
+
+def delete_expired_pdf_job_files():
+    """
+    Deletes job results older than PDF_JOB_TIMEOUT, their jobs have expired so they can't be downloaded anymore
+    """
+    if not default_storage.exists(PDF_JOB_FILES_DIR):
+        return 0
+
+    expired_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=PDF_JOB_TIMEOUT)
+    deleted = 0
+    for filename in default_storage.listdir(PDF_JOB_FILES_DIR)[1]:
+        name = '{}/{}'.format(PDF_JOB_FILES_DIR, filename)
+        if default_storage.get_modified_time(name) < expired_at:
+            default_storage.delete(name)
+            deleted += 1
+    return deleted
+
+
+def get_pdf_job(job_id):
+    return cache.get(get_pdf_job_key(job_id))
+
+
+def update_pdf_job(job_id, **kwargs):
+    pdf_job = get_pdf_job(job_id)
+    if pdf_job:
+        pdf_job.update(kwargs)
+        cache.set(get_pdf_job_key(job_id), pdf_job, PDF_JOB_TIMEOUT)
+    return pdf_job
+
+
+def get_pdf_job_details(pdf_job):
+    details = dict(
+        id=pdf_job['id'], status=pdf_job['status'], url='{}/api/pdf-jobs/{}/'.format(TUNGA_URL, pdf_job['id'])
+    )
+    if pdf_job['status'] == STATUS_COMPLETED:
+        details['download_url'] = '{}/api/pdf-jobs/{}/download/'.format(TUNGA_URL, pdf_job['id'])
+    elif pdf_job['status'] == STATUS_FAILED and pdf_job.get('error', None):
+        details['error'] = pdf_job['error']
+    return details
+
+
+def can_access_pdf_job(user, pdf_job):
+    if not pdf_job or not user.is_authenticated():
+        return False
+    if user.is_admin:
+        return True
+    return not pdf_job.get('admin_only', False) and pdf_job.get('user_id', None) == user.id
+
+
+@job
+def generate_pdf_job(job_id, renderer, kwargs):
+    """
+    :param job_id: id from get_pdf_job_id
+    :param renderer: dotted path to a callable that returns PDF bytes or a PdfJobResult
+    :param kwargs: keyword arguments for the renderer
+    """
+    update_pdf_job(job_id, status=STATUS_PROCESSING)
+    try:
+        result = import_string(renderer)(**kwargs)
+        name = _save_pdf_job_file(job_id, result)
+    except PdfJobError as e:
+        update_pdf_job(job_id, status=STATUS_FAILED, error=str(e))
+        return
+    except:
+        update_pdf_job(job_id, status=STATUS_FAILED)
+        raise
+    if isinstance(result, PdfJobResult):
+        update_pdf_job(job_id, content_type=result.content_type, extension=result.extension)
+    update_pdf_job(job_id, status=STATUS_COMPLETED, file=name)
+
+
+def enqueue_pdf_job(renderer, kwargs=None, user_id=None, admin_only=False):
+    """
+    Queues a PDF render unless an identical one is already queued, running or finished
+    :param renderer: dotted path to a callable that returns PDF bytes
+    :param kwargs: json serializable keyword arguments for the renderer
+    :param user_id: user allowed to download the PDF
+    :param admin_only: restrict the download to admins
+    :return: job state dict
+    """
+    kwargs = kwargs or dict()
+    job_id = get_pdf_job_id(renderer, kwargs, user_id=user_id, admin_only=admin_only)
+    key = get_pdf_job_key(job_id)
+
+    pdf_job = get_pdf_job(job_id)
+    if pdf_job and (
+        pdf_job['status'] == STATUS_FAILED or
+        (pdf_job['status'] == STATUS_COMPLETED and not has_pdf_job_file(pdf_job))
+    ):
+        # Retry failed jobs and re-render deleted files
+        if pdf_job.get('file', None):
+            default_storage.delete(pdf_job['file'])
+        cache.delete(key)
+
+    pdf_job = dict(id=job_id, status=STATUS_PENDING, user_id=user_id, admin_only=admin_only)
+    if cache.add(key, pdf_job, PDF_JOB_TIMEOUT):
+        generate_pdf_job.delay(job_id, renderer, kwargs)
+        return pdf_job
+    return get_pdf_job(job_id) or pdf_job
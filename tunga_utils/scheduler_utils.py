@@ -0,0 +1,124 @@
+import calendar
+import datetime
+import socket
+import time
+import traceback
+from functools import wraps
+
+from django.db import connections
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from tunga.settings import SCHEDULER_LOCK_TIMEOUT
+from tunga_utils.constants import STATUS_COMPLETED, STATUS_FAILED, STATUS_SKIPPED, STATUS_MISSED
+
+SCHEDULER_JOBS_KEY = 'scheduler_jobs'
+SCHEDULER_LOCK_KEY = 'scheduler_lock:{}'
+SCHEDULER_STATUS_KEY = 'scheduler_status:{}'
+
+
+def get_timestamp(value):
+    # APScheduler run times are timezone aware
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+
+def exclusive_job(lock_timeout=SCHEDULER_LOCK_TIMEOUT, **interval):
+    """
+    Runs a scheduler job on only one host at a time.
+    The job is also skipped if it started on any host less than half the interval ago,
+    so schedulers on several hosts don't each run it once per interval.
+    :param lock_timeout: seconds after which the lock is released even if the job hasn't finished
+    :param interval: the job's interval as timedelta keyword arguments (e.g minutes=5)
+    """
+    min_gap = datetime.timedelta(**interval).total_seconds() / 2
+
+    def decorator(func):
+        name = func.__name__
+
+        @wraps(func)
+        def wrapper():
+            redis = get_redis_connection()
+            started_at = time.time()
+            lock = redis.lock(SCHEDULER_LOCK_KEY.format(name), timeout=lock_timeout)
+            if not lock.acquire(blocking=False):
+                return dict(status=STATUS_SKIPPED, started_at=started_at, duration=0)
+
+            try:
+                last_started_at = redis.hget(SCHEDULER_STATUS_KEY.format(name), 'last_started_at')
+                if last_started_at and started_at - float(last_started_at) < min_gap:
+                    return dict(status=STATUS_SKIPPED, started_at=started_at, duration=0)
+                redis.hset(SCHEDULER_STATUS_KEY.format(name), 'last_started_at', started_at)
+
+                try:
+                    func()
+                except Exception:
+                    return dict(
+                        status=STATUS_FAILED, started_at=started_at, duration=time.time() - started_at,
+                        error=traceback.format_exc()
+                    )
+                finally:
+                    # Pool threads are reused, don't leave their database connections open
+                    connections.close_all()
+                return dict(status=STATUS_COMPLETED, started_at=started_at, duration=time.time() - started_at)
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    # Lock expired while the job was running
+                    pass
+        return wrapper
+    return decorator
+
+
+def record_job_run(name, scheduled_run_time, result=None):
+    """
+    Records the outcome, duration and lag (delay between the scheduled and actual start) of a job run
+    :param result: dict returned by an exclusive_job or None if the run was missed
+    """
+    redis = get_redis_connection()
+    key = SCHEDULER_STATUS_KEY.format(name)
+    status = result and result['status'] or STATUS_MISSED
+
+    details = dict(
+        last_status=status, last_host=socket.gethostname(), last_scheduled_at=get_timestamp(scheduled_run_time)
+    )
+    if result:
+        details['last_lag'] = max(result['started_at'] - details['last_scheduled_at'], 0)
+        if status != STATUS_SKIPPED:
+            details.update(last_run_at=result['started_at'], last_duration=result['duration'])
+        if status == STATUS_FAILED:
+            details['last_error'] = result.get('error', '')
+            details['last_failed_at'] = result['started_at']
+
+    pipe = redis.pipeline()
+    pipe.sadd(SCHEDULER_JOBS_KEY, name)
+    pipe.hmset(key, details)
+    pipe.hincrby(key, '{}_count'.format(status), 1)
+    pipe.execute()
+
+
+def get_scheduler_status():
+    """
+    :return: list of recorded job stats sorted by job name
+    """
+    redis = get_redis_connection()
+    names = sorted(redis.smembers(SCHEDULER_JOBS_KEY))
+
+    pipe = redis.pipeline()
+    for name in names:
+        pipe.hgetall(SCHEDULER_STATUS_KEY.format(name))
+
+    jobs = []
+    for name, details in zip(names, pipe.execute()):
+        job_status = dict(name=name)
+        for field, value in details.items():
+            if field in ['last_status', 'last_host', 'last_error']:
+                job_status[field] = value
+            elif field.endswith('_count'):
+                job_status[field] = int(value)
+            elif field in ['last_duration', 'last_lag']:
+                job_status[field] = float(value)
+            else:
+                job_status[field] = datetime.datetime.utcfromtimestamp(float(value))
+        jobs.append(job_status)
+    return jobs
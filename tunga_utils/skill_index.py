@@ -0,0 +1,50 @@
+from django.apps import apps
+from django.db.models.aggregates import Count
+from django.db.models.expressions import Subquery, OuterRef
+from django.db.models.fields import IntegerField
+
+SKILL_INDEX_TASKS = 'tasks'
+SKILL_INDEX_USERS = 'users'
+
+# index name -> (model label, skills field name, field on the model that matches the queryset's primary key)
+SKILL_INDEX_SOURCES = {
+    SKILL_INDEX_TASKS: ('tunga_tasks.Task', 'skills', 'id'),
+    SKILL_INDEX_USERS: ('tunga_profiles.UserProfile', 'skills', 'user_id'),
+}
+
+
+def get_skill_match_subqueries(index, skill_ids):
+    """
+    :return: (object id subquery, correlated match count subquery) over the skills through table
+    """
+    model_label, field_name, id_field = SKILL_INDEX_SOURCES[index]
+    field = apps.get_model(model_label)._meta.get_field(field_name)
+    object_lookup = field.m2m_field_name()
+    if id_field != 'id':
+        object_lookup = '{}__{}'.format(object_lookup, id_field)
+
+    tagged = field.remote_field.through.objects.filter(
+        **{'{}__in'.format(field.m2m_reverse_field_name()): skill_ids}
+    ).order_by()
+    return (
+        tagged.values(object_lookup),
+        tagged.filter(**{object_lookup: OuterRef('pk')}).values(object_lookup).annotate(
+            matches=Count('pk')
+        ).values('matches')
+    )
+
+
+def annotate_skill_matches(queryset, index, skill_ids, field_name='matches'):
+    """
+    Restricts queryset to objects sharing at least one of the skills and annotates the number of matches.
+    Matching and counting run in the database (driven by the through table's skill index),
+    so ordering and pagination only load the current page.
+    """
+    skill_ids = list(skill_ids)
+    if not skill_ids:
+        return queryset.none()
+
+    object_ids, matches = get_skill_match_subqueries(index, skill_ids)
+    return queryset.filter(id__in=object_ids).annotate(**{
+        field_name: Subquery(matches, output_field=IntegerField())
+    })
@@ -1,11 +1,17 @@
+import hashlib
 import json
+import time
 
 import requests
 from django.core.exceptions import ObjectDoesNotExist
+from django_redis import get_redis_connection
+from django_rq.decorators import job
 from slacker import Slacker
 
 from tunga.settings import SLACK_STAFF_OUTGOING_WEBHOOK_TOKEN, SLACK_AUTHORIZE_URL, SLACK_SCOPES, SLACK_CLIENT_ID, \
-    SLACK_ACCESS_TOKEN_URL, TUNGA_ICON_SQUARE_URL_150
+    SLACK_ACCESS_TOKEN_URL, TUNGA_ICON_SQUARE_URL_150, SLACK_API_URL, SLACK_REQUEST_TIMEOUT, SLACK_DELIVERY_WINDOW, \
+    SLACK_DELIVERY_MAX_ATTEMPTS, SLACK_DELIVERY_MAX_BACKOFF, SLACK_DELIVERY_MAX_ATTACHMENTS, SLACK_DIRECTORY_TIMEOUT, \
+    SLACK_DIRECTORY_REFRESH_INTERVAL, SLACK_DIRECTORY_MISS_INTERVAL
 from tunga_profiles.utils import get_app_integration
 from tunga_utils.constants import APP_INTEGRATION_PROVIDER_SLACK
 
@@ -61,6 +67,21 @@ KEY_GROUPS = 'groups'
 
 VALUE_TYPE_BUTTON = 'button'
 
+KEY_WEBHOOK_URL = 'webhook_url'
+
+SLACK_RQ_QUEUE = 'slack'  # RQ queue for Slack deliveries, run with: python manage.py rqworker slack
+
+SLACK_QUEUE_KEY = 'slack_queue:{}'
+SLACK_QUEUE_SCHEDULED_KEY = 'slack_queue_scheduled:{}'
+SLACK_QUEUE_SCHEDULED_TIMEOUT = 10 * 60  # Lets a new delivery be scheduled if a delivery job gets lost
+
+SLACK_DIRECTORY_KEY = 'slack_directory:{}'
+SLACK_DIRECTORY_REFRESH_KEY = 'slack_directory_refresh:{}'
+SLACK_DIRECTORY_REFRESHED_AT_FIELD = '__refreshed_at'
+SLACK_DIRECTORY_PAGE_SIZE = 200
+
+_slack_sessions = dict()
+
 
 def get_authorize_url(redirect_uri):
     return '%s?client_id=%s&scope=%s&redirect_uri=%s' % (
@@ -98,9 +119,162 @@ def is_task_notification_enabled(task, event_id):
     return target_task.integration_set.filter(provider=APP_INTEGRATION_PROVIDER_SLACK, events__id=event_id).count() > 0
 
 
+def get_slack_session(key):
+    """
+    HTTP session per token or webhook url, so deliveries reuse keep-alive connections
+    """
+    session = _slack_sessions.get(key, None)
+    if session is None:
+        session = requests.Session()
+        _slack_sessions[key] = session
+    return session
+
+
+def get_slack_queue_id(destination):
+    return hashlib.sha1(json.dumps(destination, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def queue_slack_message(destination, message):
+    """
+    Queues a message per destination (webhook or token and channel).
+    Messages queued within SLACK_DELIVERY_WINDOW seconds are delivered together by deliver_slack_queue.
+    """
+    queue_id = get_slack_queue_id(destination)
+    redis = get_redis_connection()
+    redis.rpush(SLACK_QUEUE_KEY.format(queue_id), json.dumps(dict(destination=destination, message=message)))
+    if redis.set(SLACK_QUEUE_SCHEDULED_KEY.format(queue_id), 1, nx=True, ex=SLACK_QUEUE_SCHEDULED_TIMEOUT):
+        deliver_slack_queue.delay(queue_id)
+
+
+def merge_slack_messages(messages):
+    """
+    Merges consecutive messages with the same options (channel, username, icon e.t.c) into one message.
+    The text of each merged message becomes the pretext of its first attachment so it stays above its attachments.
+    """
+    merged = []
+    last_options = None
+    for message in messages:
+        options = dict((key, value) for key, value in message.items() if key not in [KEY_TEXT, KEY_ATTACHMENTS])
+        text = message.get(KEY_TEXT, None)
+        attachments = list(message.get(KEY_ATTACHMENTS, None) or [])
+
+        if merged and options == last_options and \
+                len(merged[-1].get(KEY_ATTACHMENTS, [])) + max(len(attachments), 1) <= SLACK_DELIVERY_MAX_ATTACHMENTS:
+            if text:
+                if attachments:
+                    attachments[0] = dict(attachments[0])
+                    pretext = attachments[0].get(KEY_PRETEXT, None)
+                    attachments[0][KEY_PRETEXT] = pretext and '{}\n{}'.format(text, pretext) or text
+                    attachments[0][KEY_MRKDWN_IN] = list(
+                        set(attachments[0].get(KEY_MRKDWN_IN, None) or []) | {KEY_PRETEXT}
+                    )
+                else:
+                    attachments = [{KEY_PRETEXT: text, KEY_MRKDWN_IN: [KEY_PRETEXT]}]
+            merged[-1].setdefault(KEY_ATTACHMENTS, []).extend(attachments)
+        else:
+            merged_message = dict(message)
+            merged_message[KEY_ATTACHMENTS] = attachments
+            merged.append(merged_message)
+            last_options = options
+    return merged
+
+
+def request_slack(session, url, **kwargs):
+    """
+    POSTs to Slack, retrying with backoff on rate limits (honoring Retry-After), server errors and connection errors
+    :return: response or None if Slack couldn't be reached after SLACK_DELIVERY_MAX_ATTEMPTS
+    """
+    for attempt in range(SLACK_DELIVERY_MAX_ATTEMPTS):
+        backoff = 2 ** attempt
+        try:
+            response = session.post(url, timeout=SLACK_REQUEST_TIMEOUT, **kwargs)
+        except requests.RequestException:
+            response = None
+
+        if response is not None:
+            if response.status_code == 429:
+                try:
+                    backoff = int(response.headers.get('Retry-After', backoff))
+                except ValueError:
+                    pass
+            elif response.status_code < 500:
+                return response
+
+        if attempt < SLACK_DELIVERY_MAX_ATTEMPTS - 1:
+            time.sleep(min(backoff, SLACK_DELIVERY_MAX_BACKOFF))
+    return None
+
+
+def call_slack_api(token, method, **kwargs):
+    """
+    Calls a Web API method with the pooled session of the token
+    :return: response body or None if the call failed
+    """
+    data = dict(kwargs)
+    data[KEY_TOKEN] = token
+    response = request_slack(get_slack_session(token), '{}{}'.format(SLACK_API_URL, method), data=data)
+    if response is None:
+        return None
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    return body.get('ok', False) and body or None
+
+
+def post_slack_message(destination, message):
+    """
+    Posts a message to a webhook or with the Web API
+    :return: True if Slack accepted the message
+    """
+    webhook_url = destination.get(KEY_WEBHOOK_URL, None)
+    if webhook_url:
+        response = request_slack(get_slack_session(webhook_url), webhook_url, json=message)
+        return response is not None and response.ok
+
+    data = dict(message)
+    data.update({KEY_CHANNEL: destination[KEY_CHANNEL], 'as_user': 'false'})
+    if data.get(KEY_ATTACHMENTS, None):
+        data[KEY_ATTACHMENTS] = json.dumps(data[KEY_ATTACHMENTS])
+    return call_slack_api(destination[KEY_TOKEN], 'chat.postMessage', **data) is not None
+
+
+@job(SLACK_RQ_QUEUE)
+def deliver_slack_queue(queue_id):
+    """
+    Delivers all messages queued for a destination, merging bursts into as few messages as possible.
+    Runs on the dedicated slack queue since it waits for the burst window and backs off on rate limits,
+    which would otherwise hold up default queue workers (emails, PDFs, payouts).
+    :return: tuple of (delivered, failed) message counts
+    """
+    # Give the rest of the burst time to arrive
+    time.sleep(SLACK_DELIVERY_WINDOW)
+
+    redis = get_redis_connection()
+    # Cleared before draining so messages queued from here on schedule another delivery
+    redis.delete(SLACK_QUEUE_SCHEDULED_KEY.format(queue_id))
+
+    pipe = redis.pipeline()
+    pipe.lrange(SLACK_QUEUE_KEY.format(queue_id), 0, -1)
+    pipe.delete(SLACK_QUEUE_KEY.format(queue_id))
+    items = [json.loads(item) for item in pipe.execute()[0]]
+    if not items:
+        return 0, 0
+
+    destination = items[0]['destination']
+    delivered = 0
+    failed = 0
+    for message in merge_slack_messages([item['message'] for item in items]):
+        if post_slack_message(destination, message):
+            delivered += 1
+        else:
+            failed += 1
+    return delivered, failed
+
+
 def send_incoming_webhook(url, message):
     message[KEY_LINK_NAMES] = 1
-    return requests.post(url, json=message)
+    queue_slack_message({KEY_WEBHOOK_URL: url, KEY_CHANNEL: message.get(KEY_CHANNEL, None)}, message)
 
 
 def get_slack_token(user):
@@ -156,11 +330,13 @@ def send_project_message(project, message=None, attachments=None, author_name='t
 
 
 def send_slack_message(token, channel, message=None, attachments=None, author_name='tunga', author_icon=TUNGA_ICON_SQUARE_URL_150):
-    slack_client = Slacker(token)
-    slack_client.chat.post_message(
-        channel, message, attachments=attachments,
-        as_user=False, username=author_name, icon_url=author_icon, link_names=1
-    )
+    queue_slack_message({KEY_TOKEN: token, KEY_CHANNEL: channel}, {
+        KEY_TEXT: message,
+        KEY_ATTACHMENTS: attachments,
+        KEY_USERNAME: author_name,
+        KEY_ICON_URL: author_icon,
+        KEY_LINK_NAMES: 1
+    })
 
 
 def upload_file(token, channel, upload, content=None, filetype=None, filename=None, title=None, initial_comment=None):
@@ -171,52 +347,118 @@ def upload_file(token, channel, upload, content=None, filetype=None, filename=No
     )
 
 
+def get_slack_directory_id(token):
+    # Tokens are per team installation, hashed to keep them out of key names
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+
+def list_slack_members(token):
+    """
+    :return: all members of the token's team, paging through users.list, or None if a page failed
+    """
+    members = []
+    cursor = None
+    while True:
+        params = dict(limit=SLACK_DIRECTORY_PAGE_SIZE)
+        if cursor:
+            params['cursor'] = cursor
+        body = call_slack_api(token, 'users.list', **params)
+        if body is None:
+            return None
+        members.extend(body.get(KEY_MEMBERS, None) or [])
+        cursor = (body.get('response_metadata', None) or dict()).get('next_cursor', None)
+        if not cursor:
+            return members
+
+
+@job(SLACK_RQ_QUEUE)
+def refresh_slack_directory(token):
+    """
+    Rebuilds the email -> (user id, username, IM channel id) directory of the token's team
+    :return: True if the directory was rebuilt
+    """
+    members = list_slack_members(token)
+    if members is None:
+        return False
+
+    key = SLACK_DIRECTORY_KEY.format(get_slack_directory_id(token))
+    redis = get_redis_connection()
+
+    # IM channel ids don't change, keep the ones opened before
+    im_ids = dict()
+    for field, value in redis.hgetall(key).items():
+        if field != SLACK_DIRECTORY_REFRESHED_AT_FIELD:
+            entry = json.loads(value)
+            if entry.get('im_id', None):
+                im_ids[entry['id']] = entry['im_id']
+
+    directory = dict()
+    for member in members:
+        email = (member.get(KEY_PROFILE, None) or dict()).get(KEY_EMAIL, None)
+        if not email or (email.lower() in directory and member.get('deleted', False)):
+            continue
+        directory[email.lower()] = json.dumps(
+            dict(id=member.get(KEY_ID, None), name=member.get(KEY_NAME, None), im_id=im_ids.get(member.get(KEY_ID)))
+        )
+    directory[SLACK_DIRECTORY_REFRESHED_AT_FIELD] = int(time.time())
+
+    pipe = redis.pipeline()
+    pipe.delete(key)
+    pipe.hmset(key, directory)
+    pipe.expire(key, SLACK_DIRECTORY_TIMEOUT)
+    pipe.execute()
+    return True
+
+
+def get_slack_directory_entry(email, token):
+    """
+    Looks up a team member by email in the cached team directory.
+    Unknown emails trigger a refresh (at most once every SLACK_DIRECTORY_MISS_INTERVAL) in case they just joined,
+    stale directories are refreshed in the background.
+    :return: dict with id, name and im_id or None
+    """
+    if not email or not token:
+        return None
+
+    directory_id = get_slack_directory_id(token)
+    key = SLACK_DIRECTORY_KEY.format(directory_id)
+    refresh_key = SLACK_DIRECTORY_REFRESH_KEY.format(directory_id)
+    redis = get_redis_connection()
+
+    entry, refreshed_at = redis.hmget(key, [email.lower(), SLACK_DIRECTORY_REFRESHED_AT_FIELD])
+    if refreshed_at is None or entry is None:
+        if redis.set(refresh_key, 1, nx=True, ex=SLACK_DIRECTORY_MISS_INTERVAL):
+            refresh_slack_directory(token)
+            entry = redis.hget(key, email.lower())
+    elif int(refreshed_at) < time.time() - SLACK_DIRECTORY_REFRESH_INTERVAL:
+        if redis.set(refresh_key, 1, nx=True, ex=SLACK_DIRECTORY_MISS_INTERVAL):
+            refresh_slack_directory.delay(token)
+    return entry and json.loads(entry) or None
+
+
 def get_user_id(email, token):
-    slack_client = Slacker(token)
-    try:
-        response = slack_client.users.list()
-        if response.successful:
-            users = response.body.get(KEY_MEMBERS, None)
-            if users:
-                for user in users:
-                    user_profile = user.get(KEY_PROFILE, None)
-                    if user_profile:
-                        if user_profile.get(KEY_EMAIL, None) == email:
-                            return user.get(KEY_ID, None)
-    except:
-        pass
-    return None
+    entry = get_slack_directory_entry(email, token)
+    return entry and entry.get('id', None) or None
 
 
 def get_username(email, token):
-    slack_client = Slacker(token)
-    try:
-        response = slack_client.users.list()
-        if response.successful:
-            users = response.body.get(KEY_MEMBERS, None)
-            if users:
-                for user in users:
-                    user_profile = user.get(KEY_PROFILE, None)
-                    if user_profile:
-                        if user_profile.get(KEY_EMAIL, None) == email:
-                            return user.get(KEY_NAME, None)
-    except:
-        pass
-    return None
+    entry = get_slack_directory_entry(email, token)
+    return entry and entry.get('name', None) or None
 
 
 def get_user_im_id(email, token):
-    user_id = get_user_id(email, token)
-
-    if user_id:
-        slack_client = Slacker(token)
-
-        try:
-            im_response = slack_client.im.open(user_id)
-            if im_response and im_response.successful:
-                im_details = im_response.body.get(KEY_CHANNEL, None)
-                return im_details.get(KEY_ID, None)
-        except:
-            pass
-    return None
-
+    entry = get_slack_directory_entry(email, token)
+    if not entry or not entry.get('id', None):
+        return None
+    if entry.get('im_id', None):
+        return entry['im_id']
+
+    body = call_slack_api(token, 'im.open', user=entry['id'])
+    im_id = body and (body.get(KEY_CHANNEL, None) or dict()).get(KEY_ID, None) or None
+    if im_id:
+        key = SLACK_DIRECTORY_KEY.format(get_slack_directory_id(token))
+        redis = get_redis_connection()
+        if redis.hexists(key, email.lower()):
+            entry['im_id'] = im_id
+            redis.hset(key, email.lower(), json.dumps(entry))
+    return im_id
@@ -1,3 +1,218 @@
-from django.test import TestCase
+import asyncore
+import datetime
+import json
+import smtpd
+import threading
+from collections import OrderedDict
 
-# Create your tests here.
+from django.core.mail import get_connection
+from django.core.mail.message import EmailMessage
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from tunga.settings import SLACK_DELIVERY_MAX_ATTACHMENTS
+from tunga_utils import hubspot_utils
+from tunga_utils.constants import STATUS_PENDING, STATUS_COMPLETED, STATUS_FAILED
+from tunga_utils.emails import send_mail_batch, CachedPremailer, PREMAILER_CACHE_SIZE
+from tunga_utils.hubspot_utils import send_queued_hubspot_engagements, HUBSPOT_ENGAGEMENT_MAX_ATTEMPTS
+from tunga_utils.models import HubspotEngagement
+from tunga_utils.slack_utils import merge_slack_messages, KEY_CHANNEL, KEY_TEXT, KEY_ATTACHMENTS, KEY_PRETEXT, \
+    KEY_MRKDWN_IN
+
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    """
+    SMTP stand-in that records connections and messages instead of delivering them
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        self.host, self.port = self.socket.getsockname()
+        self.connections = 0
+        self.messages = []
+        self.thread = None
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append(dict(mailfrom=mailfrom, rcpttos=rcpttos, data=data))
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncore.loop, kwargs=dict(timeout=0.1, map=self._map))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        for channel in list(self._map.values()):
+            channel.close()
+        self.thread.join()
+
+
+class SendMailBatchTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.server.start()
+        self.settings_override = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=self.server.host, EMAIL_PORT=self.server.port,
+            EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.stop()
+
+    def get_messages(self, count):
+        return [
+            EmailMessage('Subject {}'.format(idx), 'Body', 'hello@tunga.io', ['user{}@example.com'.format(idx)])
+            for idx in range(count)
+        ]
+
+    def test_batch_reuses_connection(self):
+        results = send_mail_batch(self.get_messages(3))
+
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_batch_reconnects_dropped_connection(self):
+        connection = get_connection()
+        try:
+            self.assertEqual(send_mail_batch(self.get_messages(1), connection=connection), [True])
+            # Drop the socket without telling the backend
+            connection.connection.sock.close()
+            self.assertEqual(send_mail_batch(self.get_messages(2), connection=connection), [True, True])
+        finally:
+            connection.close()
+
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_batch_reports_failed_messages(self):
+        messages = self.get_messages(2)
+        messages[0].to = []
+
+        self.assertEqual(send_mail_batch(messages), [False, True])
+        self.assertEqual(len(self.server.messages), 1)
+
+
+class CachedPremailerTestCase(SimpleTestCase):
+
+    def test_cache_keeps_most_recently_used_entries(self):
+        cache = OrderedDict()
+        for idx in range(PREMAILER_CACHE_SIZE):
+            CachedPremailer._get_cached(cache, idx, lambda: 'style')
+        # Use the oldest entry again so it isn't evicted next
+        CachedPremailer._get_cached(cache, 0, lambda: 'reloaded')
+        CachedPremailer._get_cached(cache, PREMAILER_CACHE_SIZE, lambda: 'style')
+
+        self.assertEqual(len(cache), PREMAILER_CACHE_SIZE)
+        self.assertEqual(cache[0], 'style')
+        self.assertNotIn(1, cache)
+
+
+class MergeSlackMessagesTestCase(SimpleTestCase):
+
+    def test_merged_text_becomes_pretext(self):
+        merged = merge_slack_messages([
+            {KEY_CHANNEL: 'general', KEY_TEXT: 'First'},
+            {KEY_CHANNEL: 'general', KEY_TEXT: 'Second', KEY_ATTACHMENTS: [{KEY_TEXT: 'Details', KEY_PRETEXT: 'Note'}]},
+            {KEY_CHANNEL: 'general', KEY_TEXT: 'Third'},
+            {KEY_CHANNEL: 'random', KEY_TEXT: 'Fourth'},
+        ])
+
+        self.assertEqual(len(merged), 2)
+        self.assertEqual(merged[0][KEY_TEXT], 'First')
+        self.assertEqual(merged[0][KEY_ATTACHMENTS], [
+            {KEY_TEXT: 'Details', KEY_PRETEXT: 'Second\nNote', KEY_MRKDWN_IN: [KEY_PRETEXT]},
+            {KEY_PRETEXT: 'Third', KEY_MRKDWN_IN: [KEY_PRETEXT]},
+        ])
+        self.assertEqual(merged[1], {KEY_CHANNEL: 'random', KEY_TEXT: 'Fourth', KEY_ATTACHMENTS: []})
+
+    def test_merged_messages_are_capped_by_attachments(self):
+        merged = merge_slack_messages([
+            {KEY_CHANNEL: 'general', KEY_ATTACHMENTS: [{KEY_TEXT: 'Attachment {}'.format(idx)}]}
+            for idx in range(SLACK_DELIVERY_MAX_ATTACHMENTS + 1)
+        ])
+
+        self.assertEqual(len(merged), 2)
+        self.assertEqual(len(merged[0][KEY_ATTACHMENTS]), SLACK_DELIVERY_MAX_ATTACHMENTS)
+        self.assertEqual(
+            merged[1][KEY_ATTACHMENTS], [{KEY_TEXT: 'Attachment {}'.format(SLACK_DELIVERY_MAX_ATTACHMENTS)}]
+        )
+
+
+class SendQueuedHubspotEngagementsTestCase(TestCase):
+
+    def setUp(self):
+        self.sent_payloads = []
+        self.claimed = []
+        self.create_hubspot_engagement = hubspot_utils.create_hubspot_engagement
+        self.get_cached_hubspot_contact_vids = hubspot_utils.get_cached_hubspot_contact_vids
+        hubspot_utils.create_hubspot_engagement = self.fake_create_hubspot_engagement
+        hubspot_utils.get_cached_hubspot_contact_vids = lambda emails: dict()
+
+    def tearDown(self):
+        hubspot_utils.create_hubspot_engagement = self.create_hubspot_engagement
+        hubspot_utils.get_cached_hubspot_contact_vids = self.get_cached_hubspot_contact_vids
+
+    def fake_create_hubspot_engagement(self, from_email, to_emails, subject, body, **kwargs):
+        self.sent_payloads.append(subject)
+        # The engagement must already be claimed while it's being sent
+        engagement = HubspotEngagement.objects.get(subject=subject)
+        self.claimed.append(engagement.next_attempt_at > datetime.datetime.utcnow())
+        if subject == 'Accepted':
+            return dict(engagement=dict(id=42))
+        return None
+
+    def create_engagement(self, subject, **kwargs):
+        return HubspotEngagement.objects.create(
+            subject=subject, payload=json.dumps(dict(
+                from_email='hello@tunga.io', to_emails=['client@example.com'], subject=subject, body='Body'
+            )), **kwargs
+        )
+
+    def test_due_engagements_are_claimed_and_sent(self):
+        accepted = self.create_engagement('Accepted')
+        self.create_engagement('Later', next_attempt_at=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+
+        self.assertEqual(send_queued_hubspot_engagements(), (1, 0, 0))
+        self.assertEqual(self.sent_payloads, ['Accepted'])
+        self.assertEqual(self.claimed, [True])
+
+        accepted = HubspotEngagement.objects.get(id=accepted.id)
+        self.assertEqual(accepted.status, STATUS_COMPLETED)
+        self.assertEqual(accepted.engagement_id, '42')
+        self.assertEqual(accepted.attempts, 1)
+
+        # Completed engagements aren't sent again
+        self.assertEqual(send_queued_hubspot_engagements(), (0, 0, 0))
+
+    def test_rejected_engagements_are_retried_with_backoff(self):
+        rejected = self.create_engagement('Rejected', attempts=2)
+
+        before = datetime.datetime.utcnow()
+        self.assertEqual(send_queued_hubspot_engagements(), (0, 1, 0))
+
+        rejected = HubspotEngagement.objects.get(id=rejected.id)
+        self.assertEqual(rejected.status, STATUS_PENDING)
+        self.assertEqual(rejected.attempts, 3)
+        self.assertTrue(rejected.last_error)
+        self.assertGreaterEqual(rejected.next_attempt_at, before + datetime.timedelta(minutes=8))
+
+        # Not due again until the backoff passes
+        self.assertEqual(send_queued_hubspot_engagements(), (0, 0, 0))
+
+    def test_engagements_fail_after_max_attempts(self):
+        rejected = self.create_engagement('Rejected', attempts=HUBSPOT_ENGAGEMENT_MAX_ATTEMPTS - 1)
+        invalid = HubspotEngagement.objects.create(subject='Invalid', payload='{')
+
+        self.assertEqual(send_queued_hubspot_engagements(), (0, 0, 2))
+        self.assertEqual(self.sent_payloads, ['Rejected'])
+
+        for engagement in HubspotEngagement.objects.filter(id__in=[rejected.id, invalid.id]):
+            self.assertEqual(engagement.status, STATUS_FAILED)
+            self.assertTrue(engagement.last_error)
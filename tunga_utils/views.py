@@ -6,8 +6,8 @@ from operator import itemgetter
 
 import requests
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.files.storage import FileSystemStorage
-from django.http import HttpResponse
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.http import HttpResponse, JsonResponse, FileResponse
 from django.utils import six
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, generics, status
@@ -23,9 +23,11 @@ from tunga_projects.models import Project, ProgressEvent
 from tunga_projects.serializers import SimpleProjectSerializer, SimpleProgressEventSerializer
 from tunga_projects.utils import weekly_project_report, weekly_payment_report
 from tunga_tasks.renderers import PDFRenderer
-from tunga_utils.constants import EVENT_SOURCE_HUBSPOT
+from tunga_utils.constants import EVENT_SOURCE_HUBSPOT, STATUS_COMPLETED
 from tunga_utils.models import ContactRequest, InviteRequest, ExternalEvent, SearchEvent
 from tunga_utils.notifications.slack import notify_new_calendly_event
+from tunga_utils.pdf_utils import enqueue_pdf_job, get_pdf_job, get_pdf_job_details, can_access_pdf_job
+from tunga_utils.scheduler_utils import get_scheduler_status
 from tunga_utils.serializers import SkillSerializer, ContactRequestSerializer, InviteRequestSerializer
 from tunga_utils.tasks import log_calendly_event_hubspot
 
@@ -132,6 +134,14 @@ def find_by_legacy_id(request, model, pk):
 @permission_classes([IsAdminUser])
 @renderer_classes([PDFRenderer, StaticHTMLRenderer])
 def weekly_report(request, subject):
+    if request.query_params.get('async', None) and request.accepted_renderer.format != 'html':
+        pdf_job = enqueue_pdf_job(
+            subject == 'payments' and 'tunga_projects.utils.weekly_payment_report' or
+            'tunga_projects.utils.weekly_project_report',
+            kwargs=dict(render_format='pdf'), admin_only=True
+        )
+        return JsonResponse(get_pdf_job_details(pdf_job), status=status.HTTP_202_ACCEPTED)
+
     if subject == 'payments':
         if request.accepted_renderer.format == 'html':
             return HttpResponse(weekly_payment_report(render_format='html'))
@@ -148,6 +158,37 @@ def weekly_report(request, subject):
             return http_response
 
 
+@api_view(http_method_names=['GET'])
+@permission_classes([IsAuthenticated])
+def pdf_job_status(request, job_id):
+    pdf_job = get_pdf_job(job_id)
+    if not can_access_pdf_job(request.user, pdf_job):
+        return Response(dict(message='PDF job not found'), status=status.HTTP_404_NOT_FOUND)
+    return Response(get_pdf_job_details(pdf_job))
+
+
+@api_view(http_method_names=['GET'])
+@permission_classes([IsAuthenticated])
+def pdf_job_download(request, job_id):
+    pdf_job = get_pdf_job(job_id)
+    if not can_access_pdf_job(request.user, pdf_job) or pdf_job['status'] != STATUS_COMPLETED:
+        return Response(dict(message='PDF not found'), status=status.HTTP_404_NOT_FOUND)
+    try:
+        pdf_file = default_storage.open(pdf_job['file'], 'rb')
+    except (IOError, KeyError):
+        return Response(dict(message='PDF not found'), status=status.HTTP_404_NOT_FOUND)
+    # Bulk results can be large, stream them instead of loading them into memory
+    http_response = FileResponse(pdf_file, content_type=pdf_job.get('content_type', 'application/pdf'))
+    http_response['Content-Disposition'] = 'filename="{}.{}"'.format(job_id, pdf_job.get('extension', 'pdf'))
+    return http_response
+
+
+@api_view(http_method_names=['GET'])
+@permission_classes([IsAdminUser])
+def scheduler_status(request):
+    return Response(dict(jobs=get_scheduler_status()))
+
+
 @csrf_exempt
 @api_view(http_method_names=['POST'])
 @permission_classes([AllowAny])